@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark de form_coerce.DeltaCoercer sobre deltas típicos del LLM.
+
+Cada caso lleva el delta "crudo" (como lo devolvería el modelo, con los errores
+de tipo habituales) y el esperado tras la coerción. Verifica el resultado, mide
+µs por delta y muestra las reparaciones contadas por campo.
+
+Uso:
+    python bench_form_coerce.py
+    python bench_form_coerce.py --repeat 20000
+"""
+
+import argparse
+import json
+import time
+
+from constants import SCHEMA
+from form_coerce import DeltaCoercer, CoercionStats
+
+CASES = [
+    ("delta válido",
+     {"afiliacion": {"motivoConsulta": "fiebre"}, "anamnesis": {"sintomasPrincipales": ["tos"]}},
+     {"afiliacion": {"motivoConsulta": "fiebre"}, "anamnesis": {"sintomasPrincipales": ["tos"]}}),
+    ("signos como texto",
+     {"examenClinico": {"signosVitales": {"temperatura": "38°C", "SpO2": "98 %", "FC": "noventa y dos"}}},
+     {"examenClinico": {"signosVitales": {"temperatura": 38, "SpO2": 98, "FC": 92}}}),
+    ("enums hablados",
+     {"afiliacion": {"sexo": "M"}, "diagnosticos": [{"nombre": "Faringitis", "tipo": "Probable"}]},
+     {"afiliacion": {"sexo": "masculino"}, "diagnosticos": [{"nombre": "Faringitis", "tipo": "presuntivo"}]}),
+    ("claves inventadas",
+     {"afiliacion": {"telefono": "999", "edad": {"anios": "35 años"}}, "observaciones": "ninguna"},
+     {"afiliacion": {"edad": {"anios": 35}}}),
+    ("página de documento",
+     {
+         "afiliacion": {"nombreCompleto": "Ana Pérez", "sexo": "F", "dni": 40123456, "edad": {"anios": 29, "meses": 0}},
+         "anamnesis": {"sintomasPrincipales": "cefalea", "alergias": ["", "penicilina"]},
+         "examenClinico": {"signosVitales": {"PA": "110/70", "temperatura": "36,8", "peso": "62 kg"}},
+         "diagnosticos": [{"nombre": "Migraña", "cie10": "G43.9", "tipo": "Definitivo"}],
+         "tratamientos": [{"medicamento": "ibuprofeno", "dosisIndicacion": "400 mg c/8h", "via": "oral"}],
+     },
+     {
+         "afiliacion": {"nombreCompleto": "Ana Pérez", "sexo": "femenino", "dni": "40123456", "edad": {"anios": 29, "meses": 0}},
+         "anamnesis": {"sintomasPrincipales": ["cefalea"], "alergias": ["penicilina"]},
+         "examenClinico": {"signosVitales": {"PA": "110/70", "temperatura": 36.8, "peso": 62}},
+         "diagnosticos": [{"nombre": "Migraña", "cie10": "G43.9", "tipo": "definitivo"}],
+         "tratamientos": [{"medicamento": "ibuprofeno", "dosisIndicacion": "400 mg c/8h"}],
+     }),
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de DeltaCoercer")
+    parser.add_argument("--repeat", type=int, default=5000)
+    args = parser.parse_args()
+
+    stats = CoercionStats()
+    coercer = DeltaCoercer(SCHEMA, stats)
+    bare = DeltaCoercer(SCHEMA)  # sin contadores, para medir
+
+    print("=" * 60)
+    print(f"COERCIÓN DE DELTAS ({args.repeat} repeticiones)")
+    print("=" * 60)
+    print(f"{'caso':<24} {'µs/delta':>10} {'reparaciones':>14}")
+    print("-" * 60)
+    for name, raw, expected in CASES:
+        clean, repairs = coercer.coerce(raw)
+        assert clean == expected, (name, clean)
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            bare.coerce(raw)
+        elapsed = (time.perf_counter() - start) / args.repeat * 1e6
+        print(f"{name:<24} {elapsed:>10.1f} {len(repairs):>14}")
+
+    print()
+    print(json.dumps(stats.snapshot(), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
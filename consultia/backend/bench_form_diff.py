@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark del diff del formulario: _flatten + compute_deltas anterior vs
+form_diff.compute_deltas (con y sin el delta aplicado).
+
+Arma un formulario grande a partir de constants.SCHEMA (todas las hojas con
+valor, listas largas de síntomas / antecedentes / diagnósticos / tratamientos)
+y le aplica deltas típicos de un fragmento: un signo vital, un síntoma nuevo,
+un diagnóstico nuevo. Verifica que ambos digan lo mismo (salvo que el nuevo
+reporta los agregados a listas elemento por elemento) y compara tiempos.
+También compara deep_merge + diff contra FormMerger (mezcla y cambios en una pasada).
+
+Uso:
+    python bench_form_diff.py
+    python bench_form_diff.py --items 200 --repeat 2000
+"""
+
+import argparse
+import copy
+import time
+
+from constants import SCHEMA
+from form_diff import compute_deltas, split_append
+from form_merge import FormMerger
+
+
+# ---------- Implementación anterior (server.py) ----------
+
+def _flatten(d, prefix=""):
+    out = {}
+    if isinstance(d, dict):
+        for k, v in d.items():
+            out.update(_flatten(v, f"{prefix}.{k}" if prefix else k))
+    elif isinstance(d, list):
+        out[prefix] = d
+    else:
+        out[prefix] = d
+    return out
+
+
+def legacy_compute_deltas(prev: dict, curr: dict):
+    p = _flatten(prev); c = _flatten(curr)
+    changes = []
+    for path, val in c.items():
+        if path not in p or p[path] != val:
+            changes.append({"path": path, "value": val})
+    return changes
+
+
+def deep_merge(old: dict, new: dict) -> dict:
+    result = old.copy()
+    for k, v in new.items():
+        if isinstance(v, dict) and isinstance(result.get(k), dict):
+            result[k] = deep_merge(result[k], v)
+        else:
+            result[k] = v
+    return result
+
+
+# ---------- Datos ----------
+
+def filled_from_schema(schema: dict, items: int, path: str = ""):
+    t = schema.get("type")
+    if t == "object":
+        return {k: filled_from_schema(v, items, f"{path}.{k}") for k, v in schema.get("properties", {}).items()}
+    if t == "array":
+        item = schema.get("items", {})
+        return [filled_from_schema(item, items, f"{path}[{i}]") for i in range(items)]
+    if t in ("number", "integer"):
+        return 42
+    return f"valor de {path}"
+
+
+def scenarios(form: dict):
+    ana = form["anamnesis"]
+    return [
+        ("signo vital", {"examenClinico": {"signosVitales": {"FC": 96}}}),
+        ("síntoma nuevo", {"anamnesis": {"sintomasPrincipales": ana["sintomasPrincipales"] + ["tos seca"]}}),
+        ("diagnóstico nuevo", {"diagnosticos": form["diagnosticos"] + [{"nombre": "Faringitis", "tipo": "presuntivo", "cie10": "J02.9"}]}),
+        ("varias secciones", {
+            "afiliacion": {"motivoConsulta": "fiebre y tos"},
+            "examenClinico": {"signosVitales": {"temperatura": 38.5, "PA": "120/80"}},
+            "anamnesis": {"alergias": ana["alergias"] + ["penicilina"]},
+        }),
+    ]
+
+
+def normalize(changes):
+    """Agrupa los agregados "<lista>.-" como la lista completa (formato anterior)."""
+    out = {}
+    for ch in changes:
+        path, append = split_append(ch["path"])
+        if append:
+            out.setdefault(path, ("append", []))[1].append(ch["value"])
+        else:
+            out[path] = ("set", ch["value"])
+    return out
+
+
+def timeit(fn, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de compute_deltas")
+    parser.add_argument("--items", type=int, default=50, help="elementos por lista del formulario")
+    parser.add_argument("--repeat", type=int, default=1000)
+    args = parser.parse_args()
+
+    form = filled_from_schema(SCHEMA, args.items)
+    print("=" * 84)
+    print(f"DIFF DEL FORMULARIO ({args.items} elementos por lista, {args.repeat} repeticiones)")
+    print("=" * 84)
+    print(f"{'escenario':<20} {'anterior µs':>12} {'nuevo µs':>10} {'+delta µs':>10} {'x':>6} {'cambios':>14}")
+    print("-" * 84)
+    for name, delta in scenarios(form):
+        prev = copy.deepcopy(form)
+        curr = deep_merge(prev, delta)
+        old = legacy_compute_deltas(prev, curr)
+        new_full = compute_deltas(prev, curr)
+        new_delta = compute_deltas(prev, curr, delta)
+        assert normalize(new_full) == normalize(new_delta)
+        # Mismo conjunto de rutas; las listas que solo crecieron van elemento por elemento
+        old_paths = {c["path"]: c["value"] for c in old}
+        for path, (kind, value) in normalize(new_full).items():
+            if kind == "set":
+                assert old_paths.pop(path) == value, path
+            else:
+                assert old_paths.pop(path)[-len(value):] == value, path
+        assert not old_paths, old_paths
+
+        t_old = timeit(lambda: legacy_compute_deltas(prev, curr), args.repeat)
+        t_full = timeit(lambda: compute_deltas(prev, curr), args.repeat)
+        t_delta = timeit(lambda: compute_deltas(prev, curr, delta), args.repeat)
+        print(
+            f"{name:<20} {t_old:>12.1f} {t_full:>10.1f} {t_delta:>10.2f} {t_old / t_delta:>6.0f} "
+            f"{len(old):>5} → {len(new_delta):<5}"
+        )
+
+    merger = FormMerger(SCHEMA)
+    print()
+    print(f"{'mezcla + diff':<20} {'anterior µs':>12} {'merger µs':>10} {'x':>6}")
+    print("-" * 52)
+    for name, delta in scenarios(form):
+        prev = copy.deepcopy(form)
+        t_old = timeit(lambda: legacy_compute_deltas(prev, deep_merge(prev, delta)), args.repeat)
+        t_new = timeit(lambda: merger.merge(prev, delta), args.repeat)
+        print(f"{name:<20} {t_old:>12.1f} {t_new:>10.1f} {t_old / t_new:>6.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Benchmark del preprocesamiento de imágenes de /extract-document (image_prep.py).
+
+Reporta por muestra: bytes del archivo y del base64 enviado, tokens de imagen
+(según el reescalado de detail="high") antes/después, ángulo corregido y tiempo.
+
+Sin argumentos genera muestras sintéticas (foto de celular de una hoja impresa,
+rotada, sobre fondo). Con un directorio usa sus imágenes; si junto a una imagen
+existe <nombre>.json con los datos esperados y se pasa --extract, llama a la
+Vision API con la imagen original y con la preprocesada y compara los campos
+extraídos (requiere OPENAI_API_KEY).
+
+Uso:
+    python bench_image_prep.py
+    python bench_image_prep.py muestras/ --extract
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from image_prep import preprocess_image, vision_tokens
+
+LINES = [
+    "HISTORIA CLINICA - CONSULTA EXTERNA",
+    "Paciente: Juan Perez Gomez    DNI: 45879632",
+    "Edad: 45 anos   Sexo: masculino   Grupo: O+",
+    "Motivo de consulta: dolor de garganta y fiebre",
+    "PA 120/80  FC 88  FR 18  T 38.5  SpO2 97%",
+    "Dx: Faringitis aguda (J02.9) - presuntivo",
+    "Tto: Amoxicilina 500 mg c/8h por 7 dias",
+    "Paracetamol 500 mg c/8h si fiebre",
+]
+
+
+def synthetic_sample(seed: int) -> bytes:
+    """Foto simulada: hoja con texto, rotada, sobre un fondo de mesa, JPEG de celular."""
+    rnd = random.Random(seed)
+    page = Image.new("RGB", (2480, 3508), (248, 246, 240))
+    draw = ImageDraw.Draw(page)
+    try:
+        font = ImageFont.load_default(size=56)
+    except TypeError:
+        font = ImageFont.load_default()
+    y = 250
+    for _ in range(4):
+        for line in LINES:
+            draw.text((200, y), line, fill=(25, 25, 30), font=font)
+            y += 95
+    photo = Image.new("RGB", (3024, 4032), (110 + rnd.randint(0, 30), 80, 60))
+    page = page.rotate(rnd.uniform(-4, 4), expand=True, fillcolor=(110, 80, 60))
+    page.thumbnail((2800, 3800))
+    photo.paste(page, ((photo.width - page.width) // 2, (photo.height - page.height) // 2))
+    out = io.BytesIO()
+    photo.save(out, format="JPEG", quality=95)
+    return out.getvalue()
+
+
+def load_samples(directory: str):
+    if not directory:
+        return [(f"sintetica-{i}", synthetic_sample(i), None) for i in range(3)]
+    samples = []
+    for name in sorted(os.listdir(directory)):
+        if not name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            continue
+        with open(os.path.join(directory, name), "rb") as f:
+            data = f.read()
+        expected = None
+        exp_path = os.path.join(directory, os.path.splitext(name)[0] + ".json")
+        if os.path.exists(exp_path):
+            with open(exp_path, "r", encoding="utf-8") as f:
+                expected = json.load(f)
+        samples.append((name, data, expected))
+    return samples
+
+
+def flatten(d, prefix=""):
+    out = {}
+    if isinstance(d, dict):
+        for k, v in d.items():
+            out.update(flatten(v, f"{prefix}.{k}" if prefix else k))
+    elif isinstance(d, list):
+        out[prefix] = json.dumps(d, sort_keys=True, ensure_ascii=False).lower()
+    elif d not in (None, ""):
+        out[prefix] = str(d).strip().lower()
+    return out
+
+
+def field_accuracy(expected: dict, got: dict) -> float:
+    exp, res = flatten(expected), flatten(got)
+    return sum(1 for k, v in exp.items() if res.get(k) == v) / len(exp) if exp else 1.0
+
+
+async def compare_extraction(samples):
+    from server import extract_page  # importa FastAPI/OpenAI solo si se pide
+
+    print()
+    print(f"{'muestra':<24} {'original':>9} {'preproc.':>9}")
+    print("-" * 46)
+    for name, data, expected in samples:
+        if expected is None:
+            continue
+        mime = "image/png" if name.lower().endswith(".png") else "image/jpeg"
+        raw = await extract_page(data, mime)
+        prepped, prepped_mime, _ = preprocess_image(data)
+        pre = await extract_page(prepped, prepped_mime)
+        print(f"{name:<24} {field_accuracy(expected, raw):>8.0%} {field_accuracy(expected, pre):>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de image_prep.py")
+    parser.add_argument("directory", nargs="?", default="", help="carpeta con imágenes (+ <nombre>.json esperado)")
+    parser.add_argument("--extract", action="store_true", help="comparar la extracción con la Vision API")
+    parser.add_argument("--format", default="JPEG", help="JPEG | WEBP | PNG")
+    parser.add_argument("--max-tiles", type=int, default=0)
+    args = parser.parse_args()
+
+    samples = load_samples(args.directory)
+    print("=" * 96)
+    print("PREPROCESAMIENTO DE IMÁGENES (detail=high)")
+    print("=" * 96)
+    print(f"{'muestra':<24} {'bytes':>10} {'→':>2} {'bytes':>9} {'b64 ahorro':>11} {'tokens':>7} {'→':>2} {'tokens':>6} {'ángulo':>7} {'ms':>7}")
+    print("-" * 96)
+    tot_in = tot_out = tok_in = tok_out = 0
+    for name, data, _ in samples:
+        start = time.perf_counter()
+        out, _, info = preprocess_image(data, fmt=args.format, max_tiles=args.max_tiles)
+        ms = (time.perf_counter() - start) * 1000
+        b64_in, b64_out = len(base64.b64encode(data)), len(base64.b64encode(out))
+        with Image.open(io.BytesIO(data)) as img:
+            tokens_in = vision_tokens(*img.size)
+        tot_in += b64_in
+        tot_out += b64_out
+        tok_in += tokens_in
+        tok_out += info["tokens_after"]
+        print(
+            f"{name[:24]:<24} {len(data):>10} {'→':>2} {len(out):>9} {1 - b64_out / b64_in:>10.0%} "
+            f"{tokens_in:>7} {'→':>2} {info['tokens_after']:>6} {info['angle']:>7.1f} {ms:>7.0f}"
+        )
+    print("-" * 96)
+    if samples:
+        print(f"Payload base64: {tot_in / 1e6:.2f} MB → {tot_out / 1e6:.2f} MB  ({1 - tot_out / tot_in:.0%} menos)")
+        print(f"Tokens de imagen: {tok_in} → {tok_out}  ({1 - tok_out / tok_in:.0%} menos)")
+
+    if args.extract:
+        asyncio.run(compare_extraction(samples))
+
+
+if __name__ == "__main__":
+    main()
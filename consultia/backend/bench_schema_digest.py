@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Benchmark del digest compacto del schema: compara el tamaño (chars y tokens) de
+los prompts con el JSON Schema completo vs el digest de schema_digest.py.
+
+Usa tiktoken si está instalado; si no, estima tokens como chars / 4.
+
+Uso:
+    python bench_schema_digest.py
+"""
+
+import time
+
+from prompts import schema_block, delta_system_prompt, combined_system_prompt, form_system_prompt
+from schema_digest import SCHEMA_DIGEST, SchemaDigest
+from constants import SCHEMA
+
+try:
+    import tiktoken
+    _enc = tiktoken.get_encoding("o200k_base")
+
+    def count_tokens(text: str) -> int:
+        return len(_enc.encode(text))
+
+    TOKENIZER = "tiktoken o200k_base"
+except ImportError:
+    def count_tokens(text: str) -> int:
+        return len(text) // 4
+
+    TOKENIZER = "estimado (chars / 4)"
+
+
+def row(label: str, full: str, compact: str):
+    tf, tc = count_tokens(full), count_tokens(compact)
+    saved = 100 * (1 - tc / tf) if tf else 0
+    print(f"{label:<28} {tf:>8} {tc:>8} {saved:>8.1f}%")
+
+
+print("=" * 60)
+print(f"DIGEST DE SCHEMA  (tokens: {TOKENIZER})")
+print("=" * 60)
+
+start = time.perf_counter()
+SchemaDigest(SCHEMA)
+print(f"Compilación del digest: {(time.perf_counter() - start) * 1000:.2f} ms")
+print()
+print(f"{'prompt':<28} {'full':>8} {'compact':>8} {'ahorro':>9}")
+print("-" * 60)
+row("schema", schema_block("full"), schema_block("compact"))
+row("form_system_prompt", form_system_prompt("full"), form_system_prompt("compact"))
+row("delta_system_prompt", delta_system_prompt("full"), delta_system_prompt("compact"))
+row("combined_system_prompt", combined_system_prompt("full"), combined_system_prompt("compact"))
+
+print()
+print("Por sección (subset de una sola sección):")
+print("-" * 60)
+for section in SCHEMA_DIGEST.sections:
+    row(f"  {section}", schema_block("full", (section,)), schema_block("compact", (section,)))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memoria de las subidas a /extract-document (uploads.py).
+
+Simula N subidas simultáneas de una foto de celular y mide el RSS del proceso
+para dos caminos, cada uno en un subproceso limpio:
+
+  legacy   → await file.read() entero, preprocesado desde bytes, getvalue(),
+             b64encode().decode() y f-string del data URL (todo vivo durante la llamada)
+  spooled  → hash en bloques del temporal de Starlette en su lugar (hash_upload),
+             Pillow lee de ese mismo temporal, image_data_url sin copias intermedias
+
+El trabajo de CPU (copia, decodificación, codificación) pasa por un semáforo de
+--workers, como DOCUMENT_EXECUTOR; luego las N subidas esperan juntas (barrera)
+con su data URL armado, como mientras esperan la respuesta de la Vision API.
+Reporta el pico de RSS y el RSS retenido durante esa espera, por subida.
+No llama a OpenAI ni necesita el servidor.
+
+Uso:
+    python bench_upload_rss.py
+    python bench_upload_rss.py --uploads 32 --workers 4 --no-preprocess
+    python bench_upload_rss.py --sample foto.jpg
+"""
+
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from bench_image_prep import synthetic_sample
+from image_prep import preprocess_image
+from uploads import current_rss_kb, hash_upload, image_data_url, peak_rss_kb, upload_hasher
+
+MODES = ("legacy", "spooled")
+
+
+def noisy_sample(path: str) -> None:
+    """Foto sintética con ruido de sensor: pesa como una foto real de celular (varios MB)."""
+    photo = Image.open(io.BytesIO(synthetic_sample(0)))
+    noise = Image.effect_noise(photo.size, 24).convert("RGB")
+    Image.blend(photo, noise, 0.12).save(path, format="JPEG", quality=92)
+
+
+def upload_file(data: bytes):
+    """Como UploadFile.file de Starlette: SpooledTemporaryFile de 1 MB en RAM."""
+    f = tempfile.SpooledTemporaryFile(max_size=1024 * 1024)
+    f.write(data)
+    f.seek(0)
+    return f
+
+
+def legacy(src, preprocess: bool, pool: threading.Semaphore, barrier: threading.Barrier) -> int:
+    contents = src.read()
+    hashlib.sha256(contents).hexdigest()
+    with pool:
+        if preprocess:
+            data, mime, _ = preprocess_image(contents)
+            data = bytes(data)  # getvalue()
+        else:
+            data, mime = contents, "image/jpeg"
+    base64_image = base64.b64encode(data).decode("utf-8")
+    url = f"data:{mime};base64,{base64_image}"
+    barrier.wait()
+    return len(url)
+
+
+def spooled(src, preprocess: bool, pool: threading.Semaphore, barrier: threading.Barrier) -> int:
+    with pool:
+        hasher = upload_hasher()
+        hash_upload(src, 0, hasher)
+        hasher.hexdigest()
+        with src as upload:
+            if preprocess:
+                data, mime, _ = preprocess_image(upload)
+            else:
+                data, mime = upload.read(), "image/jpeg"
+        url = image_data_url(data, mime)
+        del data
+    barrier.wait()
+    return len(url)
+
+
+def worker(mode: str, sample_path: str, uploads: int, workers: int, preprocess: bool) -> dict:
+    with open(sample_path, "rb") as f:
+        sample = f.read()
+    sources = [upload_file(sample) for _ in range(uploads)]
+    del sample
+    # Reinicia VmHWM al RSS actual: el pico medido es solo el de las subidas
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+    baseline = current_rss_kb() or peak_rss_kb()
+    fn = legacy if mode == "legacy" else spooled
+    pool = threading.Semaphore(workers)
+    retained = []
+    # Cuando todas terminaron de preparar su imagen: RSS mientras "esperan a la API"
+    barrier = threading.Barrier(uploads, action=lambda: retained.append(current_rss_kb()))
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=uploads) as threads:
+        sizes = list(threads.map(lambda s: fn(s, preprocess, pool, barrier), sources))
+    elapsed = time.perf_counter() - start
+    peak = peak_rss_kb()
+    return {
+        "mode": mode,
+        "baseline_kb": baseline,
+        "peak_kb": peak,
+        "retained_kb": retained[0],
+        "per_upload_kb": (peak - baseline) / uploads,
+        "retained_per_upload_kb": (retained[0] - baseline) / uploads,
+        "upload_bytes": os.path.getsize(sample_path),
+        "payload_bytes": sizes[0],
+        "seconds": elapsed,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pico de RSS por subida (legacy vs spooled)")
+    parser.add_argument("--uploads", type=int, default=16, help="subidas simultáneas")
+    parser.add_argument("--workers", type=int, default=4, help="hilos de CPU (DOCUMENT_WORKERS)")
+    parser.add_argument("--no-preprocess", action="store_true", help="enviar la foto original (DOCUMENT_PREPROCESS=0)")
+    parser.add_argument("--sample", default="", help="imagen a subir (por defecto una foto sintética)")
+    parser.add_argument("--worker", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(worker(args.worker, args.sample, args.uploads, args.workers, not args.no_preprocess)))
+        return
+
+    # La muestra se genera aquí: los subprocesos arrancan con el pico de RSS bajo
+    sample = args.sample
+    if not sample:
+        sample = os.path.join(tempfile.gettempdir(), "bench_upload_rss.jpg")
+        noisy_sample(sample)
+
+    print("=" * 72)
+    print(f"SUBIDAS: {args.uploads} simultáneas, {args.workers} workers  archivo={os.path.getsize(sample) / 1e6:.1f} MB  "
+          f"preprocesado={'no' if args.no_preprocess else 'sí'}")
+    print("=" * 72)
+    print(f"{'camino':<10} {'base MB':>8} {'pico MB':>8} {'pico/subida':>12} {'retenido/subida':>16} {'payload KB':>11} {'s':>6}")
+    print("-" * 72)
+    results = {}
+    for mode in MODES:
+        cmd = [sys.executable, __file__, "--worker", mode, "--sample", sample, "--uploads", str(args.uploads), "--workers", str(args.workers)]
+        if args.no_preprocess:
+            cmd.append("--no-preprocess")
+        r = json.loads(subprocess.run(cmd, check=True, capture_output=True, text=True).stdout)
+        results[mode] = r
+        print(
+            f"{mode:<10} {r['baseline_kb'] / 1024:>8.1f} {r['peak_kb'] / 1024:>8.1f} "
+            f"{r['per_upload_kb'] / 1024:>9.1f} MB {r['retained_per_upload_kb'] / 1024:>13.1f} MB "
+            f"{r['payload_bytes'] / 1024:>11.0f} {r['seconds']:>6.2f}"
+        )
+    print("-" * 72)
+    for key, label in (("per_upload_kb", "Pico por subida"), ("retained_per_upload_kb", "Retenido por subida")):
+        old, new = results["legacy"][key], results["spooled"][key]
+        if old > 0:
+            print(f"{label}: {old / 1024:.1f} MB → {new / 1024:.1f} MB  ({1 - new / old:.0%} menos)")
+
+
+if __name__ == "__main__":
+    main()
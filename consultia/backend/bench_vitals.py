@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Corpus y benchmark del pre-extractor de signos vitales (vitals.py).
+
+Para cada fragmento compara el delta extraído y la cobertura (si se omitiría
+el LLM) contra lo esperado, y mide el tiempo por fragmento.
+
+Uso:
+    python bench_vitals.py
+"""
+
+import sys
+import time
+
+from vitals import extract_vitals, VitalsStats
+
+SV = "examenClinico.signosVitales."
+
+# (fragmento, campos esperados {path: valor}, ¿cubierto por completo?)
+CORPUS = [
+    ("presión 120 sobre 80", {SV + "PA": "120/80"}, True),
+    ("temperatura treinta y ocho grados", {SV + "temperatura": 38}, True),
+    ("presión arterial de ciento treinta sobre noventa", {SV + "PA": "130/90"}, True),
+    ("PA 110/70 mmHg", {SV + "PA": "110/70"}, True),
+    ("frecuencia cardíaca 88 por minuto", {SV + "FC": 88}, True),
+    ("pulso de noventa y dos", {SV + "FC": 92}, True),
+    ("tiene 76 latidos por minuto", {SV + "FC": 76}, True),
+    ("frecuencia respiratoria dieciocho", {SV + "FR": 18}, True),
+    ("FR 22 respiraciones por minuto", {SV + "FR": 22}, True),
+    ("saturación 97%", {SV + "SpO2": 97}, True),
+    ("saturando al noventa y cinco por ciento", {SV + "SpO2": 95}, True),
+    ("SpO2 de 99", {SV + "SpO2": 99}, True),
+    ("temperatura 38,5", {SV + "temperatura": 38.5}, True),
+    ("treinta y siete punto dos grados", {SV + "temperatura": 37.2}, True),
+    ("fiebre de 39 grados", {SV + "temperatura": 39}, True),
+    ("peso 72 kilos", {SV + "peso": 72}, True),
+    ("pesa setenta y cinco kilogramos", {SV + "peso": 75}, True),
+    ("talla 1.68 metros", {SV + "talla": 168}, True),
+    ("mide uno setenta", {SV + "talla": 170}, True),
+    ("estatura de 165 centímetros", {SV + "talla": 165}, True),
+    ("Glasgow 15 sobre 15", {SV + "glasgow": 15}, True),
+    ("paciente de 45 años", {"afiliacion.edad.anios": 45}, True),
+    ("paciente de dos años y tres meses", {"afiliacion.edad.anios": 2, "afiliacion.edad.meses": 3}, True),
+    ("edad 8 meses", {"afiliacion.edad.meses": 8}, True),
+    ("varón de 60 años de edad", {"afiliacion.edad.anios": 60}, True),
+    ("edad de cuarenta y cinco años", {"afiliacion.edad.anios": 45}, True),
+    (
+        "signos vitales: presión 120 sobre 80, frecuencia cardíaca 80, frecuencia respiratoria 16, "
+        "saturación 98 por ciento, temperatura 36.8",
+        {SV + "PA": "120/80", SV + "FC": 80, SV + "FR": 16, SV + "SpO2": 98, SV + "temperatura": 36.8},
+        True,
+    ),
+    ("peso 60 kg talla 1.60", {SV + "peso": 60, SV + "talla": 160}, True),
+    # Con información adicional: se extrae lo numérico pero el LLM sigue siendo necesario
+    ("fiebre de 39 desde hace tres días con tos", {SV + "temperatura": 39}, False),
+    ("presión 140 sobre 90, refiere cefalea intensa", {SV + "PA": "140/90"}, False),
+    ("paciente de 30 años acude por dolor abdominal", {"afiliacion.edad.anios": 30}, False),
+    # Sin signos vitales
+    ("dolor desde hace 3 años en la rodilla", {}, False),
+    # Duraciones que no son la edad
+    ("tiene cinco años con diabetes", {}, False),
+    ("tiene 3 meses de evolución con dolor lumbar", {}, False),
+    ("la paciente tiene 2 meses de embarazo", {}, False),
+    ("hipertenso desde hace 10 años, tiene 2 años sin control", {}, False),
+    ("indico paracetamol 500 mg cada 8 horas", {}, False),
+    ("refiere tos seca", {}, False),
+    ("amoxicilina por 7 días", {}, False),
+    # Valores fuera de rango: se descartan
+    ("temperatura 380", {}, False),
+    ("saturación 150", {}, False),
+]
+
+
+def flatten(d, prefix=""):
+    out = {}
+    for k, v in d.items():
+        path = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            out.update(flatten(v, path))
+        else:
+            out[path] = v
+    return out
+
+
+stats = VitalsStats()
+failures = 0
+for fragment, expected, covered in CORPUS:
+    result = extract_vitals(fragment)
+    stats.record(result)
+    got = flatten(result.delta)
+    if got != expected or result.covered != covered:
+        failures += 1
+        print(f"FALLO: {fragment!r}\n  esperado={expected} cubierto={covered}\n  obtenido={got} cubierto={result.covered}")
+
+rounds = 200
+start = time.perf_counter()
+for _ in range(rounds):
+    for fragment, _, _ in CORPUS:
+        extract_vitals(fragment)
+per_fragment_us = (time.perf_counter() - start) / (rounds * len(CORPUS)) * 1e6
+
+snap = stats.snapshot()
+print("=" * 60)
+print("PRE-EXTRACTOR DE SIGNOS VITALES")
+print("=" * 60)
+print(f"Fragmentos:           {len(CORPUS)}")
+print(f"Correctos:            {len(CORPUS) - failures}/{len(CORPUS)}")
+print(f"Con algún campo:      {snap['hits']}  (hit rate {snap['hit_rate']:.0%})")
+print(f"Sin LLM (cubiertos):  {snap['covered']}  ({snap['llm_skip_rate']:.0%})")
+print(f"Tiempo por fragmento: {per_fragment_us:.1f} µs")
+sys.exit(1 if failures else 0)
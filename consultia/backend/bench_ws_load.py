@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Benchmark de carga para /ws: abre N sesiones concurrentes y mide cuánto tarda
+cada una en recibir su primer form_update.
+
+Si las llamadas a OpenAI bloquean el event loop, las sesiones se serializan y el
+tiempo total crece ~N × (latencia de una sesión). Con la capa async (llm.py) el
+tiempo total debe quedar cerca de la latencia de la sesión más lenta.
+
+Uso (con el servidor corriendo):
+    python bench_ws_load.py --url ws://localhost:8001/ws --sessions 10
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+import uuid
+
+import websockets
+
+FRAGMENT = "Paciente viene por fiebre desde hace dos días, tiene tos y dolor de cabeza"
+
+
+async def run_session(url: str, fragment: str, timeout: float) -> float:
+    session = f"bench-{uuid.uuid4().hex[:8]}"
+    async with websockets.connect(f"{url}?session={session}") as ws:
+        start = time.perf_counter()
+        await ws.send(json.dumps({"type": "final", "text": fragment}))
+        while True:
+            raw = await asyncio.wait_for(ws.recv(), timeout=timeout)
+            msg = json.loads(raw)
+            if msg.get("type") == "form_update":
+                return time.perf_counter() - start
+            if msg.get("type") == "error":
+                raise RuntimeError(msg.get("message"))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark de sesiones /ws concurrentes")
+    parser.add_argument("--url", default="ws://localhost:8001/ws")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--fragment", default=FRAGMENT)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    print("=" * 60)
+    print(f"BENCHMARK /ws: {args.sessions} sesiones concurrentes")
+    print("=" * 60)
+
+    # 1) Línea base: una sola sesión
+    single = await run_session(args.url, args.fragment, args.timeout)
+    print(f"✓ Sesión única: {single:.2f}s")
+
+    # 2) N sesiones en paralelo
+    wall_start = time.perf_counter()
+    results = await asyncio.gather(
+        *(run_session(args.url, args.fragment, args.timeout) for _ in range(args.sessions)),
+        return_exceptions=True,
+    )
+    wall = time.perf_counter() - wall_start
+
+    latencies = [r for r in results if isinstance(r, float)]
+    errors = [r for r in results if not isinstance(r, float)]
+
+    print("-" * 60)
+    print(f"Completadas: {len(latencies)}  Errores: {len(errors)}")
+    if latencies:
+        print(f"Latencia p50: {statistics.median(latencies):.2f}s  max: {max(latencies):.2f}s")
+        print(f"Tiempo total: {wall:.2f}s  (serializado sería ~{single * args.sessions:.2f}s)")
+        print(f"Factor de concurrencia: {sum(latencies) / wall:.1f}x")
+    for e in errors[:5]:
+        print(f"❌ {e}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+# completeness.py
+# Campos requeridos del formulario, compilados una vez (REQUIRED_KEYS + SCHEMA)
+#
+# compute_missing volvía a partir cada ruta de REQUIRED_KEYS y a recorrer el
+# formulario desde la raíz en cada update, y otra vez dentro de
+# generate_contextual_suggestions. Aquí:
+#   - RequiredRules compila las rutas una vez (validadas contra el schema) con un
+#     índice por prefijo: cada cambio de FormMerger ("a.b", "lista.-",
+#     "lista.<i>.campo") encuentra en O(profundidad) las reglas que puede afectar
+#   - Completeness (una por sesión, inmutable) guarda qué reglas faltan; update()
+#     solo re-evalúa las reglas tocadas por el cambio, así el costo por update no
+#     crece con la cantidad de reglas ni de conjuntos por especialidad
+#   - Porcentaje de completitud por sección (primer segmento de la ruta) para el
+#     form_update
+# Misma semántica que compute_missing: null, "" (o solo espacios) y [] faltan; si
+# la ruta atraviesa una lista basta con que la lista no esté vacía.
+
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Sequence, Tuple
+
+from form_diff import APPEND
+
+
+def _resolve(schema: Dict[str, Any], parts: Sequence[str]) -> bool:
+    """True si la ruta existe en el schema (una lista corta la verificación)."""
+    node = schema
+    for p in parts:
+        if node.get("type") == "array":
+            return True
+        props = node.get("properties")
+        if not isinstance(props, dict) or p not in props:
+            return False
+        node = props[p]
+    return True
+
+
+def _present(form: Any, parts: Sequence[str]) -> bool:
+    cur = form
+    for p in parts:
+        if isinstance(cur, list):
+            # lista no valida para seguir por clave
+            return len(cur) > 0
+        if not isinstance(cur, dict) or p not in cur:
+            return False
+        cur = cur[p]
+    if cur is None:
+        return False
+    if isinstance(cur, str):
+        return cur.strip() != ""
+    if isinstance(cur, list):
+        return len(cur) > 0
+    return True
+
+
+class Completeness:
+    """Reglas que faltan en un formulario (resultado de RequiredRules)."""
+
+    __slots__ = ("rules", "missing")
+
+    def __init__(self, rules: "RequiredRules", missing: FrozenSet[int]):
+        self.rules = rules
+        self.missing = missing
+
+    def missing_paths(self) -> List[str]:
+        """Rutas faltantes, en el orden de REQUIRED_KEYS."""
+        paths = self.rules.paths
+        return [paths[i] for i in sorted(self.missing)]
+
+    def sections(self) -> Dict[str, int]:
+        """{sección: % de requeridos completos (0-100)}."""
+        out = {}
+        for section, ids in self.rules.sections.items():
+            done = sum(1 for i in ids if i not in self.missing)
+            out[section] = round(100 * done / len(ids))
+        return out
+
+
+class RequiredRules:
+    """Conjunto de rutas requeridas compilado contra el schema.
+
+    Args:
+        required: Rutas con puntos ("afiliacion.motivoConsulta", "diagnosticos").
+        schema: constants.SCHEMA; una ruta que no existe en él es un error de
+            configuración (ValueError al arrancar, no un faltante eterno).
+    """
+
+    def __init__(self, required: Iterable[str], schema: Dict[str, Any]):
+        self.paths: Tuple[str, ...] = tuple(dict.fromkeys(required))
+        self._parts = [tuple(p.split(".")) for p in self.paths]
+        bad = [p for p, parts in zip(self.paths, self._parts) if not _resolve(schema, parts)]
+        if bad:
+            raise ValueError(f"Rutas requeridas fuera del schema: {', '.join(bad)}")
+
+        # Reglas en o debajo de cada prefijo, y reglas exactas por ruta
+        self._below: Dict[Tuple[str, ...], List[int]] = {}
+        self._exact: Dict[Tuple[str, ...], int] = {}
+        self.sections: Dict[str, List[int]] = {}
+        for i, parts in enumerate(self._parts):
+            for k in range(1, len(parts) + 1):
+                self._below.setdefault(parts[:k], []).append(i)
+            self._exact[parts] = i
+            self.sections.setdefault(parts[0], []).append(i)
+
+        self.evaluations = 0
+        self.updates = 0
+        self.rules_checked = 0
+
+    def evaluate(self, form: Dict[str, Any]) -> Completeness:
+        """Evaluación completa (snapshot, sesión restaurada, formulario nuevo)."""
+        self.evaluations += 1
+        self.rules_checked += len(self._parts)
+        return Completeness(self, frozenset(i for i, parts in enumerate(self._parts) if not _present(form, parts)))
+
+    def affected(self, path: str) -> List[int]:
+        """Reglas cuyo resultado puede cambiar por un cambio en `path`."""
+        parts = path.split(".")
+        out: List[int] = []
+        for k, segment in enumerate(parts):
+            if segment == APPEND or segment.isdigit():
+                # Dentro de una lista: toda regla que la atraviese depende de su largo
+                return out + self._below.get(tuple(parts[:k]), [])
+            if k + 1 < len(parts):
+                i = self._exact.get(tuple(parts[:k + 1]))
+                if i is not None:
+                    out.append(i)
+        return out + self._below.get(tuple(parts), [])
+
+    def update(self, prev: Completeness, form: Dict[str, Any], changes: Iterable[Dict[str, Any]]) -> Completeness:
+        """Completeness de `form` a partir de la anterior y los cambios de la mezcla.
+
+        Devuelve `prev` si ninguna regla cambió.
+        """
+        self.updates += 1
+        touched = set()
+        for ch in changes:
+            touched.update(self.affected(ch["path"]))
+        if not touched:
+            return prev
+        self.rules_checked += len(touched)
+        missing = set(prev.missing)
+        for i in touched:
+            if _present(form, self._parts[i]):
+                missing.discard(i)
+            else:
+                missing.add(i)
+        if missing == prev.missing:
+            return prev
+        return Completeness(self, frozenset(missing))
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "rules": len(self.paths),
+            "evaluations": self.evaluations,
+            "updates": self.updates,
+            "rules_checked": self.rules_checked,
+        }
+
+
+def build_rule_sets(
+    required: Sequence[str],
+    by_specialty: Optional[Dict[str, Sequence[str]]],
+    schema: Dict[str, Any],
+) -> Dict[str, RequiredRules]:
+    """{"": reglas base, especialidad: base + propias} compiladas una vez."""
+    rule_sets = {"": RequiredRules(required, schema)}
+    for name, extra in (by_specialty or {}).items():
+        rule_sets[name.lower()] = RequiredRules(list(required) + list(extra), schema)
+    return rule_sets
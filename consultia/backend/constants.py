@@ -1,4 +1,4 @@
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 # Reglas mínimas que exigiremos (puedes ajustar)
 REQUIRED_KEYS = [
@@ -8,6 +8,16 @@ REQUIRED_KEYS = [
     "tratamientos"
 ]
 
+# Requeridos extra por especialidad (se suman a REQUIRED_KEYS); la sesión la elige
+# con ?specialty= en el WebSocket. Las rutas deben existir en SCHEMA (ver completeness.py)
+REQUIRED_KEYS_BY_SPECIALTY: Dict[str, List[str]] = {
+    "pediatria": [
+        "afiliacion.edad.anios",
+        "examenClinico.signosVitales.peso",
+        "examenClinico.signosVitales.talla",
+    ],
+}
+
 # ------------------ Schema de Historia Clínica (alineado a tu PDF) ------------------
 SCHEMA: Dict[str, Any] = {
     "type": "object",
@@ -0,0 +1,204 @@
+# document_store.py
+# Resultados de /extract-document indexados por hash del contenido
+# - El mismo archivo subido varias veces no vuelve a pasar por pdf2image ni por
+#   la llamada de visión (la más cara): el JSON extraído se guarda en disco
+# - Desalojo por tamaño total del directorio (los menos usados primero; cada
+#   acierto actualiza el mtime)
+# - Subidas idénticas simultáneas comparten una única extracción en curso; los
+#   eventos de progreso (páginas terminadas) se reenvían a todos los que esperan,
+#   incluidos los que llegan tarde (se les repiten los eventos ya emitidos)
+
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class _Inflight:
+    """Extracción en curso: su task y los eventos de progreso emitidos hasta ahora."""
+
+    __slots__ = ("task", "events", "listeners")
+
+    def __init__(self):
+        self.task: Optional[asyncio.Task] = None
+        self.events: List[Any] = []
+        self.listeners: List[Callable[[Any], None]] = []
+
+    def publish(self, event: Any) -> None:
+        self.events.append(event)
+        for listener in list(self.listeners):
+            listener(event)
+
+    def subscribe(self, listener: Callable[[Any], None]) -> None:
+        for event in self.events:
+            listener(event)
+        self.listeners.append(listener)
+
+
+class DocumentStore:
+    """Índice hash → JSON extraído, en disco, con límite de tamaño.
+
+    Args:
+        directory: Carpeta de los resultados ("" = sin persistencia, solo coalescing).
+        max_bytes: Tamaño máximo total de la carpeta.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = 256 * 1024 * 1024):
+        self._dir = directory
+        self._max_bytes = max_bytes
+        self._index: Dict[str, Tuple[float, int]] = {}   # digest → (último uso, bytes)
+        self._total = 0
+        self._inflight: Dict[str, _Inflight] = {}
+
+        # Métricas
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evicted = 0
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            with os.scandir(directory) as it:
+                for e in it:
+                    if e.name.endswith(".json"):
+                        st = e.stat()
+                        self._index[e.name[:-5]] = (st.st_mtime, st.st_size)
+                        self._total += st.st_size
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self._dir, f"{digest}.json")
+
+    # ---------- Disco (se ejecuta en un thread; el índice solo se toca en el loop) ----------
+
+    def _read(self, digest: str) -> Optional[Any]:
+        path = self._path(digest)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return data
+
+    def _write(self, digest: str, data: Any) -> int:
+        path = self._path(digest)
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    def _remove(self, paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _evict(self) -> List[str]:
+        """Saca del índice los menos usados hasta volver al límite (en el event loop).
+
+        Devuelve los archivos a borrar; el borrado en sí va a un thread.
+        """
+        victims = []
+        for digest, (_, size) in sorted(self._index.items(), key=lambda kv: kv[1][0]):
+            if self._total <= self._max_bytes:
+                break
+            del self._index[digest]
+            self._total -= size
+            self.evicted += 1
+            victims.append(self._path(digest))
+        return victims
+
+    # ---------- API ----------
+
+    async def get(self, digest: str) -> Optional[Any]:
+        if not self._dir or digest not in self._index:
+            return None
+        data = await asyncio.to_thread(self._read, digest)
+        if data is None:
+            _, size = self._index.pop(digest)
+            self._total -= size
+            return None
+        self._index[digest] = (time.time(), self._index[digest][1])
+        return data
+
+    async def put(self, digest: str, data: Any) -> None:
+        if not self._dir:
+            return
+        try:
+            size = await asyncio.to_thread(self._write, digest, data)
+        except OSError:
+            logger.exception("[DOC-STORE] error escribiendo resultado")
+            return
+        _, old = self._index.get(digest, (0, 0))
+        self._index[digest] = (time.time(), size)
+        self._total += size - old
+        if self._total > self._max_bytes:
+            await asyncio.to_thread(self._remove, self._evict())
+
+    async def get_or_extract(
+        self,
+        digest: str,
+        extract: Callable[[Callable[[Any], None]], Awaitable[Any]],
+        listener: Optional[Callable[[Any], None]] = None,
+    ) -> Tuple[Any, str]:
+        """Resultado guardado, el de una extracción en curso, o uno nuevo.
+
+        Args:
+            extract: Recibe `publish(evento)` para emitir progreso y devuelve el resultado.
+            listener: Recibe (síncrono) cada evento de la extracción que se espera,
+                también los emitidos antes de llegar. Con un resultado guardado no hay eventos.
+
+        Returns:
+            (data, origen) — origen es "store", "coalesced" o "extracted".
+        """
+        data = await self.get(digest)
+        if data is not None:
+            self.hits += 1
+            return data, "store"
+
+        flight = self._inflight.get(digest)
+        if flight is not None:
+            self.coalesced += 1
+            return await self._wait(flight, listener), "coalesced"
+
+        self.misses += 1
+        # Task propio + shield: si el cliente que la inició se desconecta, la
+        # extracción sigue para los demás que esperan el mismo archivo
+        flight = _Inflight()
+        flight.task = asyncio.create_task(self._extract_and_store(digest, extract, flight.publish))
+        self._inflight[digest] = flight
+        flight.task.add_done_callback(lambda _: self._inflight.pop(digest, None))
+        return await self._wait(flight, listener), "extracted"
+
+    @staticmethod
+    async def _wait(flight: _Inflight, listener: Optional[Callable[[Any], None]]) -> Any:
+        if listener is None:
+            return await asyncio.shield(flight.task)
+        flight.subscribe(listener)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.listeners.remove(listener)
+
+    async def _extract_and_store(self, digest: str, extract, publish: Callable[[Any], None]) -> Any:
+        data = await extract(publish)
+        await self.put(digest, data)
+        return data
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "documents": len(self._index),
+            "bytes": self._total,
+            "max_bytes": self._max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evicted": self.evicted,
+            "inflight": len(self._inflight),
+        }
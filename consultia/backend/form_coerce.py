@@ -0,0 +1,258 @@
+# form_coerce.py
+# Validación y coerción local de los deltas del LLM contra constants.SCHEMA
+#
+# extract_form_delta / combined / la visión de documentos confiaban en el JSON del
+# modelo tal cual: "temperatura": "38°C", "sexo": "M" (el prompt de visión pedía
+# "M/F") o claves inventadas llegaban a json_state y obligaban a re-preguntar o a
+# corregir a mano. Aquí, con el schema compilado una vez a un árbol de nodos:
+#   - Claves fuera del schema: se descartan
+#   - number / integer: "38°C" → 38, "38,5" → 38.5, "treinta y ocho" → 38 (vía
+#     vitals.words_to_digits); sin número reconocible se descarta
+#   - enum: sin mayúsculas / tildes, sinónimos hablados (ENUM_SYNONYMS) e
+#     iniciales no ambiguas ("M" → "masculino", "Definitiva" → "definitivo")
+#   - string: números → texto, listas de textos → "a, b"; objetos se descartan
+#   - array: un valor suelto se envuelve en lista; elementos vacíos se quitan
+# null se mantiene (para FormMerger es "sin información"). Cada reparación se
+# cuenta por ruta del schema ("diagnosticos[].tipo") y tipo en CoercionStats.
+# Corre sobre el delta (no sobre el formulario): decenas de µs por delta.
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from form_context import normalize_text
+from vitals import words_to_digits
+
+# Formas habladas / escritas de cada valor de enum (además del valor y sus iniciales)
+ENUM_SYNONYMS: Dict[str, Tuple[str, ...]] = {
+    "masculino": ("masculina", "hombre", "varon", "male", "man"),
+    "femenino": ("femenina", "mujer", "female", "woman"),
+    "presuntivo": ("presuntiva", "probable", "posible", "sospecha", "diferencial", "presunto", "presunta"),
+    "definitivo": ("definitiva", "confirmado", "confirmada", "establecido", "establecida"),
+}
+
+_NUMBER_RE = re.compile(r"[-+]?\d+(?:[.,]\d+)?")
+
+# Una reparación: (ruta del schema, tipo)
+Repair = Tuple[str, str]
+
+_DROP = object()
+
+
+def _norm(value: str) -> str:
+    return " ".join(normalize_text(value).split())
+
+
+def _parse_number(value: str) -> Optional[float]:
+    m = _NUMBER_RE.search(value)
+    if m is None:
+        m = _NUMBER_RE.search(words_to_digits(normalize_text(value)))
+        if m is None:
+            return None
+    return float(m.group(0).replace(",", "."))
+
+
+def _num(v: float) -> Any:
+    return int(v) if v == int(v) else round(v, 2)
+
+
+class _Node:
+    __slots__ = ("kind", "path", "props", "items", "nullable", "enum")
+
+    def __init__(self, kind: str, path: str, nullable: bool = False):
+        self.kind = kind            # object | array | string | number | integer | enum | any
+        self.path = path
+        self.props: Dict[str, "_Node"] = {}
+        self.items: Optional["_Node"] = None
+        self.nullable = nullable
+        self.enum: Dict[str, str] = {}
+
+
+def _compile(schema: Dict[str, Any], path: str) -> _Node:
+    t = schema.get("type")
+    types = t if isinstance(t, list) else [t]
+    nullable = "null" in types
+    base = next((x for x in types if x != "null"), None)
+
+    if base == "object" or "properties" in schema:
+        node = _Node("object", path, nullable)
+        for k, v in schema.get("properties", {}).items():
+            node.props[k] = _compile(v, f"{path}.{k}" if path else k)
+        return node
+    if base == "array":
+        node = _Node("array", path, nullable)
+        items = schema.get("items")
+        node.items = _compile(items, f"{path}[]") if isinstance(items, dict) else _Node("any", f"{path}[]")
+        return node
+    if schema.get("enum"):
+        node = _Node("enum", path, nullable)
+        _index_enum(node.enum, [str(v) for v in schema["enum"]])
+        return node
+    if base in ("number", "integer", "string"):
+        return _Node(base, path, nullable)
+    return _Node("any", path, nullable)
+
+
+def _index_enum(table: Dict[str, str], values: List[str]) -> None:
+    """Forma normalizada → valor canónico: valor, sinónimos e iniciales no ambiguas."""
+    for v in values:
+        table[_norm(v)] = v
+        for syn in ENUM_SYNONYMS.get(v, ()):
+            table.setdefault(_norm(syn), v)
+    initials: Dict[str, List[str]] = {}
+    for v in values:
+        initials.setdefault(_norm(v)[:1], []).append(v)
+    for letter, owners in initials.items():
+        if letter and len(owners) == 1:
+            table.setdefault(letter, owners[0])
+
+
+class CoercionStats:
+    """Deltas revisados y reparaciones por campo (para /metrics)."""
+
+    def __init__(self):
+        self.deltas = 0
+        self.repaired = 0      # deltas con al menos una reparación
+        self.fields: Dict[str, Dict[str, int]] = {}
+
+    def record(self, repairs: List[Repair]) -> None:
+        self.deltas += 1
+        if repairs:
+            self.repaired += 1
+        for path, kind in repairs:
+            counts = self.fields.setdefault(path, {})
+            counts[kind] = counts.get(kind, 0) + 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "deltas": self.deltas,
+            "repaired": self.repaired,
+            "repair_rate": round(self.repaired / self.deltas, 3) if self.deltas else 0.0,
+            "fields": {path: dict(counts) for path, counts in self.fields.items()},
+        }
+
+
+class DeltaCoercer:
+    """Validador / coercionador compilado desde un JSON Schema.
+
+    Args:
+        schema: constants.SCHEMA (o uno compatible).
+        stats: Contadores opcionales donde se registra cada llamada a coerce().
+    """
+
+    def __init__(self, schema: Dict[str, Any], stats: Optional[CoercionStats] = None):
+        self._root = _compile(schema, "")
+        self.stats = stats
+
+    def coerce(self, delta: Any) -> Tuple[Dict[str, Any], List[Repair]]:
+        """Devuelve (delta válido, reparaciones). No modifica `delta`.
+
+        Un delta que no es objeto se descarta entero ({}).
+        """
+        repairs: List[Repair] = []
+        if isinstance(delta, dict):
+            clean = self._object(delta, self._root, repairs)
+        else:
+            repairs.append(("", "type"))
+            clean = {}
+        if self.stats is not None:
+            self.stats.record(repairs)
+        return clean, repairs
+
+    # ---------- Nodos ----------
+
+    def _value(self, value: Any, node: _Node, repairs: List[Repair]) -> Any:
+        if value is None:
+            return None
+        kind = node.kind
+        if kind == "object":
+            if isinstance(value, dict):
+                return self._object(value, node, repairs)
+        elif kind == "array":
+            return self._array(value, node, repairs)
+        elif kind == "string":
+            return self._string(value, node, repairs)
+        elif kind == "enum":
+            return self._enum(value, node, repairs)
+        elif kind in ("number", "integer"):
+            return self._number(value, node, repairs)
+        else:
+            return value
+        repairs.append((node.path, "type"))
+        return _DROP
+
+    def _object(self, value: dict, node: _Node, repairs: List[Repair]) -> dict:
+        out = {}
+        props = node.props
+        for key, v in value.items():
+            child = props.get(key)
+            if child is None:
+                repairs.append((f"{node.path}.{key}" if node.path else str(key), "unknown"))
+                continue
+            v = self._value(v, child, repairs)
+            if v is not _DROP:
+                out[key] = v
+        return out
+
+    def _array(self, value: Any, node: _Node, repairs: List[Repair]) -> Any:
+        if not isinstance(value, list):
+            if isinstance(value, dict) and node.items.kind != "object":
+                repairs.append((node.path, "type"))
+                return _DROP
+            repairs.append((node.path, "wrapped"))
+            value = [value]
+        out = []
+        items = node.items
+        for item in value:
+            if item is None or item == "" or item == {}:
+                repairs.append((items.path, "empty"))
+                continue
+            if isinstance(item, str) and items.kind == "object":
+                # "gripe" en diagnosticos: FormMerger lo convierte en {"nombre": "gripe"}
+                out.append(item)
+                continue
+            item = self._value(item, items, repairs)
+            if item is not _DROP and item is not None:
+                out.append(item)
+        return out
+
+    def _string(self, value: Any, node: _Node, repairs: List[Repair]) -> Any:
+        if isinstance(value, str):
+            return value
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            repairs.append((node.path, "to_string"))
+            return str(value)
+        if isinstance(value, list) and all(isinstance(v, (str, int, float)) for v in value):
+            repairs.append((node.path, "joined"))
+            return ", ".join(str(v) for v in value if v != "")
+        repairs.append((node.path, "type"))
+        return _DROP
+
+    def _enum(self, value: Any, node: _Node, repairs: List[Repair]) -> Any:
+        if isinstance(value, str):
+            if value in node.enum.values():
+                return value
+            canonical = node.enum.get(_norm(value).rstrip("."))
+            if canonical is not None:
+                repairs.append((node.path, "enum"))
+                return canonical
+        repairs.append((node.path, "invalid_enum"))
+        return _DROP
+
+    def _number(self, value: Any, node: _Node, repairs: List[Repair]) -> Any:
+        if isinstance(value, bool):
+            repairs.append((node.path, "type"))
+            return _DROP
+        if isinstance(value, (int, float)):
+            if node.kind == "integer" and not isinstance(value, int):
+                repairs.append((node.path, "to_integer"))
+                return int(value)
+            return value
+        if isinstance(value, str):
+            number = _parse_number(value)
+            if number is not None:
+                repairs.append((node.path, "to_number"))
+                return int(number) if node.kind == "integer" else _num(number)
+            if not value.strip():
+                return None
+        repairs.append((node.path, "type"))
+        return _DROP
@@ -0,0 +1,116 @@
+# form_context.py
+# Contexto del formulario que se envía al LLM en cada fragmento
+# - Poda nulls, strings vacíos, listas y objetos vacíos (make_blank_from_schema
+#   deja todo el árbol en null y eso se reenviaba completo en cada llamada)
+# - Recorta textos largos (anamnesis.relato...) y listas muy largas
+# - Opcional: incluye solo las secciones que el fragmento probablemente toca
+#
+# Así el tamaño del prompt queda acotado aunque la consulta crezca.
+
+import re
+import unicodedata
+from typing import Any, Dict, Optional, Tuple
+
+# Palabras (sin tildes, en minúscula) que indican qué sección toca un fragmento
+SECTION_KEYWORDS: Dict[str, Tuple[str, ...]] = {
+    "afiliacion": (
+        "nombre", "llama", "edad", "anos", "meses", "sexo", "masculino", "femenino", "dni",
+        "documento", "sangre", "seguro", "poliza", "consulta", "acude", "viene", "motivo",
+        "control", "chequeo", "emergencia",
+    ),
+    "anamnesis": (
+        "dolor", "fiebre", "tos", "desde", "hace", "dias", "semanas", "refiere", "presenta",
+        "sintoma", "nausea", "vomito", "diarrea", "apetito", "sed", "orina", "deposicion",
+        "sueno", "antecedente", "padre", "madre", "alergi", "medicamento", "toma", "relato",
+        "cefalea", "mareo", "malestar",
+    ),
+    "examenClinico": (
+        "presion", "pa ", "frecuencia", "pulso", "latidos", "respiracion", "temperatura",
+        "grados", "saturacion", "spo2", "oxigeno", "peso", "kilos", "kg", "talla", "mide",
+        "estatura", "imc", "glasgow", "examen", "piel", "cabeza", "cuello", "torax", "pulmon",
+        "murmullo", "corazon", "ruidos", "abdomen", "blando", "depresible", "extremidades",
+        "neurologico", "lucido", "orientado", "estado general", "faringe", "amigdala",
+    ),
+    "diagnosticos": (
+        "diagnostico", "impresion", "probable", "sospecha", "compatible", "cuadro", "parece",
+        "cie", "itis", "gripe", "infeccion", "hipertension", "diabetes", "asma", "neumonia",
+    ),
+    "tratamientos": (
+        "tratamiento", "plan", "indicar", "indico", "prescrib", "recet", "dar", "doy",
+        "tomar", "tome", "cada", "horas", "mg", "tableta", "pastilla", "capsula", "jarabe",
+        "reposo", "dieta", "liquidos", "paracetamol", "ibuprofeno", "amoxicilina",
+        "administrar", "aplicar", "suspender", "continuar",
+    ),
+    "firma": ("firma", "colegiatura", "doctor", "medico tratante", "cmp"),
+}
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas y sin tildes (para comparar con SECTION_KEYWORDS)."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def relevant_sections(fragment: str) -> Optional[Tuple[str, ...]]:
+    """Secciones de primer nivel que el fragmento probablemente toca.
+
+    Devuelve None si no se reconoce ninguna (el llamador debe enviar todo).
+    """
+    norm = " " + re.sub(r"\s+", " ", normalize_text(fragment)) + " "
+    hits = tuple(s for s, words in SECTION_KEYWORDS.items() if any(w in norm for w in words))
+    return hits or None
+
+
+def prune_form(value: Any, max_text: int = 300, max_items: int = 20) -> Any:
+    """Copia del formulario sin valores vacíos y con textos/listas recortados.
+
+    Devuelve None si el valor queda vacío (para que el padre lo omita).
+    Los textos largos conservan el final ("…" + últimos max_text chars), que es
+    lo más reciente en campos narrativos como anamnesis.relato.
+    """
+    if isinstance(value, dict):
+        out = {}
+        for k, v in value.items():
+            pv = prune_form(v, max_text, max_items)
+            if pv is not None:
+                out[k] = pv
+        return out or None
+    if isinstance(value, list):
+        items = [pv for pv in (prune_form(v, max_text, max_items) for v in value) if pv is not None]
+        if len(items) > max_items:
+            items = items[-max_items:]
+        return items or None
+    if isinstance(value, str):
+        text = value.strip()
+        if not text:
+            return None
+        if len(text) > max_text:
+            text = "…" + text[-max_text:]
+        return text
+    return value
+
+
+def build_form_context(
+    form: Dict[str, Any],
+    fragment: str = "",
+    mode: str = "pruned",
+    max_text: int = 300,
+    max_items: int = 20,
+) -> Tuple[Dict[str, Any], Optional[Tuple[str, ...]]]:
+    """Arma el `current_form` para el prompt.
+
+    Args:
+        form: Formulario completo de la sesión (no se modifica).
+        fragment: Fragmento dictado (para mode="sections").
+        mode: "full" (tal cual), "pruned" (sin vacíos, recortado) o
+            "sections" (pruned + solo secciones relevantes al fragmento).
+
+    Returns:
+        (contexto, secciones) — secciones es None si se envían todas.
+    """
+    if mode == "full":
+        return form, None
+
+    sections = relevant_sections(fragment) if mode == "sections" else None
+    source = form if sections is None else {k: v for k, v in form.items() if k in sections}
+    return prune_form(source, max_text, max_items) or {}, sections
@@ -0,0 +1,75 @@
+# form_diff.py
+# Diff estructural del formulario (reemplaza _flatten + compute_deltas de server.py)
+#
+# Antes se aplanaban ambos formularios completos a dicts nuevos en cada update
+# (un dict nuevo por nivel con out.update) y las listas se comparaban enteras:
+# agregar un síntoma reportaba toda la lista como cambiada. Aquí:
+#   - Solo se recorren los subárboles que toca el delta entrante (el resto del
+#     formulario ni se visita); sin delta se recorre todo, sin aplanar
+#   - Subárboles compartidos por identidad (la mezcla no copia lo que no cambió)
+#     se saltan sin comparar
+#   - Una lista que solo creció al final emite un cambio por elemento nuevo con
+#     la ruta "<lista>.-" (el "/-" de JSON Patch); cualquier otro cambio en una
+#     lista la reporta completa, como antes
+# FormMerger (form_merge.py) ya devuelve los cambios al mezclar; esto queda para
+# comparar formularios completos. Benchmark: bench_form_diff.py
+
+from itertools import islice
+from typing import Any, Dict, List, Optional
+
+# Segmento de ruta para "agregado al final de la lista"
+APPEND = "-"
+
+_MISSING = object()
+
+
+def _diff_list(prev: list, curr: list, path: str, out: List[Dict[str, Any]]) -> None:
+    n = len(prev)
+    if len(curr) > n and all(a == b for a, b in zip(prev, curr)):
+        for item in islice(curr, n, None):
+            out.append({"path": f"{path}.{APPEND}", "value": item})
+    elif curr != prev:
+        out.append({"path": path, "value": curr})
+
+
+def _diff_dict(prev: Any, curr: dict, touched: Optional[dict], prefix: str, out: List[Dict[str, Any]]) -> None:
+    if not isinstance(prev, dict):
+        prev = {}
+    for key in (curr if touched is None else touched):
+        c = curr.get(key, _MISSING)
+        if c is _MISSING:
+            continue
+        p = prev.get(key, _MISSING)
+        if p is c:
+            continue
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(c, dict):
+            sub = touched.get(key) if touched is not None else None
+            _diff_dict(p, c, sub if isinstance(sub, dict) else None, path, out)
+        elif isinstance(c, list) and isinstance(p, list):
+            _diff_list(p, c, path, out)
+        elif p is _MISSING or p != c:
+            out.append({"path": path, "value": c})
+
+
+def compute_deltas(prev: dict, curr: dict, touched: Optional[dict] = None) -> List[Dict[str, Any]]:
+    """Cambios de `prev` a `curr` como [{"path": "a.b", "value": v}].
+
+    Args:
+        touched: Delta aplicado (curr = prev + touched); si se pasa,
+            solo se recorren sus claves. None = comparar los formularios completos.
+
+    Las hojas nuevas o distintas se reportan con su ruta con puntos; los objetos
+    se recorren hasta sus hojas. Los elementos agregados al final de una lista se
+    reportan uno por uno en "<ruta>.-".
+    """
+    out: List[Dict[str, Any]] = []
+    _diff_dict(prev, curr, touched, "", out)
+    return out
+
+
+def split_append(path: str):
+    """("a.b", True) para "a.b.-"; (path, False) si no es un agregado a lista."""
+    if path.endswith("." + APPEND):
+        return path[:-len(APPEND) - 1], True
+    return path, False
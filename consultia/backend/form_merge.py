@@ -0,0 +1,210 @@
+# form_merge.py
+# Mezcla de deltas del LLM sobre el formulario, compilada desde constants.SCHEMA
+#
+# deep_merge copiaba cada nivel visitado (old.copy()) y reemplazaba las listas
+# enteras, aunque el prompt pide "agrega nuevos elementos sin borrar los
+# existentes": o se perdían diagnósticos / tratamientos, o el modelo reenviaba
+# las listas completas (tokens). Aquí, con el schema compilado una vez:
+#   - Listas de strings: se agregan los elementos nuevos (sin duplicados,
+#     comparando sin mayúsculas ni tildes)
+#   - Listas de objetos con claves (diagnosticos por nombre / cie10, tratamientos
+#     por medicamento): un elemento con la misma clave completa al existente; uno
+#     sin clave (p. ej. solo la dosis) completa al último; si no, se agrega
+#   - null en el delta = "sin información": no borra lo que había
+#   - Copy-on-write: solo se copian los dicts / listas del camino que cambió; el
+#     resto del formulario se comparte con la versión anterior (que no se modifica)
+#   - Devuelve los cambios ya calculados, en el formato de form_diff.compute_deltas
+#     ("a.b", "lista.-" para agregados, "lista.<i>.campo" para elementos existentes),
+#     así no hace falta un segundo recorrido para el diff
+# Claves fuera del schema se mezclan como antes (reemplazo / recursión en dicts).
+
+from functools import lru_cache
+from itertools import islice
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from form_context import normalize_text
+from form_diff import APPEND
+
+# Campos que identifican un elemento de las listas de objetos (en orden de preferencia)
+DEFAULT_ITEM_KEYS: Dict[str, Tuple[str, ...]] = {
+    "diagnosticos": ("nombre", "cie10"),
+    "tratamientos": ("medicamento",),
+}
+
+_OBJECT, _ARRAY, _SCALAR = "object", "array", "scalar"
+
+
+class _Node:
+    __slots__ = ("kind", "props", "items", "keys")
+
+    def __init__(self, kind: str, props=None, items=None, keys: Sequence[str] = ()):
+        self.kind = kind
+        self.props: Dict[str, "_Node"] = props or {}
+        self.items: Optional["_Node"] = items
+        self.keys = tuple(keys)
+
+
+def _compile(schema: Dict[str, Any], name: str, item_keys: Dict[str, Tuple[str, ...]]) -> _Node:
+    t = schema.get("type")
+    if t == "object" or "properties" in schema:
+        return _Node(_OBJECT, props={k: _compile(v, k, item_keys) for k, v in schema.get("properties", {}).items()})
+    if t == "array":
+        items = schema.get("items")
+        return _Node(_ARRAY, items=_compile(items, "", item_keys) if isinstance(items, dict) else None,
+                     keys=item_keys.get(name, ()))
+    return _Node(_SCALAR)
+
+
+@lru_cache(maxsize=4096)
+def _norm_text(value: str) -> str:
+    return " ".join(normalize_text(value).split())
+
+
+def _norm(value: Any) -> Any:
+    return _norm_text(value) if isinstance(value, str) else value
+
+
+def _empty(value: Any) -> bool:
+    return value is None or value == "" or value == [] or value == {}
+
+
+class FormMerger:
+    """Mezclador compilado desde un JSON Schema.
+
+    Args:
+        schema: constants.SCHEMA (o uno compatible).
+        item_keys: Campos identificadores por nombre de lista de objetos.
+    """
+
+    def __init__(self, schema: Dict[str, Any], item_keys: Optional[Dict[str, Tuple[str, ...]]] = None):
+        self._root = _compile(schema, "", DEFAULT_ITEM_KEYS if item_keys is None else item_keys)
+
+    def merge(self, old: Dict[str, Any], delta: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+        """Aplica `delta` sobre `old` sin modificarlo.
+
+        Returns:
+            (formulario nuevo, cambios [{"path", "value"}]). Si no hubo cambios el
+            formulario devuelto es el mismo objeto `old`.
+        """
+        changes: List[Dict[str, Any]] = []
+        merged = self._merge_object(old if isinstance(old, dict) else {}, delta, self._root, "", changes)
+        return merged, changes
+
+    # ---------- Objetos ----------
+
+    def _merge_object(self, old: dict, new: dict, node: Optional[_Node], prefix: str, changes: list) -> dict:
+        result = old
+        props = node.props if node is not None else {}
+        for key, value in new.items():
+            if value is None:
+                continue
+            path = f"{prefix}.{key}" if prefix else key
+            child = props.get(key)
+            current = old.get(key)
+            merged = self._merge_value(current, value, child, path, changes)
+            if merged is not current:
+                if result is old:
+                    result = dict(old)  # copy-on-write: una sola copia por nivel
+                result[key] = merged
+        return result
+
+    def _merge_value(self, current: Any, value: Any, node: Optional[_Node], path: str, changes: list) -> Any:
+        if isinstance(value, dict):
+            if isinstance(current, dict):
+                return self._merge_object(current, value, node, path, changes)
+            sub: List[Dict[str, Any]] = []
+            merged = self._merge_object({}, value, node, path, sub)
+            if not sub:
+                return current
+            changes.extend(sub)
+            return merged
+        if isinstance(value, list) and isinstance(current, list) and (node is None or node.kind == _ARRAY):
+            return self._merge_list(current, value, node, path, changes)
+        if current != value:
+            changes.append({"path": path, "value": value})
+            return value
+        return current
+
+    # ---------- Listas ----------
+
+    def _merge_list(self, current: list, new: list, node: Optional[_Node], path: str, changes: list) -> list:
+        result = current
+        items = node.items if node is not None else None
+        keys = node.keys if node is not None else ()
+        index = None  # clave normalizada → posición (se arma solo si hace falta)
+
+        # El modelo suele reenviar la lista completa: el prefijo idéntico no cambia nada
+        start, n = 0, min(len(new), len(current))
+        while start < n and new[start] == current[start]:
+            start += 1
+
+        for item in islice(new, start, None):
+            if _empty(item):
+                continue
+            if keys and isinstance(item, str):
+                # "gripe" en diagnosticos → {"nombre": "gripe"}
+                item = {keys[0]: item}
+            if isinstance(item, dict) and (keys or (items is not None and items.kind == _OBJECT)):
+                if index is None:
+                    index = self._key_index(result, keys)
+                pos = self._find(item, keys, index, result)
+                if pos is not None:
+                    before = result[pos]
+                    # La clave que lo identificó no "cambia" por mayúsculas / tildes
+                    item = {k: v for k, v in item.items() if k not in keys or _norm(v) != _norm(before.get(k))}
+                    merged = self._merge_object(before, item, items, f"{path}.{pos}", changes)
+                    if merged is not before:
+                        if result is current:
+                            result = list(current)
+                        result[pos] = merged
+                        self._index_item(index, merged, keys, pos)
+                    continue
+            else:
+                if index is None:
+                    index = {_norm(v) if not isinstance(v, (dict, list)) else repr(v): i for i, v in enumerate(result)}
+                marker = _norm(item) if not isinstance(item, (dict, list)) else repr(item)
+                if marker in index:
+                    continue
+                index[marker] = len(result)
+
+            if result is current:
+                result = list(current)
+            result.append(item)
+            if isinstance(item, dict) and keys:
+                self._index_item(index, item, keys, len(result) - 1)
+            changes.append({"path": f"{path}.{APPEND}", "value": item})
+        return result
+
+    @staticmethod
+    def _key_index(items: list, keys: Sequence[str]) -> Dict[Tuple[str, Any], int]:
+        index: Dict[Tuple[str, Any], int] = {}
+        for i, item in enumerate(items):
+            if isinstance(item, dict):
+                FormMerger._index_item(index, item, keys, i)
+        return index
+
+    @staticmethod
+    def _index_item(index: dict, item: dict, keys: Sequence[str], pos: int) -> None:
+        for k in keys:
+            v = item.get(k)
+            if not _empty(v):
+                index[(k, _norm(v))] = pos
+
+    @staticmethod
+    def _find(item: dict, keys: Sequence[str], index: dict, items: list) -> Optional[int]:
+        """Posición del elemento existente que corresponde a `item`, o None (= agregar)."""
+        has_key = False
+        for k in keys:
+            v = item.get(k)
+            if _empty(v):
+                continue
+            has_key = True
+            pos = index.get((k, _norm(v)))
+            if pos is not None:
+                return pos
+        if not has_key and keys and items and isinstance(items[-1], dict):
+            # Sin identificador (p. ej. solo la dosis): completa al último elemento
+            return len(items) - 1
+        if not keys and item in items:
+            return items.index(item)
+        return None
@@ -0,0 +1,108 @@
+# form_patch.py
+# Protocolo de diffs del formulario por WebSocket (RFC 6902 JSON Patch)
+#
+# Antes cada form_update llevaba el formulario completo (varios KB con el schema
+# en blanco) por fragmento. Ahora:
+#   - form_update {"rev": N, "patch": [...]}   → ops contra la revisión N-1
+#   - form_update {"rev": N, "form": {...}}    → snapshot (al conectar o si el
+#     cliente pide "resync" porque detectó un salto de revisión)
+# Las rutas con puntos de compute_deltas ("a.b.c") se traducen a JSON Pointer
+# ("/a/b/c"); si el padre no existía en la revisión anterior se agrega el
+# subárbol completo desde el primer segmento faltante. Los agregados al final de
+# una lista ("a.lista.-", ver form_diff.py) son {"op": "add", "path": "/a/lista/-"}.
+
+from typing import Any, Dict, Iterable, List, Sequence
+
+from form_diff import split_append
+
+
+def escape_token(token: str) -> str:
+    """Escapa un segmento de JSON Pointer (RFC 6901)."""
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def to_pointer(parts: Sequence[str]) -> str:
+    """["a", "b"] → "/a/b"."""
+    return "".join("/" + escape_token(str(p)) for p in parts)
+
+
+def _get(doc: Any, parts: Sequence[str]) -> Any:
+    for p in parts:
+        doc = doc[int(p)] if isinstance(doc, list) else doc[p]
+    return doc
+
+
+def changes_to_patch(prev: Dict[str, Any], curr: Dict[str, Any], changes: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Convierte los cambios {"path": "a.b", "value": v} en ops RFC 6902 aplicables a `prev`.
+
+    Args:
+        prev: Formulario de la revisión anterior (el que tiene el cliente).
+        curr: Formulario nuevo (de aquí salen los subárboles agregados).
+        changes: Salida de compute_deltas(prev, curr).
+    """
+    ops: List[Dict[str, Any]] = []
+    seen = set()
+    for ch in changes:
+        base, append = split_append(ch["path"])
+        if append:
+            ops.append({"op": "add", "path": to_pointer(base.split(".")) + "/-", "value": ch["value"]})
+            continue
+        parts = ch["path"].split(".")
+        node = prev
+        for i, key in enumerate(parts):
+            if isinstance(node, list) and key.isdigit() and int(key) < len(node):
+                # Elemento existente de una lista ("diagnosticos.0.tipo")
+                node = node[int(key)]
+                continue
+            if not isinstance(node, dict):
+                # Un escalar / lista / null pasó a ser objeto: se reemplaza entero
+                op, head = "replace", parts[:i]
+                break
+            if key not in node:
+                op, head = "add", parts[:i + 1]
+                break
+            node = node[key]
+        else:
+            op, head = "replace", parts
+
+        pointer = to_pointer(head)
+        if pointer in seen:
+            continue
+        seen.add(pointer)
+        value = ch["value"] if len(head) == len(parts) else _get(curr, head)
+        ops.append({"op": op, "path": pointer, "value": value})
+    return ops
+
+
+class PatchStats:
+    """Bytes enviados por form_update: patches vs snapshots (para /metrics)."""
+
+    def __init__(self):
+        self.patches = 0
+        self.patch_bytes = 0
+        self.snapshots = 0
+        self.snapshot_bytes = 0
+        self.resyncs = 0
+
+    def record_patch(self, size: int) -> None:
+        self.patches += 1
+        self.patch_bytes += size
+
+    def record_snapshot(self, size: int) -> None:
+        self.snapshots += 1
+        self.snapshot_bytes += size
+
+    def snapshot(self) -> Dict[str, Any]:
+        avg_patch = self.patch_bytes / self.patches if self.patches else 0
+        avg_snapshot = self.snapshot_bytes / self.snapshots if self.snapshots else 0
+        return {
+            "patches": self.patches,
+            "patch_bytes": self.patch_bytes,
+            "avg_patch_bytes": round(avg_patch),
+            "snapshots": self.snapshots,
+            "snapshot_bytes": self.snapshot_bytes,
+            "avg_snapshot_bytes": round(avg_snapshot),
+            "resyncs": self.resyncs,
+            # Lo que se habría enviado con el formulario completo en cada update
+            "saved_ratio": round(1 - avg_patch / avg_snapshot, 3) if avg_snapshot else 0.0,
+        }
@@ -0,0 +1,50 @@
+# history.py
+# Historial acotado para extract_form_incremental
+#
+# Antes cada fragmento agregaba a state["messages"] un mensaje de usuario y otro
+# de asistente con el formulario completo, sin límite: tras una consulta larga
+# cada request reenviaba el schema + N copias del formulario.
+#
+# En modo acotado el request se arma en cada llamada con:
+#   system (schema)  →  fragmentos antiguos condensados (opcional)
+#   →  últimos K fragmentos  →  snapshot actual del formulario  →  fragmento nuevo
+# y el estado por sesión es solo {"recent": [...K], "older": "<= N chars"}.
+
+import json
+from typing import Any, Dict, List
+
+
+def new_history() -> Dict[str, Any]:
+    return {"recent": [], "older": ""}
+
+
+def push_fragment(history: Dict[str, Any], fragment: str, keep: int = 6, older_max_chars: int = 1500) -> None:
+    """Agrega un fragmento; los que salen de la ventana se condensan en `older`.
+
+    Con older_max_chars=0 los fragmentos antiguos simplemente se descartan.
+    """
+    recent: List[str] = history["recent"]
+    recent.append(fragment)
+    while len(recent) > max(0, keep):
+        dropped = recent.pop(0)
+        if older_max_chars > 0:
+            older = f"{history['older']} {dropped}".strip()
+            # Se conserva lo más reciente; el formulario ya refleja lo anterior
+            history["older"] = older[-older_max_chars:]
+
+
+def build_messages(system_prompt: str, history: Dict[str, Any], form: Dict[str, Any], new_fragment: str) -> List[Dict[str, str]]:
+    """Mensajes del request incremental (tamaño acotado sin importar la duración)."""
+    messages = [{"role": "system", "content": system_prompt}]
+    if history["older"]:
+        messages.append({"role": "user", "content": f"FRAGMENTOS ANTERIORES (condensados): {history['older']}"})
+    if history["recent"]:
+        messages.append({"role": "user", "content": "FRAGMENTOS RECIENTES:\n" + "\n".join(history["recent"])})
+    messages.append({"role": "assistant", "content": json.dumps(form, ensure_ascii=False)})
+    messages.append({
+        "role": "user",
+        "content": f"NUEVO FRAGMENTO: {new_fragment}. "
+                   "Actualiza el objeto JSON en base a esto. "
+                   "Si no hay cambios, devuelve el mismo JSON."
+    })
+    return messages
@@ -0,0 +1,222 @@
+# image_prep.py
+# Preprocesamiento de imágenes antes de la Vision API (/extract-document)
+#
+# Una foto de celular de 10+ MB o un render PNG a resolución completa se enviaban
+# tal cual en base64 con detail="high". La API igual reescala (lado mayor <= 2048,
+# lado menor <= 768) y cobra 85 + 170 tokens por tile de 512 px, así que todo
+# píxel por encima de eso es payload desperdiciado. Pasos (Pillow):
+#   1. Rotación según EXIF (fotos de celular)
+#   2. Escala de grises (texto impreso / manuscrito no necesita color)
+#   3. Enderezado (deskew) por perfil de proyección en una miniatura
+#   4. Recorte a la hoja (mesa alrededor en fotos) y al contenido (márgenes blancos)
+#   5. Reescalado a la escala que la API usaría con el original: un recorte ahorra
+#      tiles sin achicar la letra (opcionalmente, además, un tope de tiles)
+#   6. Re-codificación JPEG / WebP
+# Benchmark: bench_image_prep.py
+
+import io
+import math
+from typing import Any, BinaryIO, Dict, Tuple, Union
+
+from PIL import Image, ImageDraw, ImageOps
+
+# Reescalado que hace la API en detail="high" (ver documentación de vision)
+HIGH_DETAIL_MAX_SIDE = 2048
+HIGH_DETAIL_SHORT_SIDE = 768
+TILE = 512
+TOKENS_BASE = 85
+TOKENS_PER_TILE = 170
+
+_MIME = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def high_detail_size(width: int, height: int) -> Tuple[int, int]:
+    """Tamaño al que la API reescala una imagen en detail="high"."""
+    scale = min(1.0, HIGH_DETAIL_MAX_SIDE / max(width, height))
+    width, height = width * scale, height * scale
+    scale = min(1.0, HIGH_DETAIL_SHORT_SIDE / min(width, height))
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def vision_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Tokens de imagen que cobra la API para ese tamaño."""
+    if detail == "low":
+        return TOKENS_BASE
+    w, h = high_detail_size(width, height)
+    return TOKENS_BASE + TOKENS_PER_TILE * math.ceil(w / TILE) * math.ceil(h / TILE)
+
+
+def tiles(width: int, height: int) -> int:
+    """Tiles de 512 px que ocupa la imagen tras el reescalado de detail="high"."""
+    w, h = high_detail_size(width, height)
+    return math.ceil(w / TILE) * math.ceil(h / TILE)
+
+
+def _fit_tiles(width: int, height: int, max_tiles: int) -> Tuple[int, int]:
+    """Reduce el tamaño hasta que ocupe como máximo `max_tiles` tiles (0 = sin tope)."""
+    w, h = high_detail_size(width, height)
+    while max_tiles and math.ceil(w / TILE) * math.ceil(h / TILE) > max_tiles:
+        w, h = int(w * 0.9), int(h * 0.9)
+    return w, h
+
+
+def _row_profile_score(img: Image.Image) -> float:
+    """Varianza del perfil de filas: máxima cuando las líneas de texto están horizontales."""
+    # Redimensionar a ancho 1 con BOX = promedio por fila (sin numpy)
+    rows = list(img.resize((1, img.height), Image.BOX).getdata())
+    mean = sum(rows) / len(rows)
+    return sum((r - mean) ** 2 for r in rows) / len(rows)
+
+
+def estimate_skew(gray: Image.Image, max_angle: float = 5.0, step: float = 0.5) -> float:
+    """Ángulo (grados) que endereza el texto, buscado en una miniatura de ~800 px."""
+    thumb = gray.copy()
+    thumb.thumbnail((800, 800))
+    # Solo la zona central: las esquinas de una hoja torcida traen fondo que domina el perfil
+    w, h = thumb.size
+    thumb = thumb.crop((int(w * 0.15), int(h * 0.15), int(w * 0.85), int(h * 0.85)))
+    # Texto en blanco sobre negro: el relleno de la rotación (0) no suma al perfil
+    inverted = ImageOps.invert(thumb).point(lambda p: 255 if p > 96 else 0)
+    best_angle, best_score = 0.0, _row_profile_score(inverted)
+    steps = int(max_angle / step)
+    for i in range(-steps, steps + 1):
+        angle = i * step
+        if angle == 0:
+            continue
+        score = _row_profile_score(inverted.rotate(angle, resample=Image.NEAREST))
+        if score > best_score * 1.02:  # evita rotar por ruido
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+def page_box(gray: Image.Image, threshold: int = 170):
+    """Caja de la hoja (región clara) dentro de una foto con fondo más oscuro, o None."""
+    bbox = gray.point(lambda p: 255 if p > threshold else 0).getbbox()
+    if bbox is None:
+        return None
+    if (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) > 0.95 * gray.width * gray.height:
+        return None
+    return bbox
+
+
+def content_box(gray: Image.Image, margin: float = 0.02, threshold: int = 200):
+    """Caja (left, top, right, bottom) del contenido (píxeles más oscuros que `threshold`).
+
+    Lo oscuro conectado al borde (cuñas de fondo que deja el enderezado, sombra del
+    borde de la hoja, marco negro del escáner) no cuenta como contenido. Devuelve
+    None si no hay nada que recortar.
+    """
+    mask = gray.point(lambda p: 255 if p < threshold else 0)
+    # En una miniatura: floodfill de Pillow es Python puro
+    small = mask.resize((max(1, gray.width // 4), max(1, gray.height // 4)), Image.BOX)
+    small = small.point(lambda p: 255 if p else 0)
+    sw, sh = small.size
+    for xy in [(x, y) for x in range(sw) for y in (0, sh - 1)] + [(x, y) for y in range(sh) for x in (0, sw - 1)]:
+        if small.getpixel(xy):
+            ImageDraw.floodfill(small, xy, 0)
+    bbox = small.getbbox()
+    if bbox is None:
+        return None
+    fx, fy = gray.width / sw, gray.height / sh
+    left, top = int(bbox[0] * fx), int(bbox[1] * fy)
+    right, bottom = math.ceil(bbox[2] * fx), math.ceil(bbox[3] * fy)
+    mx, my = int(gray.width * margin), int(gray.height * margin)
+    box = (max(0, left - mx), max(0, top - my), min(gray.width, right + mx), min(gray.height, bottom + my))
+    # Si el "contenido" ocupa casi todo (foto con fondo), no vale la pena recortar
+    if (box[2] - box[0]) * (box[3] - box[1]) > 0.95 * gray.width * gray.height:
+        return None
+    return box
+
+
+def preprocess_image(
+    source: Union[bytes, BinaryIO, Image.Image],
+    grayscale: bool = True,
+    deskew: bool = True,
+    crop: bool = True,
+    max_tiles: int = 0,
+    fmt: str = "JPEG",
+    quality: int = 85,
+) -> Tuple[memoryview, str, Dict[str, Any]]:
+    """Prepara una imagen para la Vision API.
+
+    Args:
+        source: Bytes o archivo abierto (temporal de la subida) o imagen PIL
+            (página renderizada de un PDF).
+        max_tiles: Tope de tiles de 512 px (0 = los que ocupa el contenido a la escala
+            a la que la API vería el original).
+        fmt: "JPEG", "WEBP" o "PNG".
+
+    Returns:
+        (imagen codificada, mime type, info con tamaños y tokens antes/después). La
+        imagen es un memoryview sobre el buffer del encoder (sin la copia de getvalue()).
+    """
+    if isinstance(source, (bytes, bytearray)):
+        img = Image.open(io.BytesIO(source))
+    elif hasattr(source, "read"):
+        img = Image.open(source)
+    else:
+        img = source
+    original_size = img.size
+    tw, th = high_detail_size(*img.size)
+    if img.format == "JPEG":
+        # Decodificación reducida (escalado DCT): no se descomprime la foto completa
+        side = 2 * max(tw, th)
+        img.draft("L" if grayscale else "RGB", (side, side))
+    img = ImageOps.exif_transpose(img)
+
+    if grayscale:
+        img = img.convert("L")
+    elif img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+
+    # Reducción barata a ~2x el tamaño final antes de rotar / recortar
+    factor = min(max(img.size) // (2 * max(tw, th)), min(img.size) // (2 * min(tw, th)))
+    if factor >= 2:
+        img = img.reduce(factor)
+    # Escala a la que la API vería la imagen completa: el contenido recortado se
+    # envía a esa misma escala (mismo tamaño de letra), no reampliado al tope de la API
+    api_scale = max(high_detail_size(*img.size)) / max(img.size)
+
+    if crop:
+        # Foto de una hoja sobre una mesa: primero la hoja (si no, el fondo cuenta como contenido)
+        box = page_box(img if img.mode == "L" else img.convert("L"))
+        if box is not None:
+            img = img.crop(box)
+
+    angle = 0.0
+    if deskew:
+        gray = img if img.mode == "L" else img.convert("L")
+        angle = estimate_skew(gray)
+        if angle:
+            fill = 255 if img.mode == "L" else (255, 255, 255)
+            img = img.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=fill)
+
+    if crop:
+        box = content_box(img if img.mode == "L" else img.convert("L"))
+        if box is not None:
+            img = img.crop(box)
+
+    # Los tiles son los que ocupa el contenido a la escala del original (menos que
+    # la hoja entera si hubo recorte); nunca más que el original ni que max_tiles
+    budget = min(max_tiles, tiles(*original_size)) if max_tiles else tiles(*original_size)
+    target = _fit_tiles(max(1, round(img.width * api_scale)), max(1, round(img.height * api_scale)), budget)
+    if target != img.size:
+        img = img.resize(target, Image.LANCZOS)
+
+    fmt = fmt.upper()
+    out = io.BytesIO()
+    if fmt == "PNG":
+        img.save(out, format="PNG", optimize=True)
+    else:
+        img.save(out, format=fmt, quality=quality, optimize=True)
+    data = out.getbuffer()
+
+    info = {
+        "original_size": original_size,
+        "size": img.size,
+        "angle": angle,
+        "bytes": len(data),
+        "tokens_before": vision_tokens(*original_size),
+        "tokens_after": vision_tokens(*img.size),
+    }
+    return data, _MIME.get(fmt, "image/jpeg"), info
@@ -0,0 +1,166 @@
+# llm.py
+# Capa LLM compartida para Consult-IA
+# - Un único cliente AsyncOpenAI por proceso, con pool httpx configurable
+# - chat_completion(): wrapper asíncrono que usan todos los helpers de server.py
+# - UsageStats: tokens de prompt cacheados vs no cacheados por tipo de llamada
+# - llm_cache: caché de respuestas por contenido (ver llm_cache.py)
+#
+# Variables de entorno:
+#   OPENAI_MAX_CONNECTIONS   conexiones simultáneas máximas hacia OpenAI (default 100)
+#   OPENAI_MAX_KEEPALIVE     conexiones keep-alive en el pool (default 20)
+#   OPENAI_TIMEOUT           timeout total por request en segundos (default 60)
+#   OPENAI_CONNECT_TIMEOUT   timeout de conexión en segundos (default 5)
+#   OPENAI_MAX_RETRIES       reintentos automáticos del SDK (default 2)
+#   LLM_CACHE                1 = cachear respuestas idénticas (default 1)
+#   LLM_CACHE_MAX_ENTRIES    entradas en memoria (default 1000)
+#   LLM_CACHE_MAX_BYTES      bytes en memoria (default 64 MiB)
+#   LLM_CACHE_TTL_S          validez de una respuesta en segundos (default 3600, 0 = sin vencimiento)
+#   LLM_CACHE_DIR            directorio para la caché en disco (default vacío = solo memoria)
+#   LLM_CACHE_DISK_MAX_BYTES tamaño máximo en disco (default 512 MiB)
+#   LLM_CACHE_MAX_TEMP       solo se cachean llamadas con temperature <= esto (default 0.2)
+#   LLM_CACHE_OPT_IN         tipos de llamada no deterministas que igual se cachean (ej. "suggestions")
+
+import os
+import logging
+from typing import Any, Dict, Optional
+
+import httpx
+from dotenv import load_dotenv
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from openai.types.chat import ChatCompletion
+
+from llm_cache import LLMCache, cache_key
+
+load_dotenv()
+logger = logging.getLogger("uvicorn.error")
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY", "")
+
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_MAX_KEEPALIVE = int(os.getenv("OPENAI_MAX_KEEPALIVE", "20"))
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+
+LLM_CACHE = os.getenv("LLM_CACHE", "1") == "1"
+LLM_CACHE_MAX_TEMP = float(os.getenv("LLM_CACHE_MAX_TEMP", "0.2"))
+LLM_CACHE_OPT_IN = {c.strip() for c in os.getenv("LLM_CACHE_OPT_IN", "").split(",") if c.strip()}
+
+_client: Optional[AsyncOpenAI] = None
+
+
+class UsageStats:
+    """Acumula tokens por tipo de llamada (prompt, cacheados, completion)."""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, int]] = {}
+
+    def record(self, call_type: str, usage: Any) -> None:
+        if usage is None:
+            return
+        prompt = getattr(usage, "prompt_tokens", 0) or 0
+        completion = getattr(usage, "completion_tokens", 0) or 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+        d = self._data.setdefault(call_type, {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0, "completion_tokens": 0})
+        d["calls"] += 1
+        d["prompt_tokens"] += prompt
+        d["cached_tokens"] += cached
+        d["completion_tokens"] += completion
+        logger.info(
+            f"[LLM] {call_type} prompt={prompt} cached={cached} uncached={prompt - cached} completion={completion}"
+        )
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        out = {}
+        for call_type, d in self._data.items():
+            out[call_type] = dict(d)
+            out[call_type]["cache_hit_ratio"] = (
+                round(d["cached_tokens"] / d["prompt_tokens"], 3) if d["prompt_tokens"] else 0.0
+            )
+        return out
+
+
+usage_stats = UsageStats()
+
+llm_cache = LLMCache(
+    max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1000")),
+    max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("LLM_CACHE_TTL_S", "3600")),
+    disk_dir=os.getenv("LLM_CACHE_DIR", ""),
+    disk_max_bytes=int(os.getenv("LLM_CACHE_DISK_MAX_BYTES", str(512 * 1024 * 1024))),
+)
+
+
+def _cacheable(call_type: str, kwargs: Dict[str, Any], cache: Optional[bool]) -> bool:
+    """Solo respuestas reproducibles: sin streaming y con temperatura baja (o opt-in)."""
+    if not LLM_CACHE or kwargs.get("stream") or cache is False:
+        return False
+    if cache or call_type in LLM_CACHE_OPT_IN:
+        return True
+    temperature = kwargs.get("temperature")
+    return temperature is not None and temperature <= LLM_CACHE_MAX_TEMP
+
+
+def get_client() -> AsyncOpenAI:
+    """Devuelve el cliente AsyncOpenAI compartido (se crea en el primer uso)."""
+    global _client
+    if _client is None:
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=OPENAI_MAX_CONNECTIONS,
+                max_keepalive_connections=OPENAI_MAX_KEEPALIVE,
+            ),
+            timeout=httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+        )
+        _client = AsyncOpenAI(
+            api_key=OPENAI_API_KEY,
+            http_client=http_client,
+            max_retries=OPENAI_MAX_RETRIES,
+        )
+        logger.info(
+            f"[LLM] AsyncOpenAI listo (max_connections={OPENAI_MAX_CONNECTIONS}, "
+            f"keepalive={OPENAI_MAX_KEEPALIVE}, timeout={OPENAI_TIMEOUT}s)"
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Cierra el pool httpx (llamar al apagar la app)."""
+    global _client
+    if _client is not None:
+        await _client.close()
+        _client = None
+
+
+async def chat_completion(call_type: str, cache: Optional[bool] = None, **kwargs: Any) -> Any:
+    """Llama a chat.completions.create sin bloquear el event loop.
+
+    Args:
+        call_type: Etiqueta del tipo de llamada (summary, delta, suggestions...), usada en logs.
+        cache: None = según temperatura / LLM_CACHE_OPT_IN; True/False fuerza usar o no la caché.
+        **kwargs: Parámetros tal cual para chat.completions.create.
+    """
+    logger.debug(f"[LLM] {call_type} model={kwargs.get('model')}")
+    key = cache_key(kwargs) if _cacheable(call_type, kwargs, cache) else None
+    if key is not None:
+        payload = await llm_cache.get(key, call_type)
+        if payload is not None:
+            resp = ChatCompletion.model_validate_json(payload)
+            llm_cache.saved_prompt_tokens += getattr(resp.usage, "prompt_tokens", 0) or 0
+            logger.info(f"[LLM] {call_type} respuesta desde caché")
+            return resp
+
+    resp = await get_client().chat.completions.create(**kwargs)
+    if not kwargs.get("stream"):
+        # En streaming el usage llega en el último chunk (ver record_usage)
+        usage_stats.record(call_type, getattr(resp, "usage", None))
+    if key is not None:
+        await llm_cache.put(key, resp.model_dump_json())
+    return resp
+
+
+def record_usage(call_type: str, usage: Any) -> None:
+    """Registra el usage de una llamada en streaming (stream_options.include_usage)."""
+    usage_stats.record(call_type, usage)
@@ -0,0 +1,197 @@
+# llm_cache.py
+# Caché de respuestas del LLM direccionada por contenido
+# - Clave: modelo + temperatura + sha256 de los parámetros normalizados (mensajes,
+#   response_format, max_tokens...), así dos requests idénticos comparten respuesta
+# - Memoria: LRU con límite de entradas y de bytes, y TTL
+# - Disco (opcional): un archivo JSON por clave, escrito de forma atómica fuera del
+#   event loop; se recorta por tamaño total (los más viejos primero). El tamaño se
+#   lleva en un índice en memoria (como DocumentStore): el directorio se recorre
+#   solo al arrancar, no en cada escritura
+# - Métricas: aciertos en memoria / disco, fallos, guardados, tokens ahorrados
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("uvicorn.error")
+
+# Parámetros que no cambian el contenido de la respuesta
+_IGNORED_PARAMS = ("stream", "stream_options", "timeout", "extra_headers")
+
+
+def cache_key(params: Dict[str, Any]) -> str:
+    """Clave "modelo:temperatura:sha256" de los parámetros de chat.completions.create."""
+    body = {k: v for k, v in params.items() if k not in _IGNORED_PARAMS}
+    digest = hashlib.sha256(
+        json.dumps(body, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    ).hexdigest()
+    return f"{params.get('model')}:{params.get('temperature')}:{digest}"
+
+
+class LLMCache:
+    """LRU en memoria (+ disco opcional) de respuestas serializadas.
+
+    Args:
+        max_entries: Entradas máximas en memoria.
+        max_bytes: Bytes máximos en memoria (suma de las respuestas serializadas).
+        ttl: Segundos de validez de una respuesta (0 = sin vencimiento).
+        disk_dir: Directorio para la caché en disco ("" = solo memoria).
+        disk_max_bytes: Tamaño máximo del directorio en disco.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1000,
+        max_bytes: int = 64 * 1024 * 1024,
+        ttl: float = 3600,
+        disk_dir: str = "",
+        disk_max_bytes: int = 512 * 1024 * 1024,
+    ):
+        self._max_entries = max_entries
+        self._max_bytes = max_bytes
+        self._ttl = ttl
+        self._disk_dir = disk_dir
+        self._disk_max_bytes = disk_max_bytes
+        self._mem: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._mem_bytes = 0
+        self._disk_index: Dict[str, Tuple[float, int]] = {}   # ruta → (guardado, bytes)
+        self._disk_bytes = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            with os.scandir(disk_dir) as it:
+                for e in it:
+                    if e.name.endswith(".json"):
+                        st = e.stat()
+                        self._disk_index[e.path] = (st.st_mtime, st.st_size)
+                        self._disk_bytes += st.st_size
+
+        # Métricas (globales y por tipo de llamada)
+        self.hits_memory = 0
+        self.hits_disk = 0
+        self.misses = 0
+        self.stores = 0
+        self.saved_prompt_tokens = 0
+        self.by_call: Dict[str, Dict[str, int]] = {}
+
+    # ---------- Memoria ----------
+
+    def _expired(self, stored_at: float) -> bool:
+        return bool(self._ttl) and time.time() - stored_at > self._ttl
+
+    def _mem_put(self, key: str, stored_at: float, payload: str) -> None:
+        old = self._mem.pop(key, None)
+        if old is not None:
+            self._mem_bytes -= len(old[1])
+        self._mem[key] = (stored_at, payload)
+        self._mem_bytes += len(payload)
+        while self._mem and (len(self._mem) > self._max_entries or self._mem_bytes > self._max_bytes):
+            _, (_, dropped) = self._mem.popitem(last=False)
+            self._mem_bytes -= len(dropped)
+
+    # ---------- Disco (se ejecuta en un thread; el índice solo se toca en el loop) ----------
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self._disk_dir, key.rsplit(":", 1)[-1] + ".json")
+
+    def _disk_get(self, key: str) -> Optional[Tuple[float, str]]:
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("key") != key:
+            return None
+        return data["stored_at"], data["payload"]
+
+    def _disk_put(self, path: str, key: str, stored_at: float, payload: str) -> int:
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"key": key, "stored_at": stored_at, "payload": payload}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        return os.path.getsize(path)
+
+    @staticmethod
+    def _disk_remove(paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def _disk_trim(self) -> List[str]:
+        """Saca del índice los más viejos hasta volver al límite; devuelve los archivos a borrar."""
+        victims = []
+        for path, (_, size) in sorted(self._disk_index.items(), key=lambda kv: kv[1][0]):
+            if self._disk_bytes <= self._disk_max_bytes:
+                break
+            del self._disk_index[path]
+            self._disk_bytes -= size
+            victims.append(path)
+        return victims
+
+    # ---------- API ----------
+
+    def _count(self, call_type: str, field: str) -> None:
+        d = self.by_call.setdefault(call_type, {"hits": 0, "misses": 0})
+        d[field] += 1
+
+    async def get(self, key: str, call_type: str = "") -> Optional[str]:
+        """Respuesta serializada para `key`, o None (cuenta acierto / fallo)."""
+        item = self._mem.get(key)
+        if item is not None and not self._expired(item[0]):
+            self._mem.move_to_end(key)
+            self.hits_memory += 1
+            self._count(call_type, "hits")
+            return item[1]
+        if item is not None:
+            self._mem_bytes -= len(self._mem.pop(key)[1])
+
+        if self._disk_dir:
+            item = await asyncio.to_thread(self._disk_get, key)
+            if item is not None and not self._expired(item[0]):
+                self._mem_put(key, *item)
+                self.hits_disk += 1
+                self._count(call_type, "hits")
+                return item[1]
+
+        self.misses += 1
+        self._count(call_type, "misses")
+        return None
+
+    async def put(self, key: str, payload: str) -> None:
+        stored_at = time.time()
+        self._mem_put(key, stored_at, payload)
+        self.stores += 1
+        if self._disk_dir:
+            path = self._path(key)
+            try:
+                size = await asyncio.to_thread(self._disk_put, path, key, stored_at, payload)
+            except OSError:
+                logger.exception("[LLM-CACHE] error escribiendo en disco")
+                return
+            _, old = self._disk_index.get(path, (0, 0))
+            self._disk_index[path] = (stored_at, size)
+            self._disk_bytes += size - old
+            if self._disk_bytes > self._disk_max_bytes:
+                await asyncio.to_thread(self._disk_remove, self._disk_trim())
+
+    def snapshot(self) -> Dict[str, Any]:
+        lookups = self.hits_memory + self.hits_disk + self.misses
+        return {
+            "entries": len(self._mem),
+            "bytes": self._mem_bytes,
+            "disk_entries": len(self._disk_index),
+            "disk_bytes": self._disk_bytes,
+            "hits_memory": self.hits_memory,
+            "hits_disk": self.hits_disk,
+            "misses": self.misses,
+            "stores": self.stores,
+            "hit_ratio": round((self.hits_memory + self.hits_disk) / lookups, 3) if lookups else 0.0,
+            "saved_prompt_tokens": self.saved_prompt_tokens,
+            "by_call": {k: dict(v) for k, v in self.by_call.items()},
+        }
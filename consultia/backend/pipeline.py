@@ -0,0 +1,227 @@
+# pipeline.py
+# Pipeline de actualización ordenado por sesión
+# - Cola acotada de fragmentos "final" + UN solo worker por sesión
+# - Los fragmentos que llegan mientras hay una extracción en curso se agrupan
+#   (coalescing) en una única llamada al LLM y se aplican en orden
+# - SummaryDebouncer: regenera el resumen narrativo como máximo una vez por
+#   ventana (quiet-period / max-wait) y cancela la llamada anterior si sigue en curso
+# - FollowUpTasks: sugerencias y explicaciones en paralelo tras el form_update
+
+import asyncio
+import logging
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class SessionUpdatePipeline:
+    """Serializa las actualizaciones del formulario de una sesión.
+
+    Args:
+        process: Corrutina que procesa un lote de texto (fragmentos ya unidos).
+        max_pending: Máximo de entradas en cola. Si se llena, el nuevo fragmento
+            se une a la última entrada en vez de descartarse.
+        name: Identificador para logs (normalmente el session_id).
+    """
+
+    def __init__(
+        self,
+        process: Callable[[str], Awaitable[None]],
+        max_pending: int = 8,
+        name: str = "",
+    ):
+        self._process = process
+        self._max_pending = max(1, max_pending)
+        self._name = name
+        self._pending: Deque[str] = deque()
+        self._wakeup = asyncio.Event()
+        self._closed = False
+        self._worker: Optional[asyncio.Task] = None
+
+        # Métricas simples
+        self.fragments_received = 0
+        self.batches_processed = 0
+
+    # ---------- Fragmentos ----------
+
+    def submit(self, fragment: str) -> None:
+        """Encola un fragmento final (no bloquea el loop de recepción)."""
+        if self._closed:
+            return
+        self.fragments_received += 1
+        if len(self._pending) >= self._max_pending:
+            # Cola llena: agrupar con la última entrada (sin perder texto)
+            self._pending[-1] = f"{self._pending[-1]} {fragment}"
+        else:
+            self._pending.append(fragment)
+        self._wakeup.set()
+        if self._worker is None:
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            if not self._pending:
+                if self._closed:
+                    return
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            # Tomar TODO lo pendiente y procesarlo como un único lote
+            batch = " ".join(self._pending)
+            count = len(self._pending)
+            self._pending.clear()
+
+            try:
+                await self._process(batch)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"[PIPELINE] session={self._name} error procesando lote")
+
+            self.batches_processed += 1
+            if count > 1:
+                logger.info(f"[PIPELINE] session={self._name} coalesced {count} fragmentos en 1 llamada")
+
+    # ---------- Cierre ----------
+
+    async def close(self, drain: bool = True) -> None:
+        """Detiene el pipeline. Con drain=True procesa lo pendiente antes de salir."""
+        self._closed = True
+        if self._worker is None:
+            return
+        if drain:
+            self._wakeup.set()
+            await asyncio.gather(self._worker, return_exceptions=True)
+        else:
+            self._worker.cancel()
+        logger.info(
+            f"[PIPELINE] session={self._name} cerrado: fragmentos={self.fragments_received} "
+            f"llamadas={self.batches_processed}"
+        )
+
+
+class SummaryDebouncer:
+    """Agrupa los disparos de resumen de una sesión.
+
+    Cada trigger() reprograma la regeneración a `quiet` segundos; si siguen
+    llegando fragmentos, se fuerza igual a los `max_wait` segundos del primer
+    trigger pendiente. Al disparar se cancela el resumen anterior si aún corre,
+    porque el transcript nuevo lo deja obsoleto.
+
+    Args:
+        run: Corrutina que genera y envía el resumen (lee el estado más reciente).
+        quiet: Segundos sin fragmentos nuevos antes de regenerar.
+        max_wait: Espera máxima desde el primer trigger pendiente.
+        name: Identificador para logs (normalmente el session_id).
+    """
+
+    def __init__(
+        self,
+        run: Callable[[], Awaitable[None]],
+        quiet: float = 1.2,
+        max_wait: float = 5.0,
+        name: str = "",
+    ):
+        self._run = run
+        self._quiet = max(0.0, quiet)
+        self._max_wait = max(self._quiet, max_wait)
+        self._name = name
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._first_pending: Optional[float] = None
+        self._inflight: Optional[asyncio.Task] = None
+        self._closed = False
+
+        # Métricas simples
+        self.triggers = 0
+        self.runs = 0
+        self.cancelled = 0
+
+    def trigger(self) -> None:
+        """Marca que hay transcript nuevo; reprograma la regeneración."""
+        if self._closed:
+            return
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        self.triggers += 1
+        if self._first_pending is None:
+            self._first_pending = now
+        deadline = min(now + self._quiet, self._first_pending + self._max_wait)
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = loop.call_at(deadline, self._fire)
+
+    def _fire(self) -> None:
+        self._timer = None
+        self._first_pending = None
+        if self._closed:
+            return
+        if self._inflight is not None and not self._inflight.done():
+            self._inflight.cancel()
+            self.cancelled += 1
+        self.runs += 1
+        self._inflight = asyncio.create_task(self._guard())
+
+    async def _guard(self) -> None:
+        try:
+            await self._run()
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception(f"[SUMMARY] session={self._name} stream_summary error")
+
+    async def close(self) -> None:
+        """Cancela el timer y el resumen en curso."""
+        self._closed = True
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._inflight is not None and not self._inflight.done():
+            self._inflight.cancel()
+            await asyncio.gather(self._inflight, return_exceptions=True)
+        logger.info(
+            f"[SUMMARY] session={self._name} triggers={self.triggers} "
+            f"resúmenes={self.runs} cancelados={self.cancelled}"
+        )
+
+
+class FollowUpTasks:
+    """Tareas de seguimiento de una sesión (sugerencias, explicaciones...).
+
+    Corren en paralelo después de enviar el form_update. Cada tarea tiene un
+    `kind`; al lanzar una nueva con supersede=True se cancela la anterior del
+    mismo tipo, porque su resultado ya no corresponde al formulario vigente.
+    """
+
+    def __init__(self, name: str = ""):
+        self._name = name
+        self._tasks: Dict[str, Set[asyncio.Task]] = {}
+        self.cancelled = 0
+
+    def spawn(self, kind: str, coro: Awaitable[None], supersede: bool = False) -> None:
+        tasks = self._tasks.setdefault(kind, set())
+        if supersede:
+            for t in tasks:
+                if not t.done():
+                    t.cancel()
+                    self.cancelled += 1
+        task = asyncio.create_task(self._guard(kind, coro))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+
+    async def _guard(self, kind: str, coro: Awaitable[None]) -> None:
+        try:
+            await coro
+        except asyncio.CancelledError:
+            pass
+        except Exception:
+            logger.exception(f"[FOLLOWUP] session={self._name} {kind} error")
+
+    async def close(self) -> None:
+        """Cancela todo lo pendiente (p. ej. al desconectarse el cliente)."""
+        pending = [t for tasks in self._tasks.values() for t in tasks if not t.done()]
+        for t in pending:
+            t.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
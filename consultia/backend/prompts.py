@@ -0,0 +1,280 @@
+# prompts.py
+# Prompts estáticos del backend (prefijos byte-idénticos entre llamadas)
+#
+# OpenAI cachea automáticamente el prefijo común de los prompts (>= 1024 tokens).
+# Para que el caché acierte, todo lo estático (instrucciones, ejemplos, SCHEMA)
+# se construye UNA vez aquí al importar y va primero; el contenido dinámico de
+# cada llamada (formulario, transcript, fragmento) va siempre al final, en el
+# mensaje de usuario. No interpolar valores por llamada en estas constantes.
+
+#
+# Los prompts que llevan el schema se obtienen con funciones cacheadas
+# (delta_system_prompt, ...) según el modo: "full" = JSON Schema completo,
+# "compact" = digest de schema_digest.py, "none" = sin schema (solo delta /
+# combinado). Mismos argumentos → mismo string. Lo que depende del fragmento
+# (secciones relevantes) no entra al system prompt: rompería el prefijo cacheado.
+
+import json
+from functools import lru_cache
+from typing import Optional, Tuple
+
+from constants import SCHEMA
+from schema_digest import SCHEMA_DIGEST
+
+# Serialización única y estable del SCHEMA (mismo orden de claves en cada proceso)
+SCHEMA_JSON = json.dumps(SCHEMA, ensure_ascii=False, separators=(",", ":"))
+
+
+@lru_cache(maxsize=64)
+def schema_block(mode: str = "full", sections: Optional[Tuple[str, ...]] = None) -> str:
+    """Bloque de schema para el system prompt.
+
+    Args:
+        mode: "full" (JSON Schema), "compact" (digest ruta: tipo — pista) o "none".
+        sections: Secciones de primer nivel a incluir (None = todas).
+    """
+    if mode == "none":
+        return ""
+    if mode == "compact":
+        return "Schema (ruta: tipo — pista):\n" + SCHEMA_DIGEST.render(sections)
+    if sections is None:
+        return "JSON Schema:\n" + SCHEMA_JSON
+    props = {k: v for k, v in SCHEMA["properties"].items() if k in sections}
+    subset = {"type": "object", "properties": props}
+    return "JSON Schema:\n" + json.dumps(subset, ensure_ascii=False, separators=(",", ":"))
+
+# ------------------ Formulario ------------------
+
+# Conversación incremental (extract_form_incremental / bootstrap de /ws)
+@lru_cache(maxsize=8)
+def form_system_prompt(mode: str = "full") -> str:
+    return (
+        "Eres un asistente clínico. Tu tarea es mantener un objeto JSON de historia clínica "
+        "actualizado en tiempo real. Devuelve SOLO JSON válido y sigue EXACTAMENTE este schema.\n\n"
+        + schema_block(mode)
+    )
+
+# Extracción completa desde el transcript (extract_form)
+@lru_cache(maxsize=8)
+def full_form_system_prompt(mode: str = "full") -> str:
+    return (
+        "Eres un asistente clínico. Extrae SOLO los datos mencionados del transcript y "
+        "devuelve EXCLUSIVAMENTE un objeto JSON válido que siga EXACTAMENTE el siguiente schema. "
+        "No inventes campos ni valores. Si algo no aparece, omítelo.\n"
+        "Tarea: completar historia clínica desde el transcript. "
+        "Devuelve un UNICO objeto JSON que cumpla el schema.\n\n"
+        + schema_block(mode)
+    )
+
+# Delta por fragmento (extract_form_delta): instrucciones + ejemplos (+ schema opcional, ver delta_system_prompt)
+DELTA_INSTRUCTIONS = (
+    "Eres un asistente médico especializado que actualiza una historia clínica en formato JSON.\n\n"
+
+    "IMPORTANTE: Debes interpretar el LENGUAJE NATURAL del médico, no solo términos técnicos exactos.\n\n"
+
+    "EJEMPLOS DE INTERPRETACIÓN:\n"
+    "- 'paciente viene por fiebre' → afiliacion.motivoConsulta: 'fiebre'\n"
+    "- 'tiene tos y dolor de cabeza' → anamnesis.sintomasPrincipales: ['tos', 'dolor de cabeza']\n"
+    "- 'parece ser una gripe' → diagnosticos: [{nombre: 'gripe', tipo: 'presuntivo'}]\n"
+    "- 'probable faringitis' → diagnosticos: [{nombre: 'faringitis', tipo: 'presuntivo'}]\n"
+    "- 'le voy a dar paracetamol' → tratamientos: [{medicamento: 'paracetamol'}]\n"
+    "- 'que tome una pastilla cada 8 horas' → tratamientos: [{dosisIndicacion: 'una pastilla cada 8 horas'}]\n"
+    "- 'presión 120 sobre 80' → examenClinico.signosVitales.PA: '120/80'\n"
+    "- 'temperatura treinta y ocho grados' → examenClinico.signosVitales.temperatura: 38\n\n"
+
+    "Entradas:\n"
+    "  • El estado actual del objeto JSON (historia clínica).\n"
+    "  • Un fragmento de texto dictado por el médico.\n"
+    "  • El JSON Schema completo, con descripciones detalladas de cada campo.\n\n"
+
+    "Instrucciones:\n"
+    "1. Interpreta el SENTIDO del texto, no busques palabras clave exactas.\n"
+    "2. Lee CUIDADOSAMENTE las descripciones del schema - contienen patrones de lenguaje natural a detectar.\n"
+    "3. Devuelve SOLO un objeto JSON parcial con los campos que deben actualizarse.\n"
+    "   - Si no hay información nueva, devuelve {}.\n"
+    "4. Usa únicamente claves y estructuras que existan en el schema.\n"
+    "5. Si varios campos son relevantes para el mismo texto, actualiza todos.\n"
+    "6. Respeta los tipos de datos definidos en el schema (string, number, array, object, enum).\n"
+    "7. Para arrays: devuelve SOLO los elementos nuevos; se agregan a los existentes (no repitas los que ya están).\n"
+    "   Para completar un diagnóstico o tratamiento existente repite su nombre / medicamento con el campo nuevo.\n"
+    "8. Para enums: si no se especifica, usa el valor por defecto sugerido en la descripción.\n"
+    "9. No inventes claves ni devuelvas texto adicional fuera del JSON.\n\n"
+)
+
+# Modo combinado: delta + sugerencias + explicaciones en UNA sola llamada
+COMBINED_INSTRUCTIONS = (
+    "\n"
+    "Además del delta, en la MISMA respuesta:\n"
+    "  • Genera 0-3 sugerencias contextuales para el médico (máximo 15 palabras cada una), "
+    "específicas a lo que se acaba de decir; no digas solo 'falta X campo'.\n"
+    "  • Para cada campo que cambies, explica el motivo (reason, <= 18 palabras) y una cita "
+    "textual corta del fragmento o transcript (evidence, <= 15 palabras; cadena vacía si no hay).\n\n"
+    "Devuelve UN ÚNICO objeto JSON con esta forma exacta:\n"
+    '{"delta": {...}, "suggestions": ["..."], '
+    '"explanations": [{"path": "a.b.c", "reason": "...", "evidence": "..."}]}\n'
+    "Usa rutas con puntos para path (ejemplo: examenClinico.signosVitales.PA).\n"
+)
+
+
+@lru_cache(maxsize=8)
+def delta_system_prompt(mode: str = "none") -> str:
+    # Va en cada fragmento: sin schema por defecto (el schema no alcanza para
+    # justificar ~2k tokens más por llamada solo para llegar al umbral del caché)
+    if mode == "none":
+        return DELTA_INSTRUCTIONS
+    return DELTA_INSTRUCTIONS + schema_block(mode) + "\n"
+
+
+@lru_cache(maxsize=8)
+def combined_system_prompt(mode: str = "none") -> str:
+    # Comparte el prefijo del delta (mismo caché del proveedor hasta el schema)
+    return delta_system_prompt(mode) + COMBINED_INSTRUCTIONS
+
+# Operaciones JSON Patch (extract_form_patch)
+PATCH_SYSTEM_PROMPT = (
+    "Eres un asistente clínico. Tu tarea es mantener un objeto JSON de historia clínica actualizado.\n"
+    "Se te dará el estado actual del formulario y un fragmento de transcripción.\n"
+    "Devuelve SOLO un arreglo JSON con operaciones tipo JSON Patch (RFC6902).\n"
+    "Cada operación debe ser {op, path, value}.\n"
+    "Usa paths estilo /afiliacion/nombreCompleto, /anamnesis/sintomasPrincipales/- para agregar.\n"
+    "Si el fragmento no aporta información nueva, devuelve [].\n"
+    "Devuelve SOLO JSON válido, sin explicaciones."
+)
+
+# ------------------ Sugerencias / resumen / explicaciones ------------------
+
+SUGGESTIONS_SYSTEM_PROMPT = (
+    "Eres un asistente clínico inteligente. Tu tarea es generar 1-3 sugerencias CONTEXTUALES "
+    "para ayudar al médico a completar la historia clínica.\n\n"
+
+    "IMPORTANTE:\n"
+    "- Las sugerencias deben ser ESPECÍFICAS al contexto de lo que se está diciendo.\n"
+    "- NO solo decir 'falta X campo' - ser PROACTIVO y contextual.\n"
+    "- Basarte en lo que el médico acaba de decir para sugerir el siguiente paso lógico.\n"
+    "- Cada sugerencia debe ser breve (máximo 15 palabras) y accionable.\n\n"
+
+    "EJEMPLOS DE BUENAS SUGERENCIAS:\n"
+    "✓ 'Pregunte cuánto tiempo lleva con fiebre' (si mencionó fiebre)\n"
+    "✓ 'Indague antecedentes de hipertensión familiar' (si mencionó presión alta)\n"
+    "✓ 'Considere solicitar hemograma completo' (si hay signos de infección)\n"
+    "✓ 'Registre peso y talla para calcular IMC' (si está en examen físico)\n"
+    "✓ 'Especifique dosis del paracetamol' (si mencionó paracetamol sin dosis)\n\n"
+
+    "EJEMPLOS DE MALAS SUGERENCIAS (evitar):\n"
+    "✗ 'Falta el diagnóstico' (muy genérico)\n"
+    "✗ 'Complete el formulario' (obvio y poco útil)\n"
+    "✗ 'Registre datos del paciente' (demasiado vago)\n\n"
+
+    "Devuelve UN ÚNICO objeto JSON con formato:\n"
+    '{"suggestions": ["sugerencia 1", "sugerencia 2", ...]}\n\n'
+
+    "Si no hay nada relevante que sugerir, devuelve: {\"suggestions\": []}"
+)
+
+SUMMARY_SYSTEM_PROMPT = (
+    "Eres un asistente clínico. Resume de forma NARRATIVA lo que se ha dicho en la consulta.\n"
+    "- Resume en 2-3 oraciones máximo.\n"
+    "- Enfócate en lo que YA se mencionó (síntomas, hallazgos, impresiones).\n"
+    "- NO menciones lo que falta ni des sugerencias.\n"
+    "- Sé objetivo y clínico.\n"
+    "- Si no hay suficiente información, di 'Esperando más información de la consulta...'"
+)
+
+EXPLAIN_SYSTEM_PROMPT = (
+    "Eres un asistente clínico. Para cada cambio de la historia clínica, "
+    "devuelve SOLO un objeto JSON válido con la forma: "
+    '{"explanations":[{"path":"...","reason":"...","evidence":"..."}]}. '
+    "La propiedad 'reason' debe ser breve (<= 18 palabras). "
+    "La propiedad 'evidence' debe ser una cita textual corta (<= 15 palabras) tomada del transcript "
+    "que respalde el valor (cada cambio trae en 'fragmentos' los segmentos candidatos; cítalos de preferencia); "
+    "si no hay una evidencia textual clara, deja evidence como cadena vacía. "
+    "No incluyas texto adicional fuera del objeto JSON. "
+    "Tarea: explicar por qué se añadió/actualizó cada campo del formulario. "
+    "Responde con UN UNICO objeto JSON bajo la clave 'explanations'."
+)
+
+# ------------------ Documentos (Vision) ------------------
+
+DOCUMENT_SYSTEM_PROMPT = """Eres un experto en digitalización de historias clínicas médicas.
+
+Tu tarea es extraer TODA la información visible en el documento médico y estructurarla en formato JSON.
+
+IMPORTANTE:
+- Extrae TODOS los datos que veas, incluso si están incompletos
+- Si un campo no está presente, omítelo del JSON (no pongas null ni cadenas vacías)
+- Mantén la terminología médica original
+- Para fechas, usa formato ISO (YYYY-MM-DD) si es posible
+- Para arrays (síntomas, diagnósticos, tratamientos), incluye todos los items que encuentres
+
+ESTRUCTURA ESPERADA:
+{
+  "afiliacion": {
+    "nombreCompleto": "nombre del paciente",
+    "edad": {"anios": número, "meses": número},
+    "sexo": "masculino/femenino",
+    "dni": "documento",
+    "grupoSangre": "tipo sangre",
+    "fechaHora": "fecha consulta",
+    "seguro": "nombre seguro",
+    "tipoConsulta": "tipo",
+    "numeroSeguro": "número",
+    "motivoConsulta": "motivo"
+  },
+  "anamnesis": {
+    "tiempoEnfermedad": "duración",
+    "sintomasPrincipales": ["síntoma1", "síntoma2"],
+    "relato": "narrativa completa",
+    "funcionesBiologicas": {
+      "apetito": "estado",
+      "sed": "estado",
+      "orina": "estado",
+      "deposiciones": "estado",
+      "sueno": "estado"
+    },
+    "antecedentes": {
+      "personales": ["antecedente1"],
+      "padre": ["antecedente paterno"],
+      "madre": ["antecedente materno"]
+    },
+    "alergias": ["alergia1"],
+    "medicamentos": ["medicamento1"]
+  },
+  "examenClinico": {
+    "signosVitales": {
+      "PA": "presión arterial",
+      "FC": frecuencia cardiaca (número),
+      "FR": frecuencia respiratoria (número),
+      "temperatura": temperatura en °C (número),
+      "SpO2": saturación en % (número),
+      "IMC": índice de masa corporal (número),
+      "peso": peso en kg,
+      "talla": talla en cm
+    },
+    "estadoGeneral": "descripción",
+    "descripcionGeneral": "hallazgos",
+    "sistemas": {
+      "piel": "hallazgos",
+      "cabeza": "hallazgos",
+      "cuello": "hallazgos",
+      "torax": "hallazgos",
+      "pulmones": "hallazgos",
+      "corazon": "hallazgos",
+      "abdomen": "hallazgos",
+      "extremidades": "hallazgos",
+      "neurologico": "hallazgos"
+    }
+  },
+  "diagnosticos": [
+    {"nombre": "diagnóstico", "cie10": "código", "tipo": "presuntivo/definitivo"}
+  ],
+  "tratamientos": [
+    {"medicamento": "nombre", "dosisIndicacion": "dosis e indicaciones", "gtin": "código"}
+  ],
+  "firma": {
+    "medico": "nombre médico",
+    "colegiatura": "número colegiatura",
+    "fecha": "fecha"
+  }
+}
+
+Devuelve SOLO el JSON, sin explicaciones adicionales."""
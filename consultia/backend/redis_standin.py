@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Servidor mínimo compatible con el protocolo Redis (RESP2) para desarrollo local.
+
+Implementa solo los comandos que usa RedisBackend (session_backends.py):
+PING, AUTH, SELECT, GET, SET, DEL, RPUSH, LRANGE, LTRIM, LLEN, EXPIRE.
+Los datos viven en memoria y se pierden al cerrar.
+
+Uso:
+    python redis_standin.py --port 6390
+    SESSION_BACKEND=redis SESSION_BACKEND_URL=redis://localhost:6390/0 uvicorn server:app --workers 4
+"""
+
+import argparse
+import asyncio
+import time
+from typing import Any, Dict, Tuple
+
+
+class Store:
+    def __init__(self):
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+
+    def _alive(self, key: bytes) -> bool:
+        exp = self.expires.get(key)
+        if exp is not None and exp <= time.monotonic():
+            self.data.pop(key, None)
+            self.expires.pop(key, None)
+        return key in self.data
+
+    def _list(self, key: bytes) -> list:
+        return self.data.get(key, []) if self._alive(key) else []
+
+    def execute(self, cmd: bytes, args: list) -> Tuple[str, Any]:
+        cmd = cmd.upper()
+        if cmd == b"PING":
+            return "+", b"PONG"
+        if cmd in (b"AUTH", b"SELECT"):
+            return "+", b"OK"
+        if cmd == b"GET":
+            return "$", self.data.get(args[0]) if self._alive(args[0]) else None
+        if cmd == b"SET":
+            self.data[args[0]] = args[1]
+            self.expires.pop(args[0], None)
+            return "+", b"OK"
+        if cmd == b"DEL":
+            n = 0
+            for k in args:
+                if self._alive(k):
+                    n += 1
+                self.data.pop(k, None)
+                self.expires.pop(k, None)
+            return ":", n
+        if cmd == b"RPUSH":
+            lst = self._list(args[0])
+            lst.extend(args[1:])
+            self.data[args[0]] = lst
+            return ":", len(lst)
+        if cmd == b"LLEN":
+            return ":", len(self._list(args[0]))
+        if cmd in (b"LRANGE", b"LTRIM"):
+            lst = self._list(args[0])
+            start, stop = int(args[1]), int(args[2])
+            n = len(lst)
+            start = max(start + n if start < 0 else start, 0)
+            stop = stop + n if stop < 0 else min(stop, n - 1)
+            part = lst[start:stop + 1]
+            if cmd == b"LRANGE":
+                return "*", part
+            if part:
+                self.data[args[0]] = part
+            else:
+                self.data.pop(args[0], None)
+            return "+", b"OK"
+        if cmd == b"EXPIRE":
+            if not self._alive(args[0]):
+                return ":", 0
+            self.expires[args[0]] = time.monotonic() + int(args[1])
+            return ":", 1
+        return "-", f"ERR unknown command '{cmd.decode(errors='replace')}'".encode()
+
+
+def encode(kind: str, value: Any) -> bytes:
+    if kind in ("+", "-"):
+        return kind.encode() + value + b"\r\n"
+    if kind == ":":
+        return b":%d\r\n" % value
+    if kind == "$":
+        return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode("$", v) for v in value)
+
+
+async def handle(store: Store, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            if not line.startswith(b"*"):
+                continue
+            args = []
+            for _ in range(int(line[1:-2])):
+                n = int((await reader.readline())[1:-2])
+                args.append((await reader.readexactly(n + 2))[:-2])
+            writer.write(encode(*store.execute(args[0], args[1:])))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        writer.close()
+
+
+async def main(host: str, port: int):
+    store = Store()
+    server = await asyncio.start_server(lambda r, w: handle(store, r, w), host, port)
+    print(f"redis_standin escuchando en {host}:{port}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stand-in RESP2 en memoria")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+    asyncio.run(main(args.host, args.port))
@@ -0,0 +1,241 @@
+# relevance.py
+# Filtro local de relevancia por fragmento (antes de run_incremental_update)
+#
+# Cada fragmento "final" disparaba extracción, sugerencias, resumen y explicaciones,
+# incluso "a ver", "bueno" u "ok, siguiente". Aquí se puntúa el fragmento contra un
+# léxico clínico derivado de constants.SCHEMA (nombres de campos, descripciones,
+# enums) + SECTION_KEYWORDS; los fragmentos de relleno no se procesan: se guardan
+# y se anteponen al siguiente fragmento relevante (no se pierde nada).
+# Respuestas cortas con nombres propios ("Juan Pérez"), números ("dos días"),
+# verbos de síntoma ("le duele"), negaciones / respuestas ("niega", "no") o
+# fármacos ("penicilina") siempre pasan. Lo retenido se libera al llegar un
+# fragmento relevante, tras `max_hold` segundos sin uno, o con close() al cerrar.
+
+import asyncio
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from form_context import SECTION_KEYWORDS, normalize_text
+from vitals import words_to_digits
+
+_WORD_RE = re.compile(r"[a-z]+|\d+")
+_CAMEL_RE = re.compile(r"[a-z]+|[A-Z][a-z]*")
+# Palabra con mayúscula inicial en el texto original (nombres, lugares, fármacos)
+_PROPER_RE = re.compile(r"\b[A-ZÁÉÍÓÚÑÜ][a-záéíóúñü]+")
+
+# Duraciones: "dos días", "hace una semana", "desde ayer" (días también es relleno en "buenos días")
+DURATION_WORDS = frozenset((
+    "dia", "dias", "semana", "semanas", "mes", "meses", "ano", "anos", "hora", "horas",
+    "minuto", "minutos", "ayer", "anoche", "anteayer",
+))
+_GREETINGS = frozenset(("buenos", "buenas"))
+
+# Respuestas cortas de síntoma que el léxico del schema no cubre
+SYMPTOM_WORDS = (
+    "duele", "duelen", "dolia", "molesta", "molestan", "arde", "pica", "sangra", "mareado",
+    "mareada", "cansado", "cansada", "vomita", "vomito", "tose", "ahoga", "hinchado", "hinchada",
+)
+
+# Respuestas a preguntas del médico ("¿alergias?" → "ninguna", "niega", "no")
+ANSWER_WORDS = (
+    "no", "si", "niega", "niego", "negativo", "negativa", "positivo", "positiva", "ninguno",
+    "ninguna", "nada", "nunca", "jamas", "tampoco", "afirmativo", "afirma", "refiere", "alergico",
+    "alergica",
+)
+
+# Fármacos y alérgenos frecuentes, dictados en minúscula (sin mayúscula no pasan como nombre propio)
+DRUG_WORDS = (
+    "penicilina", "amoxicilina", "ampicilina", "cefalexina", "ceftriaxona", "azitromicina",
+    "claritromicina", "ciprofloxacino", "levofloxacino", "clindamicina", "metronidazol", "sulfa",
+    "sulfas", "cotrimoxazol", "paracetamol", "acetaminofen", "ibuprofeno", "aspirina", "naproxeno",
+    "diclofenaco", "ketorolaco", "metamizol", "dipirona", "tramadol", "morfina", "codeina",
+    "omeprazol", "ranitidina", "metformina", "insulina", "glibenclamida", "enalapril", "losartan",
+    "amlodipino", "hidroclorotiazida", "furosemida", "atorvastatina", "levotiroxina", "warfarina",
+    "salbutamol", "prednisona", "dexametasona", "loratadina", "cetirizina", "clonazepam",
+    "diazepam", "alprazolam", "sertralina", "fluoxetina", "yodo", "latex", "mariscos", "polen",
+)
+
+# Muletillas y conectores que no aportan contenido clínico
+FILLER_WORDS = frozenset((
+    "a", "ver", "bueno", "ok", "okey", "vale", "listo", "siguiente", "eh", "em", "este", "esta",
+    "mm", "mmm", "aja", "ya", "perfecto", "gracias", "entonces", "ahora", "bien", "claro", "vamos", "continuamos", "continua", "espera", "espere", "momento", "un", "una", "pues",
+    "y", "o", "e", "de", "del", "la", "el", "lo", "los", "las", "que", "en", "con", "por", "para",
+    "al", "se", "me", "te", "le", "nos", "mi", "tu", "su", "muy", "mas", "otra", "otro", "vez",
+    "dime", "digame", "cuenteme", "cuentame", "haber", "oye", "oiga", "hola", "buenos", "buenas",
+    "dias", "tardes", "noches", "adelante", "pase", "tome", "asiento", "seguimos", "sigamos",
+    "exacto", "correcto", "ajam", "hmm", "uh", "ah", "oh", "okay", "dale",
+))
+
+# Palabras genéricas de las descripciones del schema que no indican contenido clínico
+_SCHEMA_STOPWORDS = frozenset((
+    "paciente", "ejemplo", "puede", "solo", "debe", "datos", "informacion", "campo", "valor",
+    "importante", "frases", "indican", "lenguaje", "natural", "interpretar", "cuando", "segun",
+    "sobre", "entre", "cada", "otros", "otras", "todos", "todas", "tiene", "sino", "desde",
+    "hasta", "como", "este", "esta", "estos", "estas", "para", "donde", "cual", "cuales",
+    "principal", "breve", "detallada", "descripcion", "lista", "tipo", "nombre",
+))
+
+_STEM = 5
+
+
+def _camel_words(name: str) -> List[str]:
+    return [w.lower() for w in _CAMEL_RE.findall(name)]
+
+
+def build_lexicon(schema: Dict[str, Any], extra: Iterable[str] = ()) -> Set[str]:
+    """Raíces (primeros 5 chars) de los términos clínicos del schema."""
+    words: Set[str] = set()
+
+    def walk(node: Dict[str, Any]):
+        for name, prop in node.get("properties", {}).items():
+            words.update(_camel_words(name))
+            words.update(_WORD_RE.findall(normalize_text(prop.get("description", ""))))
+            for option in prop.get("enum", []) or []:
+                words.update(_WORD_RE.findall(normalize_text(str(option))))
+            if prop.get("type") == "object":
+                walk(prop)
+            elif isinstance(prop.get("items"), dict):
+                walk(prop["items"])
+
+    walk(schema)
+    lexicon = {
+        w[:_STEM] for w in words
+        if len(w) >= 4 and not w.isdigit() and w not in _SCHEMA_STOPWORDS and w not in FILLER_WORDS
+    }
+    # Palabras clave curadas: se aceptan también las cortas ("tos", "mg", "dni")
+    for term in extra:
+        lexicon.update(w[:_STEM] for w in _WORD_RE.findall(normalize_text(term)) if w not in FILLER_WORDS)
+    return lexicon
+
+
+class RelevanceScorer:
+    """Puntúa qué tan probable es que un fragmento traiga contenido clínico.
+
+    score = (términos clínicos + números) / palabras no-relleno, en [0, 1];
+    0 si el fragmento es solo relleno. Los fragmentos con al menos `min_words`
+    palabras no-relleno se consideran relevantes (discurso largo ≈ contenido).
+    """
+
+    def __init__(self, schema: Dict[str, Any], min_words: int = 6):
+        extra = [w for words in SECTION_KEYWORDS.values() for w in words]
+        extra += SYMPTOM_WORDS + ANSWER_WORDS + DRUG_WORDS
+        self.lexicon = build_lexicon(schema, extra)
+        self.min_words = min_words
+
+    def score(self, fragment: str) -> float:
+        tokens = _WORD_RE.findall(words_to_digits(normalize_text(fragment)))
+        if self._strong(fragment, tokens):
+            return 1.0
+        content = [t for t in tokens if t not in FILLER_WORDS]
+        if not content:
+            return 0.0
+        if len(content) >= self.min_words:
+            return 1.0
+        hits = sum(1 for t in content if t.isdigit() or t[:_STEM] in self.lexicon)
+        return hits / len(content)
+
+    @staticmethod
+    def _strong(fragment: str, tokens: List[str]) -> bool:
+        """Número (en cifras o dictado), duración o nombre propio: nunca es relleno."""
+        for i, t in enumerate(tokens):
+            if t.isdigit():
+                return True
+            if t in DURATION_WORDS and not (i and tokens[i - 1] in _GREETINGS):
+                return True
+        return any(normalize_text(w) not in FILLER_WORDS for w in _PROPER_RE.findall(fragment))
+
+
+class RelevanceStats:
+    """Contadores globales del filtro (para /metrics)."""
+
+    def __init__(self):
+        self.fragments = 0
+        self.passed = 0
+        self.buffered = 0      # fragmentos retenidos (cada uno, una extracción menos)
+        self.released = 0      # relleno liberado por tiempo o al cerrar (sin fragmento relevante detrás)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "fragments": self.fragments,
+            "passed": self.passed,
+            "buffered": self.buffered,
+            "released": self.released,
+            "saved_calls": self.buffered - self.released,
+            "saved_ratio": round((self.buffered - self.released) / self.fragments, 3) if self.fragments else 0.0,
+        }
+
+
+class RelevanceGate:
+    """Filtro por sesión: deja pasar fragmentos relevantes y guarda el relleno.
+
+    El relleno acumulado se antepone al siguiente fragmento relevante, así un
+    "sí" o "no" suelto llega al LLM junto con su contexto.
+
+    Args:
+        scorer: RelevanceScorer compartido.
+        threshold: Score mínimo para procesar el fragmento (0 = dejar pasar todo).
+        stats: Contadores globales.
+        max_buffer_chars: Si el relleno acumulado supera esto, se procesa igual.
+        max_hold: Segundos que el relleno puede quedar retenido sin que llegue un
+            fragmento relevante; al vencer se entrega a `on_release` (0 = sin límite).
+        on_release: Callback con el texto liberado por tiempo.
+    """
+
+    def __init__(
+        self,
+        scorer: RelevanceScorer,
+        threshold: float,
+        stats: RelevanceStats,
+        max_buffer_chars: int = 400,
+        max_hold: float = 0,
+        on_release: Optional[Callable[[str], None]] = None,
+    ):
+        self._scorer = scorer
+        self._threshold = threshold
+        self._stats = stats
+        self._max_buffer_chars = max_buffer_chars
+        self._max_hold = max_hold
+        self._on_release = on_release
+        self._pending: List[str] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def check(self, fragment: str) -> str:
+        """Devuelve el texto a procesar ("" si el fragmento quedó en espera)."""
+        self._stats.fragments += 1
+        pending_chars = sum(len(p) + 1 for p in self._pending)
+        if (
+            self._threshold > 0
+            and self._scorer.score(fragment) < self._threshold
+            and pending_chars + len(fragment) <= self._max_buffer_chars
+        ):
+            self._pending.append(fragment)
+            self._stats.buffered += 1
+            if self._max_hold > 0 and self._on_release is not None and self._timer is None:
+                self._timer = asyncio.get_running_loop().call_later(self._max_hold, self._release)
+            return ""
+        self._stats.passed += 1
+        self._pending.append(fragment)
+        return self.flush()
+
+    def flush(self) -> str:
+        """Entrega lo retenido ("" si no hay nada) y cancela el timer."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        text = " ".join(self._pending)
+        self._pending.clear()
+        return text
+
+    def close(self) -> str:
+        """Entrega lo retenido al cerrar la sesión; como no lo absorbió un fragmento
+        relevante, cuenta como liberado (no como llamada ahorrada)."""
+        text = self.flush()
+        if text:
+            self._stats.released += 1
+        return text
+
+    def _release(self) -> None:
+        self._timer = None
+        text = self.close()
+        if text:
+            self._on_release(text)
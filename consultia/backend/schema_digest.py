@@ -0,0 +1,89 @@
+# schema_digest.py
+# Representación compacta de constants.SCHEMA para los prompts
+# - Se compila UNA vez al importar: ruta corta, tipo, enum y una pista condensada
+#   (primera oración de la descripción) por campo
+# - render(sections) permite enviar solo las secciones relevantes (afiliacion,
+#   anamnesis, ...); el resultado se cachea por combinación de secciones
+#
+# Ejemplo de salida:
+#   afiliacion.sexo: enum(masculino|femenino) — Sexo biológico o género del paciente.
+#   diagnosticos: [{nombre:str, tipo:enum(presuntivo|definitivo), cie10:str}] — Diagnósticos clínicos del paciente.
+
+import re
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from constants import SCHEMA
+
+_TYPE_NAMES = {"string": "str", "integer": "int", "number": "num", "boolean": "bool", "null": "null"}
+
+
+def _type_of(node: Dict[str, Any]) -> str:
+    """Tipo corto de un nodo: str, int|null, enum(a|b), [str], [{...}], ..."""
+    if "enum" in node:
+        return "enum(" + "|".join(str(v) for v in node["enum"]) + ")"
+    t = node.get("type")
+    if t == "array":
+        items = node.get("items") or {}
+        if items.get("type") == "object":
+            fields = ", ".join(f"{k}:{_type_of(v)}" for k, v in items.get("properties", {}).items())
+            return "[{" + fields + "}]"
+        return "[" + _type_of(items) + "]"
+    if isinstance(t, list):
+        return "|".join(_TYPE_NAMES.get(x, x) for x in t)
+    return _TYPE_NAMES.get(t, t or "any")
+
+
+def _hint(description: str, max_chars: int) -> str:
+    """Primera oración de la descripción, recortada a max_chars."""
+    if not description:
+        return ""
+    first = re.split(r"(?<=[.!?])\s", description.strip(), maxsplit=1)[0]
+    if len(first) > max_chars:
+        first = first[: max_chars - 1].rstrip() + "…"
+    return first
+
+
+class SchemaDigest:
+    """Digest compacto de un JSON Schema, agrupado por sección de primer nivel.
+
+    Args:
+        schema: JSON Schema (normalmente constants.SCHEMA).
+        max_hint: Largo máximo de cada pista.
+    """
+
+    def __init__(self, schema: Dict[str, Any], max_hint: int = 80):
+        self._max_hint = max_hint
+        self._lines: Dict[str, List[str]] = {}
+        for section, node in schema.get("properties", {}).items():
+            lines: List[str] = []
+            self._compile(node, section, lines)
+            self._lines[section] = lines
+
+    @property
+    def sections(self) -> Tuple[str, ...]:
+        return tuple(self._lines)
+
+    def _compile(self, node: Dict[str, Any], path: str, out: List[str]) -> None:
+        if node.get("type") == "object" and "properties" in node:
+            for key, child in node["properties"].items():
+                self._compile(child, f"{path}.{key}", out)
+            return
+        line = f"{path}: {_type_of(node)}"
+        hint = _hint(node.get("description", ""), self._max_hint)
+        if hint:
+            line += f" — {hint}"
+        out.append(line)
+
+    def render(self, sections: Optional[Iterable[str]] = None) -> str:
+        """Texto del digest; `sections` limita a esas secciones (en orden del schema)."""
+        key = None if sections is None else tuple(s for s in self._lines if s in set(sections))
+        return self._render(key)
+
+    @lru_cache(maxsize=64)
+    def _render(self, sections: Optional[Tuple[str, ...]]) -> str:
+        names = self._lines if sections is None else sections
+        return "\n".join(line for s in names for line in self._lines[s])
+
+
+SCHEMA_DIGEST = SchemaDigest(SCHEMA)
@@ -2,26 +2,56 @@
 # Backend para Consult-IA
 # - WebSocket /ws: recibe parciales/finales de voz a texto
 # - Llama a OpenAI: (a) respuesta en streaming (tokens) y (b) JSON del formulario (schema)
-# - Devuelve al cliente: assistant_token (stream), form_update (JSON), missing, suggestions
+# - Devuelve al cliente: assistant_token (stream), form_update (JSON Patch por
+#   revisión; snapshot al conectar o ante "resync"), missing, completeness
+#   (% por sección), suggestions_update
+#   y form_delta (en paralelo, después del form_update)
 #
 # Ejecutar:
 #   setx OPENAI_API_KEY "tu_api_key"   (Windows, cerrar/reabrir terminal)
 #   uvicorn server:app --host 0.0.0.0 --port 8001 --reload
 
-import os, json, asyncio, base64, io
-from typing import Dict, Any, Optional, List
+import os, json, asyncio, hashlib, io, time, uuid
+from typing import Dict, Any, Optional, List, Tuple
+from concurrent.futures import ThreadPoolExecutor
 import logging
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, logger, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from fastapi.websockets import WebSocketState
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from constants import SCHEMA, REQUIRED_KEYS
+from constants import SCHEMA, REQUIRED_KEYS, REQUIRED_KEYS_BY_SPECIALTY
 from PIL import Image
 
-# SDK OpenAI nuevo (>=1.0)
-from openai import OpenAI
+# Cliente AsyncOpenAI compartido (pool httpx, ver llm.py)
+from llm import chat_completion, close_client, record_usage, usage_stats, llm_cache
+from pipeline import SessionUpdatePipeline, SummaryDebouncer, FollowUpTasks
+from token_stream import TokenBatcher, LatencyStats
+from form_context import build_form_context
+from history import new_history, push_fragment, build_messages
+from session_store import SessionManager
+from session_backends import make_backend, meta_op, segment_op, set_ops
+from transcript import Transcript
+from vitals import extract_vitals, VitalsStats
+from relevance import RelevanceScorer, RelevanceGate, RelevanceStats
+from document_store import DocumentStore
+from image_prep import preprocess_image
+from uploads import (
+    UploadTooLarge, UploadStats, UploadLimitMiddleware, upload_hasher, hash_upload, take_upload_file,
+    spool_upload, image_data_url
+)
+from form_patch import changes_to_patch, PatchStats
+from form_diff import compute_deltas
+from form_merge import FormMerger
+from completeness import Completeness, build_rule_sets
+from form_coerce import DeltaCoercer, CoercionStats
+from prompts import (
+    form_system_prompt, full_form_system_prompt, delta_system_prompt, combined_system_prompt,
+    PATCH_SYSTEM_PROMPT, SUGGESTIONS_SYSTEM_PROMPT, SUMMARY_SYSTEM_PROMPT, EXPLAIN_SYSTEM_PROMPT,
+    DOCUMENT_SYSTEM_PROMPT
+)
 
 # ------------------ Config ------------------
 
@@ -35,8 +65,121 @@ if not OPENAI_API_KEY:
 # Modelos: puedes subir a gpt-4o si deseas mejor razonamiento, o bajar a mini para costo/latencia
 OPENAI_MODEL_TEXT = os.getenv("OPENAI_MODEL_TEXT", "gpt-4o-mini")   # texto en streaming
 OPENAI_MODEL_JSON = os.getenv("OPENAI_MODEL_JSON", "gpt-4o-mini")   # structured outputs
+OPENAI_MODEL_VISION = os.getenv("OPENAI_MODEL_VISION", "gpt-4o")     # /extract-document (visión)
+
+# Extracción por fragmento:
+#   chain    = delta, sugerencias y explicaciones en llamadas separadas (comportamiento original)
+#   combined = una sola llamada estructurada devuelve las tres cosas (menos latencia y tokens)
+EXTRACTION_MODE = os.getenv("EXTRACTION_MODE", "chain").lower()
+
+# Schema en los prompts: full = JSON Schema completo, compact = digest (schema_digest.py),
+# none = sin schema. PROMPT_SCHEMA_MODE es el default de las llamadas de formulario
+# (_FORM incremental, _FULL_FORM); delta y combinado van una vez por fragmento y por
+# defecto no llevan schema (PROMPT_SCHEMA_MODE_DELTA / _COMBINED para cambiarlo)
+PROMPT_SCHEMA_MODE = os.getenv("PROMPT_SCHEMA_MODE", "full").lower()
+SCHEMA_MODES = {
+    call: os.getenv(f"PROMPT_SCHEMA_MODE_{call.upper()}", default).lower()
+    for call, default in (
+        ("delta", "none"), ("combined", "none"),
+        ("form", PROMPT_SCHEMA_MODE), ("full_form", PROMPT_SCHEMA_MODE),
+    )
+}
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# Formulario que se envía al LLM (ver form_context.py):
+#   full     = json_state completo (con todos los null)
+#   pruned   = sin vacíos, textos > FORM_CONTEXT_MAX_TEXT y listas > FORM_CONTEXT_MAX_ITEMS recortados
+#   sections = pruned + solo las secciones que el fragmento probablemente toca
+FORM_CONTEXT_MODE = os.getenv("FORM_CONTEXT_MODE", "pruned").lower()
+FORM_CONTEXT_MAX_TEXT = int(os.getenv("FORM_CONTEXT_MAX_TEXT", "300"))
+FORM_CONTEXT_MAX_ITEMS = int(os.getenv("FORM_CONTEXT_MAX_ITEMS", "20"))
+
+# Historial de extract_form_incremental (ver history.py):
+#   bounded = system + últimos INCREMENTAL_HISTORY_K fragmentos + snapshot actual del formulario;
+#             los fragmentos más viejos se condensan en INCREMENTAL_OLDER_MAX_CHARS (0 = descartar)
+#   full    = conversación completa sin límite (comportamiento original)
+INCREMENTAL_HISTORY = os.getenv("INCREMENTAL_HISTORY", "bounded").lower()
+INCREMENTAL_HISTORY_K = int(os.getenv("INCREMENTAL_HISTORY_K", "6"))
+INCREMENTAL_OLDER_MAX_CHARS = int(os.getenv("INCREMENTAL_OLDER_MAX_CHARS", "1500"))
+
+# Pre-extractor local de signos vitales / edad (ver vitals.py): si cubre todo el
+# fragmento no se llama al LLM; si cubre una parte, sus valores se suman al delta del LLM
+PRE_EXTRACT_VITALS = os.getenv("PRE_EXTRACT_VITALS", "1") == "1"
+
+# Validación / coerción local de lo que devuelve el LLM contra SCHEMA (ver form_coerce.py):
+# descarta claves desconocidas, "38°C" → 38, "M" → "masculino". 0 = usar el JSON tal cual
+COERCE_DELTAS = os.getenv("COERCE_DELTAS", "1") == "1"
+
+# Filtro de relevancia (ver relevance.py): los fragmentos con score < RELEVANCE_THRESHOLD
+# ("a ver", "bueno", "ok, siguiente") no disparan extracción ni resumen; se anteponen al
+# siguiente fragmento relevante. 0 = procesar todo. Con >= RELEVANCE_MIN_WORDS palabras
+# de contenido el fragmento siempre pasa; el relleno acumulado nunca supera RELEVANCE_MAX_BUFFER_CHARS.
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", "0.25"))
+RELEVANCE_MIN_WORDS = int(os.getenv("RELEVANCE_MIN_WORDS", "6"))
+RELEVANCE_MAX_BUFFER_CHARS = int(os.getenv("RELEVANCE_MAX_BUFFER_CHARS", "400"))
+# Si tras RELEVANCE_MAX_HOLD_MS no llegó un fragmento relevante, lo retenido se procesa igual
+# (0 = esperar indefinidamente; al desconectar siempre se procesa)
+RELEVANCE_MAX_HOLD_MS = int(os.getenv("RELEVANCE_MAX_HOLD_MS", "4000"))
+
+# Timeouts (segundos) de los mensajes de seguimiento en modo chain
+SUGGESTIONS_TIMEOUT_S = float(os.getenv("SUGGESTIONS_TIMEOUT_S", "8"))
+EXPLAIN_TIMEOUT_S = float(os.getenv("EXPLAIN_TIMEOUT_S", "10"))
+
+# Máximo de lotes en cola por sesión antes de agrupar fragmentos (ver pipeline.py)
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", "8"))
+
+# Resumen narrativo: espera SUMMARY_QUIET_MS sin fragmentos nuevos, pero nunca más de
+# SUMMARY_MAX_WAIT_MS desde el primer fragmento pendiente (ver SummaryDebouncer)
+SUMMARY_QUIET_MS = int(os.getenv("SUMMARY_QUIET_MS", "1200"))
+SUMMARY_MAX_WAIT_MS = int(os.getenv("SUMMARY_MAX_WAIT_MS", "5000"))
+
+# Streaming del resumen: 0 = fallback sin streaming (respuesta completa de golpe)
+SUMMARY_STREAMING = os.getenv("SUMMARY_STREAMING", "1") == "1"
+# Frames assistant_token: se envían cada STREAM_FRAME_MS o al juntar STREAM_FRAME_CHARS
+STREAM_FRAME_MS = int(os.getenv("STREAM_FRAME_MS", "50"))
+STREAM_FRAME_CHARS = int(os.getenv("STREAM_FRAME_CHARS", "64"))
+
+# Sesiones: expiran tras SESSION_TTL_S sin actividad (0 = nunca); si la memoria estimada
+# supera SESSION_MAX_BYTES (o hay más de SESSION_MAX_COUNT) se desalojan las menos usadas.
+# Las sesiones con un WebSocket abierto nunca se desalojan.
+SESSION_TTL_S = float(os.getenv("SESSION_TTL_S", "3600"))
+SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", str(256 * 1024 * 1024)))
+SESSION_MAX_COUNT = int(os.getenv("SESSION_MAX_COUNT", "0"))
+SESSION_SWEEP_S = float(os.getenv("SESSION_SWEEP_S", "60"))
+# Backend compartido entre workers (ver session_backends.py):
+#   "" (solo RAM del proceso) | memory | sqlite (SESSION_BACKEND_URL = ruta .db) | redis (redis://host:port/db)
+# Se guarda un log de ops incrementales y cada SESSION_LOG_MAX ops se compacta en un snapshot.
+SESSION_BACKEND = os.getenv("SESSION_BACKEND", "").lower()
+SESSION_BACKEND_URL = os.getenv("SESSION_BACKEND_URL", "")
+SESSION_LOG_MAX = int(os.getenv("SESSION_LOG_MAX", "200"))
+
+# /extract-document: resultados por hash del archivo en DOCUMENT_STORE_DIR ("" = no guardar;
+# las subidas simultáneas del mismo archivo se agrupan igual), hasta DOCUMENT_STORE_MAX_BYTES
+DOCUMENT_STORE_DIR = os.getenv("DOCUMENT_STORE_DIR", os.path.join(os.path.dirname(__file__), ".document_store"))
+DOCUMENT_STORE_MAX_BYTES = int(os.getenv("DOCUMENT_STORE_MAX_BYTES", str(256 * 1024 * 1024)))
+# PDFs multipágina: hasta DOCUMENT_MAX_PAGES páginas, renderizadas con DOCUMENT_RENDER_THREADS
+# procesos de pdftoppm y extraídas con a lo sumo DOCUMENT_PAGE_CONCURRENCY llamadas simultáneas
+DOCUMENT_MAX_PAGES = int(os.getenv("DOCUMENT_MAX_PAGES", "10"))
+DOCUMENT_RENDER_THREADS = int(os.getenv("DOCUMENT_RENDER_THREADS", "4"))
+DOCUMENT_PAGE_CONCURRENCY = int(os.getenv("DOCUMENT_PAGE_CONCURRENCY", "3"))
+# Preprocesamiento de imágenes (ver image_prep.py): 0 = enviar el archivo / render tal cual
+DOCUMENT_PREPROCESS = os.getenv("DOCUMENT_PREPROCESS", "1") == "1"
+DOCUMENT_GRAYSCALE = os.getenv("DOCUMENT_GRAYSCALE", "1") == "1"
+DOCUMENT_DESKEW = os.getenv("DOCUMENT_DESKEW", "1") == "1"
+DOCUMENT_CROP = os.getenv("DOCUMENT_CROP", "1") == "1"
+DOCUMENT_MAX_TILES = int(os.getenv("DOCUMENT_MAX_TILES", "0"))          # 0 = los del contenido a la escala de la API
+DOCUMENT_IMAGE_FORMAT = os.getenv("DOCUMENT_IMAGE_FORMAT", "JPEG").upper()  # JPEG | WEBP | PNG
+DOCUMENT_IMAGE_QUALITY = int(os.getenv("DOCUMENT_IMAGE_QUALITY", "85"))
+DOCUMENT_DETAIL = os.getenv("DOCUMENT_DETAIL", "high")                   # high | low | auto
+# Subidas (ver uploads.py): tope de tamaño (413 al superarlo, por Content-Length si viene)
+# e hilos del pool donde corren hash, copia de PDFs, render y codificación
+DOCUMENT_MAX_UPLOAD_BYTES = int(os.getenv("DOCUMENT_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))  # = tope del front
+DOCUMENT_WORKERS = int(os.getenv("DOCUMENT_WORKERS", "4"))
+# Cambia si cambian el modelo o el prompt de visión (invalida resultados anteriores)
+DOCUMENT_EXTRACTOR_VERSION = hashlib.sha256(
+    f"{OPENAI_MODEL_VISION}\n{DOCUMENT_MAX_PAGES}\n{DOCUMENT_DETAIL}\n"
+    f"{DOCUMENT_PREPROCESS}{DOCUMENT_GRAYSCALE}{DOCUMENT_DESKEW}{DOCUMENT_CROP}{DOCUMENT_MAX_TILES}"
+    f"{DOCUMENT_IMAGE_FORMAT}{DOCUMENT_IMAGE_QUALITY}{COERCE_DELTAS}\n{DOCUMENT_SYSTEM_PROMPT}".encode("utf-8")
+).hexdigest()[:16]
 
 # Permite a tu front en http://localhost:4200 (ajusta para producción)
 ALLOWED_ORIGINS = os.getenv("ALLOWED_ORIGINS", "http://localhost:4200,http://127.0.0.1:4200").split(",")
@@ -54,38 +197,91 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Memoria simple por sesión (RAM)
-sessions: Dict[str, Dict[str, Any]] = {}
+@app.on_event("shutdown")
+async def _shutdown():
+    # Cierra el pool httpx compartido hacia OpenAI
+    await close_client()
+    await sessions.stop()
+    await sessions.close_backend()
+    DOCUMENT_EXECUTOR.shutdown(wait=False)
+
+# Métricas de time-to-first-token del resumen (stream vs fallback)
+SUMMARY_LATENCY = LatencyStats()
+# Tasa de aciertos del pre-extractor de signos vitales
+VITALS_STATS = VitalsStats()
+# Resultados de /extract-document por hash del contenido (ver document_store.py)
+document_store = DocumentStore(DOCUMENT_STORE_DIR, max_bytes=DOCUMENT_STORE_MAX_BYTES)
+# Pool propio para el trabajo de CPU / disco de los documentos: varias subidas a la vez no
+# ocupan el pool por defecto de asyncio (to_thread) ni se reparten todos los núcleos
+DOCUMENT_EXECUTOR = ThreadPoolExecutor(max_workers=max(1, DOCUMENT_WORKERS), thread_name_prefix="document")
+UPLOAD_STATS = UploadStats()
+
+def _count_rejected_upload():
+    UPLOAD_STATS.rejected += 1
+
+# 413 antes de recibir / escribir a disco el multipart completo (ver uploads.py)
+app.add_middleware(
+    UploadLimitMiddleware,
+    limit=DOCUMENT_MAX_UPLOAD_BYTES,
+    paths=("/extract-document",),
+    on_reject=_count_rejected_upload,
+)
+# Filtro de relevancia: léxico compilado una vez desde el schema, contadores globales
+RELEVANCE_SCORER = RelevanceScorer(SCHEMA, min_words=RELEVANCE_MIN_WORDS)
+RELEVANCE_STATS = RelevanceStats()
+# Mezcla de deltas compilada desde el schema (listas con append + dedupe, copy-on-write)
+FORM_MERGER = FormMerger(SCHEMA)
+# Bytes de form_update enviados como patch vs snapshot
+FORM_PATCH_STATS = PatchStats()
+# Coerción de deltas del LLM compilada desde el schema, con reparaciones por campo
+COERCION_STATS = CoercionStats()
+DELTA_COERCER = DeltaCoercer(SCHEMA, COERCION_STATS)
+# Campos requeridos compilados una vez ("" = REQUIRED_KEYS; + uno por especialidad)
+REQUIRED_RULES = build_rule_sets(REQUIRED_KEYS, REQUIRED_KEYS_BY_SPECIALTY, SCHEMA)
+
+# Sesiones en RAM con TTL por inactividad y presupuesto de memoria (ver session_store.py),
+# opcionalmente respaldadas en un backend compartido por los workers
+sessions = SessionManager(
+    ttl=SESSION_TTL_S,
+    max_bytes=SESSION_MAX_BYTES,
+    max_sessions=SESSION_MAX_COUNT,
+    backend=make_backend(SESSION_BACKEND, SESSION_BACKEND_URL, ttl=SESSION_TTL_S),
+    log_max=SESSION_LOG_MAX,
+)
+
+@app.on_event("startup")
+async def _startup():
+    sessions.start(interval=SESSION_SWEEP_S)
 
 # ------------------ Utilidades ------------------
 
+def coerce_delta(delta: Any) -> dict:
+    """Ajusta un JSON del LLM al schema (tipos, enums, claves); {} si no es un objeto."""
+    if not COERCE_DELTAS:
+        return delta if isinstance(delta, dict) else {}
+    clean, repairs = DELTA_COERCER.coerce(delta)
+    if repairs:
+        logger.debug(f"[COERCE] {len(repairs)} reparaciones: {repairs[:10]}")
+    return clean
+
 def compute_missing(form: Dict[str, Any]) -> List[str]:
-    """Evalúa campos mínimos requeridos (ruta con puntos)."""
-    missing: List[str] = []
-
-    def exists(path: str) -> bool:
-        parts = path.split(".")
-        cur: Any = form
-        for p in parts:
-            if isinstance(cur, list):
-                # lista no valida para seguir por clave
-                return len(cur) > 0
-            if not isinstance(cur, dict) or p not in cur:
-                return False
-            cur = cur[p]
-        if cur is None:
-            return False
-        if isinstance(cur, str):
-            return cur.strip() != ""
-        if isinstance(cur, list):
-            return len(cur) > 0
-        return True
+    """Evalúa campos mínimos requeridos (ruta con puntos) de un formulario suelto.
 
-    for k in REQUIRED_KEYS:
-        if not exists(k):
-            missing.append(k)
+    Para el formulario de una sesión usar session_completeness (incremental).
+    """
+    return REQUIRED_RULES[""].evaluate(form).missing_paths()
+
+def session_rules(state: dict):
+    """Reglas de la especialidad de la sesión (las base si no tiene o no existe)."""
+    return REQUIRED_RULES.get(state.get("specialty") or "", REQUIRED_RULES[""])
 
-    return missing
+def session_completeness(state: dict) -> Completeness:
+    """Requeridos faltantes de json_state; se evalúa completo solo la primera vez
+    (sesión nueva o recargada del backend), después lo mantiene run_incremental_update."""
+    completeness = state.get("completeness")
+    if completeness is None:
+        completeness = state["completeness"] = session_rules(state).evaluate(state["json_state"])
+    return completeness
 
 def build_suggestions(missing: List[str]) -> List[str]:
     """Genera sugerencias basadas en campos faltantes (fallback antiguo)."""
@@ -97,7 +293,9 @@ def build_suggestions(missing: List[str]) -> List[str]:
     }
     return [tips_map[m] for m in missing if m in tips_map]
 
-async def generate_contextual_suggestions(transcript: str, current_form: dict, recent_fragment: str = "") -> List[str]:
+async def generate_contextual_suggestions(
+    transcript: Transcript, current_form: dict, recent_fragment: str = "", missing: Optional[List[str]] = None
+) -> List[str]:
     """
     Genera sugerencias CONTEXTUALES Y DINÁMICAS basadas en:
     - Lo que se acaba de decir (recent_fragment)
@@ -105,8 +303,10 @@ async def generate_contextual_suggestions(transcript: str, current_form: dict, r
     - El estado actual del formulario (current_form)
 
     Las sugerencias son proactivas y ayudan al médico a completar la consulta.
+    `missing` viene del seguimiento incremental de la sesión; None = calcularlo.
     """
-    missing = compute_missing(current_form)
+    if missing is None:
+        missing = compute_missing(current_form)
 
     # Mapeo amigable
     missing_friendly_map = {
@@ -118,56 +318,31 @@ async def generate_contextual_suggestions(transcript: str, current_form: dict, r
 
     missing_friendly = [missing_friendly_map.get(m, m) for m in missing]
 
-    # Prompt para generar sugerencias contextuales
-    system = (
-        "Eres un asistente clínico inteligente. Tu tarea es generar 1-3 sugerencias CONTEXTUALES "
-        "para ayudar al médico a completar la historia clínica.\n\n"
-
-        "IMPORTANTE:\n"
-        "- Las sugerencias deben ser ESPECÍFICAS al contexto de lo que se está diciendo.\n"
-        "- NO solo decir 'falta X campo' - ser PROACTIVO y contextual.\n"
-        "- Basarte en lo que el médico acaba de decir para sugerir el siguiente paso lógico.\n"
-        "- Cada sugerencia debe ser breve (máximo 15 palabras) y accionable.\n\n"
-
-        "EJEMPLOS DE BUENAS SUGERENCIAS:\n"
-        "✓ 'Pregunte cuánto tiempo lleva con fiebre' (si mencionó fiebre)\n"
-        "✓ 'Indague antecedentes de hipertensión familiar' (si mencionó presión alta)\n"
-        "✓ 'Considere solicitar hemograma completo' (si hay signos de infección)\n"
-        "✓ 'Registre peso y talla para calcular IMC' (si está en examen físico)\n"
-        "✓ 'Especifique dosis del paracetamol' (si mencionó paracetamol sin dosis)\n\n"
-
-        "EJEMPLOS DE MALAS SUGERENCIAS (evitar):\n"
-        "✗ 'Falta el diagnóstico' (muy genérico)\n"
-        "✗ 'Complete el formulario' (obvio y poco útil)\n"
-        "✗ 'Registre datos del paciente' (demasiado vago)\n\n"
-
-        "Devuelve UN ÚNICO objeto JSON con formato:\n"
-        '{"suggestions": ["sugerencia 1", "sugerencia 2", ...]}\n\n'
-
-        "Si no hay nada relevante que sugerir, devuelve: {\"suggestions\": []}"
-    )
-
-    # Construir contexto para la IA
+    # Construir contexto para la IA (lo más cambiante al final)
     context_parts = []
 
-    if recent_fragment:
-        context_parts.append(f"FRAGMENTO RECIENTE (lo que acaba de decir): {recent_fragment}")
+    if missing_friendly:
+        context_parts.append(f"CAMPOS FALTANTES: {', '.join(missing_friendly)}\n")
 
-    context_parts.append(f"\nTRANSCRIPCIÓN COMPLETA:\n{transcript[-1500:]}")  # Últimos 1500 chars
+    # Solo lo ya llenado (sin nulls) y con textos largos recortados
+    form_ctx, _ = build_form_context(current_form, mode="pruned" if FORM_CONTEXT_MODE != "full" else "full",
+                                     max_text=FORM_CONTEXT_MAX_TEXT, max_items=FORM_CONTEXT_MAX_ITEMS)
+    context_parts.append(f"FORMULARIO ACTUAL (JSON):\n{json.dumps(form_ctx, ensure_ascii=False)}\n")
 
-    context_parts.append(f"\n\nFORMULARIO ACTUAL (JSON):\n{json.dumps(current_form, ensure_ascii=False)}")
+    context_parts.append(f"TRANSCRIPCIÓN COMPLETA:\n{transcript.tail(1500)}\n")  # Últimos 1500 chars
 
-    if missing_friendly:
-        context_parts.append(f"\n\nCAMPOS FALTANTES: {', '.join(missing_friendly)}")
+    if recent_fragment:
+        context_parts.append(f"FRAGMENTO RECIENTE (lo que acaba de decir): {recent_fragment}")
 
     user_content = "\n".join(context_parts)
 
     try:
         logger.info("[SUGGESTIONS] Generating contextual suggestions...")
-        resp = client.chat.completions.create(
+        resp = await chat_completion(
+            "suggestions",
             model=OPENAI_MODEL_JSON,
             messages=[
-                {"role": "system", "content": system},
+                {"role": "system", "content": SUGGESTIONS_SYSTEM_PROMPT},
                 {"role": "user", "content": user_content}
             ],
             temperature=0.7,  # Un poco de creatividad para sugerencias variadas
@@ -189,7 +364,7 @@ async def generate_contextual_suggestions(transcript: str, current_form: dict, r
 
 # ------------------ OpenAI helpers ------------------
 
-async def stream_summary(ws: WebSocket, transcript: str, current_form: dict = None):
+async def stream_summary(ws: WebSocket, transcript: Transcript, current_form: dict = None):
     """Envía SOLO el resumen narrativo de IA en streaming (token a token).
 
     Este resumen debe ser puramente informativo sobre lo que se ha dicho,
@@ -200,17 +375,7 @@ async def stream_summary(ws: WebSocket, transcript: str, current_form: dict = No
         transcript: Transcript completo acumulado
         current_form: Estado actual del formulario (para contexto interno)
     """
-    # Prompt para resumen NARRATIVO puro
-    system = (
-        "Eres un asistente clínico. Resume de forma NARRATIVA lo que se ha dicho en la consulta.\n"
-        "- Resume en 2-3 oraciones máximo.\n"
-        "- Enfócate en lo que YA se mencionó (síntomas, hallazgos, impresiones).\n"
-        "- NO menciones lo que falta ni des sugerencias.\n"
-        "- Sé objetivo y clínico.\n"
-        "- Si no hay suficiente información, di 'Esperando más información de la consulta...'"
-    )
-
-    user_content = transcript[-2000:]  # Últimos 2000 caracteres para evitar prompts muy largos
+    user_content = transcript.tail(2000)  # Últimos 2000 caracteres para evitar prompts muy largos
 
     # notifica al frontend que reinicia el stream
     logger.info(f"[AI SUMMARY] stream_summary ENTER len={len(transcript)}")
@@ -218,43 +383,62 @@ async def stream_summary(ws: WebSocket, transcript: str, current_form: dict = No
 
     await ws.send_json({"type": "assistant_reset"})
 
-    # OPCIÓN 1: Intentar con streaming real
-    USE_STREAMING = False  # Cambiar a True cuando funcione el streaming
+    started = time.perf_counter()
 
-    if USE_STREAMING:
+    # OPCIÓN 1: streaming real (tokens agrupados en frames, ver token_stream.py)
+    if SUMMARY_STREAMING:
         logger.info("[AI] Calling OpenAI WITH streaming...")
-        stream = client.chat.completions.create(
+        stream = await chat_completion(
+            "summary_stream",
             model=OPENAI_MODEL_TEXT,
             messages=[
-                {"role": "system", "content": system},
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
                 {"role": "user", "content": user_content}
             ],
             temperature=1.0,
             max_tokens=150,
-            stream=True
+            stream=True,
+            stream_options={"include_usage": True}
+        )
+        batcher = TokenBatcher(
+            ws.send_json,
+            max_delay=STREAM_FRAME_MS / 1000,
+            max_chars=STREAM_FRAME_CHARS,
+        )
+        ttft = None
+        try:
+            async for chunk in stream:
+                if chunk.usage is not None:
+                    record_usage("summary_stream", chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    if ttft is None:
+                        ttft = time.perf_counter() - started
+                    batcher.push(delta)
+            await batcher.aclose()
+        except BaseException:
+            # Cancelado por un resumen más nuevo o error: descartar lo pendiente
+            batcher.cancel()
+            await stream.close()
+            raise
+
+        total = time.perf_counter() - started
+        SUMMARY_LATENCY.record("stream", ttft, total)
+        logger.info(
+            f"[AI] COMPLETE. deltas={batcher.deltas_in} frames={batcher.frames_out} "
+            f"ttft={(ttft or 0) * 1000:.0f}ms total={total * 1000:.0f}ms"
         )
-        logger.info("[AI] Stream created, reading tokens...")
-        token_count = 0
-        for chunk in stream:
-            try:
-                delta = chunk.choices[0].delta.get("content")
-            except Exception as e:
-                logger.warning(f"[AI] Error getting delta: {e}")
-                delta = None
-            if delta:
-                token_count += 1
-                logger.info(f"[AI] Token #{token_count}: {repr(delta[:30])}")
-                await ws.send_json({"type": "assistant_token", "delta": delta})
-
-        logger.info(f"[AI] COMPLETE. Sent {token_count} tokens")
 
     else:
         # OPCIÓN 2: SIN streaming - enviar todo de golpe
         logger.info("[AI] Calling OpenAI WITHOUT streaming (fallback)...")
-        response = client.chat.completions.create(
+        response = await chat_completion(
+            "summary",
             model=OPENAI_MODEL_TEXT,
             messages=[
-                {"role": "system", "content": system},
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
                 {"role": "user", "content": user_content}
             ],
             temperature=1.0,
@@ -264,33 +448,26 @@ async def stream_summary(ws: WebSocket, transcript: str, current_form: dict = No
         full_text = response.choices[0].message.content or ""
         logger.info(f"[AI] Got response: {full_text[:100]}...")
 
-        # Enviar todo el texto de golpe
+        # Enviar todo el texto de golpe (el primer token visible llega al final)
+        total = time.perf_counter() - started
+        SUMMARY_LATENCY.record("fallback", total, total)
         if full_text:
             await ws.send_json({"type": "assistant_token", "delta": full_text})
-            logger.info(f"[AI] COMPLETE. Sent full response ({len(full_text)} chars)")
+            logger.info(f"[AI] COMPLETE. Sent full response ({len(full_text)} chars) ttft={total * 1000:.0f}ms")
 
 async def extract_form_patch(session_id: str, new_fragment: str) -> list[dict]:
     state = sessions[session_id]
 
-    sys = (
-        "Eres un asistente clínico. Tu tarea es mantener un objeto JSON de historia clínica actualizado.\n"
-        "Se te dará el estado actual del formulario y un fragmento de transcripción.\n"
-        "Devuelve SOLO un arreglo JSON con operaciones tipo JSON Patch (RFC6902).\n"
-        "Cada operación debe ser {op, path, value}.\n"
-        "Usa paths estilo /afiliacion/nombreCompleto, /anamnesis/sintomasPrincipales/- para agregar.\n"
-        "Si el fragmento no aporta información nueva, devuelve [].\n"
-        "Devuelve SOLO JSON válido, sin explicaciones."
-    )
-
     user = {
         "current_form": state["json_state"],
         "new_fragment": new_fragment
     }
 
-    resp = client.chat.completions.create(
+    resp = await chat_completion(
+        "patch",
         model=OPENAI_MODEL_JSON,
         messages=[
-            {"role": "system", "content": sys},
+            {"role": "system", "content": PATCH_SYSTEM_PROMPT},
             {"role": "user", "content": json.dumps(user, ensure_ascii=False)}
         ],
         temperature=0,
@@ -310,17 +487,26 @@ async def extract_form_patch(session_id: str, new_fragment: str) -> list[dict]:
 async def extract_form_incremental(session_id: str, new_fragment: str) -> dict:
     state = sessions[session_id]
 
-    # append fragment as new user message
-    state["messages"].append({
-        "role": "user",
-        "content": f"NUEVO FRAGMENTO: {new_fragment}. "
-                   "Actualiza el objeto JSON en base a esto. "
-                   "Si no hay cambios, devuelve el mismo JSON."
-    })
+    if INCREMENTAL_HISTORY == "full":
+        # append fragment as new user message
+        state["messages"].append({
+            "role": "user",
+            "content": f"NUEVO FRAGMENTO: {new_fragment}. "
+                       "Actualiza el objeto JSON en base a esto. "
+                       "Si no hay cambios, devuelve el mismo JSON."
+        })
+        messages = state["messages"]
+    else:
+        # Acotado: system + fragmentos recientes + ÚLTIMO snapshot del formulario (ver history.py)
+        history = state.setdefault("history", new_history())
+        messages = build_messages(
+            form_system_prompt(SCHEMA_MODES["form"]), history, state["json_state"], new_fragment
+        )
 
-    resp = client.chat.completions.create(
+    resp = await chat_completion(
+        "incremental",
         model=OPENAI_MODEL_JSON,
-        messages=state["messages"],
+        messages=messages,
         temperature=0,
         response_format={"type": "json_object"}
     )
@@ -328,37 +514,32 @@ async def extract_form_incremental(session_id: str, new_fragment: str) -> dict:
     content = resp.choices[0].message.content or "{}"
     updated_form = json.loads(content)
 
-    # store the assistant's response in conversation for continuity
-    state["messages"].append({"role": "assistant", "content": content})
+    if INCREMENTAL_HISTORY == "full":
+        # store the assistant's response in conversation for continuity
+        state["messages"].append({"role": "assistant", "content": content})
+    else:
+        push_fragment(history, new_fragment, keep=INCREMENTAL_HISTORY_K, older_max_chars=INCREMENTAL_OLDER_MAX_CHARS)
 
     return updated_form
 
 async def extract_form(transcript: str) -> dict:
-    schema = SCHEMA
-
-    sys = (
-        "Eres un asistente clínico. Extrae SOLO los datos mencionados del transcript y "
-        "devuelve EXCLUSIVAMENTE un objeto JSON válido que siga EXACTAMENTE el siguiente JSON Schema. "
-        "No inventes campos ni valores. Si algo no aparece, omítelo."
-    )
+    # Instrucciones + schema van en el system (prefijo estático); solo el transcript cambia
     user = {
-        "tarea": "Completar historia clínica desde el transcript.",
-        "instrucciones": "Devuelve un UNICO objeto JSON que cumpla el schema.",
-        "json_schema": schema,
         "transcript": transcript
     }
 
-    resp = client.chat.completions.create(
+    resp = await chat_completion(
+        "full_form",
         model=OPENAI_MODEL_JSON,
         messages=[
-            {"role":"system","content": sys},
-            {"role":"user","content": json.dumps(user)}  # 👈 el mensaje contiene la palabra JSON y el schema
+            {"role":"system","content": full_form_system_prompt(SCHEMA_MODES["full_form"])},
+            {"role":"user","content": json.dumps(user, ensure_ascii=False)}
         ],
         temperature=0,
-        response_format={"type":"json_object"}          # 👈 ok, ya cumplimos el requisito
+        response_format={"type":"json_object"}          # 👈 el system menciona JSON (requisito)
     )
     content = resp.choices[0].message.content or "{}"
-    return json.loads(content)
+    return coerce_delta(json.loads(content))
 
 # ------------------ Rutas ------------------
 
@@ -371,31 +552,58 @@ def health():
     ok = bool(OPENAI_API_KEY)
     return JSONResponse({"ok": ok, "model_text": OPENAI_MODEL_TEXT, "model_json": OPENAI_MODEL_JSON})
 
+@app.get("/metrics")
+def metrics():
+    return JSONResponse({
+        "summary_latency": SUMMARY_LATENCY.snapshot(),
+        "llm_usage": usage_stats.snapshot(),
+        "llm_cache": llm_cache.snapshot(),
+        "pre_extractor": VITALS_STATS.snapshot(),
+        "relevance": RELEVANCE_STATS.snapshot(),
+        "documents": document_store.snapshot(),
+        "uploads": UPLOAD_STATS.snapshot(),
+        "form_patches": FORM_PATCH_STATS.snapshot(),
+        "coercion": COERCION_STATS.snapshot(),
+        "completeness": {name or "base": rules.snapshot() for name, rules in REQUIRED_RULES.items()},
+        "sessions": sessions.snapshot()
+    })
+
 @app.websocket("/ws")
 async def ws_endpoint(ws: WebSocket):
     await ws.accept()
-    session_id = ws.query_params.get("session") or "default"
-    state = sessions.setdefault(session_id, 
+    session_id = ws.query_params.get("session")
+    if not session_id:
+        # Sin ?session= cada conexión tiene su propia sesión (antes todas compartían "default")
+        session_id = f"anon-{uuid.uuid4().hex}"
+        await ws.send_json({"type": "session", "session": session_id})
+    state = await sessions.load_or_create(session_id, lambda:
         {
-            "final": "", 
+            "transcript": Transcript(),
             "partial": "", 
             # "last_form": {}, 
             # "json_state": {},
             "json_state": make_blank_from_schema(SCHEMA),
             "last_form": make_blank_from_schema(SCHEMA),
-            "messages": []
+            "messages": [],
+            "revision": 0,
+            # Conjunto de requeridos (?specialty=pediatria); vacío = REQUIRED_KEYS
+            "specialty": (ws.query_params.get("specialty") or "").lower()
         }
     )
+    sessions.acquire(session_id)
+    if state.get("specialty"):
+        # Otro worker (o este tras un reinicio) la restaura con sus requeridos propios
+        await sessions.persist(session_id, [meta_op("specialty", state["specialty"])])
 
-    if not state["messages"]:  # first time
+    # Snapshot inicial (también en reconexión, posiblemente a otro worker): desde aquí
+    # los form_update llegan como patches contra la revisión anterior
+    await send_form_snapshot(ws, state)
+
+    if INCREMENTAL_HISTORY == "full" and not state["messages"]:  # first time
         state["messages"] = [
             {
                 "role": "system",
-                "content": (
-                    "Eres un asistente clínico. Tu tarea es mantener un objeto JSON de historia clínica "
-                    "actualizado en tiempo real. Devuelve SOLO JSON válido y sigue EXACTAMENTE este schema: "
-                    f"{json.dumps(SCHEMA, ensure_ascii=False)}"
-                )
+                "content": form_system_prompt(SCHEMA_MODES["form"])
             },
             {
                 "role": "assistant",
@@ -403,6 +611,35 @@ async def ws_endpoint(ws: WebSocket):
             }
         ]
 
+    followups = FollowUpTasks(name=session_id)
+    pipeline = SessionUpdatePipeline(
+        lambda fragment: run_incremental_update(ws, session_id, fragment, followups),
+        max_pending=UPDATE_QUEUE_MAX,
+        name=session_id,
+    )
+    # El resumen lee el transcript y formulario vigentes al momento de dispararse
+    summary = SummaryDebouncer(
+        lambda: stream_summary(ws, state["transcript"], state.get("json_state", {})),
+        quiet=SUMMARY_QUIET_MS / 1000,
+        max_wait=SUMMARY_MAX_WAIT_MS / 1000,
+        name=session_id,
+    )
+
+    def process_fragment(text: str):
+        # 1) Resumen narrativo: debounce por sesión (quiet-period / max-wait)
+        summary.trigger()
+        # 2) Extracción del formulario: cola ordenada por sesión (un solo worker)
+        pipeline.submit(text)
+
+    gate = RelevanceGate(
+        RELEVANCE_SCORER,
+        RELEVANCE_THRESHOLD,
+        RELEVANCE_STATS,
+        max_buffer_chars=RELEVANCE_MAX_BUFFER_CHARS,
+        max_hold=RELEVANCE_MAX_HOLD_MS / 1000,
+        on_release=process_fragment,   # relleno retenido demasiado tiempo
+    )
+
     try:
         while True:
             msg = await ws.receive_json()
@@ -414,35 +651,26 @@ async def ws_endpoint(ws: WebSocket):
                 # solo mantener por si luego deseas usarlo
                 state["partial"] = text
 
+            elif typ == "resync":
+                # El cliente detectó un salto de revisión (o un patch que no pudo aplicar)
+                FORM_PATCH_STATS.resyncs += 1
+                await send_form_snapshot(ws, state)
+
             elif typ == "final":
                 if text:
-                    # Concatena al buffer final con puntuación simple
-                    sep = "" if state["final"].endswith((" ", "\n", ".")) else " "
-                    state["final"] = (state["final"] + sep + text + ". ").strip()
-                    logger.info(f"[WS] final+= session={session_id} chunk_len={len(text)} total_chars={len(state['final'])}")
-
-                    # 1) Streaming de asistente (still inline, so doc sees live summary)
-                    try:
-                        # Pasar el formulario actual para que la IA sepa qué falta
-                        current_form = state.get("json_state", {})
-                        asyncio.create_task(stream_summary(ws, state["final"], current_form))
-                    except Exception as e:
-                        logger.exception("[WS] stream_summary error")
-                        await ws.send_json({"type": "error", "message": f"Stream error: {e}"})
-
-                    # 2) Form extraction (run in background, don’t block loop)
-                    # Fire background task
-                    # asyncio.create_task(run_form_extraction(ws, session_id, state["final"], state.get("last_form", {})))
-                    new_fragment = text
-                    asyncio.create_task(
-                        run_incremental_update(
-                            ws,
-                            session_id,
-                            new_fragment,
-                            state.get("json_state", {}),
-                            state["final"]   # 🔹 pass transcript explicitly
-                        )
-                    )
+                    # Nuevo segmento del transcript (sin recopiar lo anterior)
+                    ts = time.time()
+                    segment = state["transcript"].append(text, ts)
+                    logger.info(f"[WS] final+= session={session_id} chunk_len={len(text)} total_chars={len(state['transcript'])}")
+                    sessions.update_size(session_id)
+                    await sessions.persist(session_id, [segment_op(segment, ts)])
+
+                    # Relleno ("bueno", "a ver"): queda en espera y se une al siguiente fragmento
+                    to_process = gate.check(text)
+                    if not to_process:
+                        continue
+
+                    process_fragment(to_process)
 
     except WebSocketDisconnect:
         # cliente cerrado
@@ -452,51 +680,179 @@ async def ws_endpoint(ws: WebSocket):
             await ws.send_json({"type": "error", "message": str(e)})
         except Exception:
             pass
+    finally:
+        # Aplica lo que quedó en cola (y lo retenido por el filtro) para no perder fragmentos ya recibidos
+        held = gate.close()
+        if held:
+            pipeline.submit(held)
+        await summary.close()
+        await pipeline.close(drain=True)
+        await followups.close()
+        sessions.release(session_id)
+
+def ws_open(ws: WebSocket) -> bool:
+    """False tras la desconexión del cliente (p. ej. al drenar el pipeline al cerrar)."""
+    return ws.client_state == WebSocketState.CONNECTED and ws.application_state == WebSocketState.CONNECTED
+
+async def send_message(ws: WebSocket, msg: dict) -> int:
+    """Serializa y envía un mensaje; devuelve los bytes enviados."""
+    text = json.dumps(msg, ensure_ascii=False, separators=(",", ":"))
+    await ws.send_text(text)
+    return len(text)
+
+async def send_form_snapshot(ws: WebSocket, state: dict):
+    """form_update con el formulario completo y la revisión vigente."""
+    completeness = session_completeness(state)
+    size = await send_message(ws, {
+        "type": "form_update",
+        "rev": state.get("revision", 0),
+        "form": state["json_state"],
+        "missing": completeness.missing_paths(),
+        "completeness": completeness.sections()
+    })
+    FORM_PATCH_STATS.record_snapshot(size)
+
+async def send_form_patch(ws: WebSocket, rev: int, patch: list, completeness: Completeness, **extra):
+    """form_update con las ops RFC 6902 que llevan de la revisión rev-1 a rev."""
+    size = await send_message(ws, {
+        "type": "form_update", "rev": rev, "patch": patch,
+        "missing": completeness.missing_paths(), "completeness": completeness.sections(), **extra
+    })
+    FORM_PATCH_STATS.record_patch(size)
+
+async def send_suggestions(ws: WebSocket, transcript: Transcript, form: dict, fragment: str, missing: List[str]):
+    """Genera sugerencias contextuales y las envía como suggestions_update (con timeout)."""
+    try:
+        suggestions = await asyncio.wait_for(
+            generate_contextual_suggestions(
+                transcript=transcript,
+                current_form=form,
+                recent_fragment=fragment,
+                missing=missing
+            ),
+            timeout=SUGGESTIONS_TIMEOUT_S
+        )
+    except asyncio.TimeoutError:
+        logger.warning(f"[SUGGESTIONS] timeout ({SUGGESTIONS_TIMEOUT_S}s), usando fallback")
+        suggestions = build_suggestions(missing)
+    await ws.send_json({"type": "suggestions_update", "suggestions": suggestions})
+
+async def send_explanations(ws: WebSocket, transcript: Transcript, deltas: list[dict]):
+    """Explica los cambios y los envía como form_delta (con timeout)."""
+    try:
+        explained = await asyncio.wait_for(explain_deltas(transcript, deltas), timeout=EXPLAIN_TIMEOUT_S)
+    except asyncio.TimeoutError:
+        logger.warning(f"[EXPLAIN] timeout ({EXPLAIN_TIMEOUT_S}s), enviando cambios sin explicación")
+        explained = attach_explanations(deltas, [], transcript)
+    await ws.send_json({"type": "form_delta", "changes": explained})
 
 async def run_incremental_update(
     ws: WebSocket,
     session_id: str,
     fragment: str,
-    prev_form: dict,
-    transcript: str
+    followups: FollowUpTasks
 ):
-    try:
-        # updated_form = await extract_form_incremental(prev_form, fragment)
-        # updated_form = await extract_form_incremental(session_id, fragment)
-        delta = await extract_form_delta(session_id, fragment)
-        updated_form = deep_merge(prev_form, delta)
-        missing = compute_missing(updated_form)
-
-        # NUEVO: Generar sugerencias contextuales dinámicas
-        suggestions = await generate_contextual_suggestions(
-            transcript=transcript,
-            current_form=updated_form,
-            recent_fragment=fragment
-        )
-
-        await ws.send_json({
-            "type": "form_update",
-            "form": updated_form,
-            "missing": missing,
-            "suggestions": suggestions  # Ahora son sugerencias contextuales
-        })
+    """Aplica un fragmento (o lote de fragmentos) al formulario de la sesión.
 
-        # Compute deltas vs previous form
-        deltas = compute_deltas(prev_form, updated_form)
-        if deltas:
-            explained = await explain_deltas(transcript, deltas)
-            await ws.send_json({"type": "form_delta", "changes": explained})
+    Se ejecuta siempre desde el worker de SessionUpdatePipeline, así que el estado
+    leído aquí es el resultado de la actualización anterior (sin carreras).
+    En modo chain, sugerencias y explicaciones se lanzan en `followups` y no
+    retrasan el form_update.
+    """
+    state = sessions[session_id]
+    started = time.perf_counter()
+    try:
+        prev_form = state["json_state"]
+        transcript = state["transcript"]
+
+        explanations = None
+        result = None
+        local = None
+        if PRE_EXTRACT_VITALS:
+            local = extract_vitals(fragment)
+            VITALS_STATS.record(local)
+
+        if local is not None and local.covered:
+            # Solo signos vitales / edad: resuelto localmente, sin round-trip al LLM
+            delta = local.delta
+            explanations = local.explanations
+        elif EXTRACTION_MODE == "combined":
+            # Una sola llamada: delta + sugerencias + explicaciones
+            result = await extract_form_combined(session_id, fragment, transcript)
+            delta = result["delta"]
+            explanations = result["explanations"]
+        else:
+            # updated_form = await extract_form_incremental(prev_form, fragment)
+            # updated_form = await extract_form_incremental(session_id, fragment)
+            delta = await extract_form_delta(session_id, fragment)
+        if local and not local.covered:
+            # El LLM ve el fragmento completo y manda; lo local solo completa claves que faltan
+            delta = fill_missing(delta, local.delta)
+        # Mezcla y cambios en una sola pasada (solo se copia el camino que cambió)
+        updated_form, deltas = FORM_MERGER.merge(prev_form, delta)
+        # Solo se re-evalúan los requeridos que tocan los cambios
+        completeness = session_rules(state).update(session_completeness(state), updated_form, deltas)
+        missing = completeness.missing_paths()
+        patch = changes_to_patch(prev_form, updated_form, deltas)
+
+        # Update session state (antes de enviar: si el socket cae no se pierde).
+        # Formulario, requeridos y revisión cambian juntos, sin await en el medio: un snapshot
+        # pedido por "resync" nunca queda entre ambos
+        state["json_state"] = updated_form
+        state["last_form"] = updated_form
+        state["completeness"] = completeness
+        state["revision"] = rev = state.get("revision", 0) + 1
+        sessions.update_size(session_id)
+
+        # Al backend compartido solo van los campos cambiados, no el formulario completo
+        await sessions.persist(session_id, set_ops(deltas) + [meta_op("revision", rev)])
+
+        if not ws_open(ws):
+            # Drenado tras la desconexión: el estado ya quedó aplicado y persistido;
+            # el cliente recibe el snapshot al reconectar
+            logger.info(f"[WS] update session={session_id} aplicado sin cliente changes={len(deltas)}")
+            return
+
+        if explanations is not None:
+            # Modo combinado o extracción local: todo llegó en la misma respuesta
+            await send_form_patch(
+                ws, rev, patch, completeness,
+                suggestions=(result["suggestions"] if result else []) or build_suggestions(missing)
+            )
+            if deltas:
+                await ws.send_json({"type": "form_delta", "changes": attach_explanations(deltas, explanations, transcript)})
+        else:
+            # El formulario sale YA; sugerencias y explicaciones llegan después, en paralelo
+            await send_form_patch(ws, rev, patch, completeness)
+            followups.spawn(
+                "suggestions",
+                send_suggestions(ws, transcript, updated_form, fragment, missing),
+                supersede=True   # solo interesan las del formulario más reciente
+            )
+            if deltas:
+                followups.spawn("explanations", send_explanations(ws, transcript, deltas))
 
-        # Update session state
-        sessions[session_id]["json_state"] = updated_form
-        sessions[session_id]["last_form"] = updated_form
+        logger.info(
+            f"[WS] update session={session_id} mode={'local' if local and local.covered else EXTRACTION_MODE} "
+            f"changes={len(deltas)} elapsed={(time.perf_counter() - started) * 1000:.0f}ms"
+        )
 
     except Exception as e:
+        if not ws_open(ws):
+            logger.warning(f"[WS] update session={session_id} sin cliente: {e}")
+            return
         logger.exception("[WS] incremental update error")
-        await ws.send_json({"type": "error", "message": f"Update error: {e}"})
+        try:
+            await ws.send_json({"type": "error", "message": f"Update error: {e}"})
+        except Exception:
+            pass  # el socket cayó durante el envío; el receptor ya cierra la sesión
 
 # helper: aplanar dict a rutas "a.b.c"
 def deep_merge(old: dict, new: dict) -> dict:
+    """Mezcla `new` sobre `old` (sin modificarlos); la lista nueva reemplaza a la anterior.
+
+    Para aplicar deltas al formulario usar FORM_MERGER (listas con append + dedupe).
+    """
     result = old.copy()
     for k, v in new.items():
         if isinstance(v, dict) and isinstance(result.get(k), dict):
@@ -505,9 +861,20 @@ def deep_merge(old: dict, new: dict) -> dict:
             result[k] = v
     return result
 
-async def run_form_extraction(ws: WebSocket, session_id: str, transcript: str, prev_form: dict):
+def fill_missing(base: dict, extra: dict) -> dict:
+    """Completa `base` con las claves de `extra` que faltan o son null (sin modificarlos)."""
+    result = base.copy()
+    for k, v in extra.items():
+        cur = result.get(k)
+        if cur is None:
+            result[k] = v
+        elif isinstance(cur, dict) and isinstance(v, dict):
+            result[k] = fill_missing(cur, v)
+    return result
+
+async def run_form_extraction(ws: WebSocket, session_id: str, transcript: Transcript, prev_form: dict):
     try:
-        form = await extract_form(transcript)
+        form = await extract_form(transcript.text)
         missing = compute_missing(form)
         suggestions = build_suggestions(missing)
 
@@ -551,49 +918,21 @@ async def extract_form_delta(session_id: str, new_fragment: str) -> dict:
     Example output: {"afiliacion": {"nombreCompleto": "Jimena Olivares"}}
     """
     state = sessions[session_id]
-
-    sys = (
-        "Eres un asistente médico especializado que actualiza una historia clínica en formato JSON.\n\n"
-
-        "IMPORTANTE: Debes interpretar el LENGUAJE NATURAL del médico, no solo términos técnicos exactos.\n\n"
-
-        "EJEMPLOS DE INTERPRETACIÓN:\n"
-        "- 'paciente viene por fiebre' → afiliacion.motivoConsulta: 'fiebre'\n"
-        "- 'tiene tos y dolor de cabeza' → anamnesis.sintomasPrincipales: ['tos', 'dolor de cabeza']\n"
-        "- 'parece ser una gripe' → diagnosticos: [{nombre: 'gripe', tipo: 'presuntivo'}]\n"
-        "- 'probable faringitis' → diagnosticos: [{nombre: 'faringitis', tipo: 'presuntivo'}]\n"
-        "- 'le voy a dar paracetamol' → tratamientos: [{medicamento: 'paracetamol'}]\n"
-        "- 'que tome una pastilla cada 8 horas' → tratamientos: [{dosisIndicacion: 'una pastilla cada 8 horas'}]\n"
-        "- 'presión 120 sobre 80' → examenClinico.signosVitales.PA: '120/80'\n"
-        "- 'temperatura treinta y ocho grados' → examenClinico.signosVitales.temperatura: 38\n\n"
-
-        "Entradas:\n"
-        "  • El estado actual del objeto JSON (historia clínica).\n"
-        "  • Un fragmento de texto dictado por el médico.\n"
-        "  • El JSON Schema completo, con descripciones detalladas de cada campo.\n\n"
-
-        "Instrucciones:\n"
-        "1. Interpreta el SENTIDO del texto, no busques palabras clave exactas.\n"
-        "2. Lee CUIDADOSAMENTE las descripciones del schema - contienen patrones de lenguaje natural a detectar.\n"
-        "3. Devuelve SOLO un objeto JSON parcial con los campos que deben actualizarse.\n"
-        "   - Si no hay información nueva, devuelve {}.\n"
-        "4. Usa únicamente claves y estructuras que existan en el schema.\n"
-        "5. Si varios campos son relevantes para el mismo texto, actualiza todos.\n"
-        "6. Respeta los tipos de datos definidos en el schema (string, number, array, object, enum).\n"
-        "7. Para arrays: agrega nuevos elementos sin borrar los existentes.\n"
-        "8. Para enums: si no se especifica, usa el valor por defecto sugerido en la descripción.\n"
-        "9. No inventes claves ni devuelvas texto adicional fuera del JSON.\n"
+    form_ctx, _ = build_form_context(
+        state["json_state"], new_fragment, mode=FORM_CONTEXT_MODE,
+        max_text=FORM_CONTEXT_MAX_TEXT, max_items=FORM_CONTEXT_MAX_ITEMS
     )
 
     user = {
-        "current_form": state["json_state"],
+        "current_form": form_ctx,
         "new_fragment": new_fragment
     }
 
-    resp = client.chat.completions.create(
+    resp = await chat_completion(
+        "delta",
         model=OPENAI_MODEL_JSON,
         messages=[
-            {"role": "system", "content": sys},
+            {"role": "system", "content": delta_system_prompt(SCHEMA_MODES["delta"])},
             {"role": "user", "content": json.dumps(user, ensure_ascii=False)}
         ],
         temperature=0,
@@ -603,66 +942,113 @@ async def extract_form_delta(session_id: str, new_fragment: str) -> dict:
     content = resp.choices[0].message.content or "{}"
     try:
         delta = json.loads(content)
-        if not isinstance(delta, dict):
-            delta = {}
     except Exception:
         delta = {}
 
-    return delta
+    return coerce_delta(delta)
 
-def _flatten(d, prefix=""):
-    out = {}
-    if isinstance(d, dict):
-        for k, v in d.items():
-            out.update(_flatten(v, f"{prefix}.{k}" if prefix else k))
-    elif isinstance(d, list):
-        out[prefix] = d
-    else:
-        out[prefix] = d
-    return out
-
-def compute_deltas(prev: dict, curr: dict):
-    p = _flatten(prev); c = _flatten(curr)
-    changes = []
-    for path, val in c.items():
-        if path not in p or p[path] != val:
-            changes.append({"path": path, "value": val})
-    return changes
-
-async def explain_deltas(transcript: str, changes: list[dict]) -> list[dict]:
+async def extract_form_combined(session_id: str, new_fragment: str, transcript: Transcript) -> dict:
+    """
+    Modo combinado (EXTRACTION_MODE=combined): una sola llamada devuelve el delta,
+    las sugerencias contextuales y las explicaciones de cada ruta cambiada.
+    Reemplaza la cadena extract_form_delta → generate_contextual_suggestions → explain_deltas.
+
+    Returns:
+        {"delta": dict, "suggestions": list[str], "explanations": list[dict]}
+    """
+    state = sessions[session_id]
+    missing = session_completeness(state).missing_paths()
+    form_ctx, _ = build_form_context(
+        state["json_state"], new_fragment, mode=FORM_CONTEXT_MODE,
+        max_text=FORM_CONTEXT_MAX_TEXT, max_items=FORM_CONTEXT_MAX_ITEMS
+    )
+
+    user = {
+        "current_form": form_ctx,
+        "new_fragment": new_fragment,
+        "transcript_reciente": transcript.tail(1500),
+        "campos_faltantes": missing
+    }
+
+    resp = await chat_completion(
+        "combined",
+        model=OPENAI_MODEL_JSON,
+        messages=[
+            {"role": "system", "content": combined_system_prompt(SCHEMA_MODES["combined"])},
+            {"role": "user", "content": json.dumps(user, ensure_ascii=False)}
+        ],
+        temperature=0,
+        response_format={"type": "json_object"}
+    )
+
+    content = resp.choices[0].message.content or "{}"
+    try:
+        data = json.loads(content)
+        if not isinstance(data, dict):
+            data = {}
+    except Exception:
+        data = {}
+
+    delta = data.get("delta")
+    suggestions = data.get("suggestions")
+    explanations = data.get("explanations")
+    return {
+        "delta": coerce_delta(delta) if isinstance(delta, dict) else {},
+        "suggestions": [s for s in suggestions if isinstance(s, str)] if isinstance(suggestions, list) else [],
+        "explanations": explanations if isinstance(explanations, list) else []
+    }
+
+def attach_explanations(changes: list[dict], explanations: Any, transcript: Optional[Transcript] = None) -> list[dict]:
+    """Combina los cambios calculados con las explicaciones del modelo (por path).
+
+    Si el modelo explicó una ruta padre (p. ej. "diagnosticos") se usa también
+    para sus hijas. Si falta la evidencia y se pasa el transcript, se usa el
+    segmento que mejor respalda el valor; si no, reason/evidence quedan vacíos.
+    """
+    by_path = {
+        e.get("path"): e
+        for e in (explanations if isinstance(explanations, list) else [])
+        if isinstance(e, dict) and e.get("path")
+    }
+
+    explained = []
+    for ch in changes:
+        path = ch["path"]
+        e = by_path.get(path)
+        if e is None:
+            e = next((v for p, v in by_path.items() if path.startswith(p + ".") or p.startswith(path + ".")), {})
+        evidence = (e.get("evidence") or "").strip()
+        if not evidence and transcript is not None:
+            evidence = next(iter(transcript.evidence(ch.get("value"), limit=1)), "")
+        explained.append({
+            "path": path,
+            "value": ch.get("value"),
+            "reason": (e.get("reason") or "").strip(),
+            "evidence": evidence,
+        })
+    return explained
+
+async def explain_deltas(transcript: Transcript, changes: list[dict]) -> list[dict]:
     """
     Devuelve una lista: [{path, value, reason, evidence}]
     Usa response_format=json_object (cumpliendo el requisito de mencionar JSON).
-    Si falla, devuelve los cambios con reason/evidence vacíos.
+    Si falla, devuelve los cambios con la evidencia local (segmento del transcript).
     """
     if not changes:
         return []
 
-    # Limitar transcript para evitar prompts gigantes
-    transcript_trim = transcript[-4000:]
-
-    system_msg = (
-        "Eres un asistente clínico. Para cada cambio de la historia clínica, "
-        "devuelve SOLO un objeto JSON válido con la forma: "
-        '{"explanations":[{"path":"...","reason":"...","evidence":"..."}]}. '
-        "La propiedad 'reason' debe ser breve (<= 18 palabras). "
-        "La propiedad 'evidence' debe ser una cita textual corta (<= 15 palabras) tomada del transcript "
-        "que respalde el valor; si no hay una evidencia textual clara, deja evidence como cadena vacía. "
-        "No incluyas texto adicional fuera del objeto JSON."
-    )
-
+    # En vez de los últimos 4000 chars: los segmentos que respaldan cada cambio + una cola corta
     user_payload = {
-        "tarea": "Explicar por qué se añadió/actualizó cada campo del formulario.",
-        "instrucciones": "Responde con UN UNICO objeto JSON bajo la clave 'explanations'.",
-        "transcript": transcript_trim,
-        "changes": changes
+        "changes": [{**ch, "fragmentos": transcript.evidence(ch.get("value"))} for ch in changes],
+        "transcript": transcript.tail(1000)
     }
 
     try:
-        resp = client.chat.completions.create(
+        resp = await chat_completion(
+            "explain",
             model=OPENAI_MODEL_JSON,          # usa el mismo que en extract_form
             messages=[
-                {"role": "system", "content": system_msg},
+                {"role": "system", "content": EXPLAIN_SYSTEM_PROMPT},
                 # 👇 el contenido incluye JSON (cumple el requisito)
                 {"role": "user", "content": json.dumps(user_payload, ensure_ascii=False)},
             ],
@@ -671,23 +1057,12 @@ async def explain_deltas(transcript: str, changes: list[dict]) -> list[dict]:
         )
         content = resp.choices[0].message.content or "{}"
         data = json.loads(content)
-        by_path = {e.get("path"): e for e in (data.get("explanations") or []) if isinstance(e, dict) and e.get("path")}
-
-        explained = []
-        for ch in changes:
-            e = by_path.get(ch["path"], {})
-            explained.append({
-                "path": ch["path"],
-                "value": ch.get("value"),
-                "reason": (e.get("reason") or "").strip(),
-                "evidence": (e.get("evidence") or "").strip(),
-            })
-        return explained
+        return attach_explanations(changes, data.get("explanations"), transcript)
 
     except Exception as ex:
         # Fallback silencioso: no trabar el flujo si la explicación falla
         logger.warning("explain_deltas failed: %s", ex)
-        return [{"path": ch["path"], "value": ch.get("value"), "reason": "", "evidence": ""} for ch in changes]
+        return attach_explanations(changes, [], transcript)
     
 def make_blank_from_schema(schema: dict) -> Any:
     t = schema.get("type")
@@ -700,8 +1075,268 @@ def make_blank_from_schema(schema: dict) -> Any:
 
 # ------------------ Document Extraction Endpoint ------------------
 
+class DocumentExtractionError(Exception):
+    """Error de extracción con la respuesta HTTP que corresponde."""
+
+    def __init__(self, status_code: int, content: dict):
+        super().__init__(content.get("error"))
+        self.status_code = status_code
+        self.content = content
+
+async def run_in_document_pool(fn, *args):
+    """Ejecuta trabajo bloqueante de documentos (copia, render, codificación) en DOCUMENT_EXECUTOR."""
+    return await asyncio.get_running_loop().run_in_executor(DOCUMENT_EXECUTOR, fn, *args)
+
+def prepare_image(source, mime: str = "image/png") -> Tuple[bytes, str]:
+    """Imagen lista para la Vision API: (bytes, mime). Bloqueante (CPU): usar en el pool.
+
+    `source` es el temporal de la subida (archivo abierto) o una página PIL de un PDF.
+
+    Con DOCUMENT_PREPROCESS=1 pasa por image_prep.preprocess_image (rotación EXIF,
+    grises, enderezado, recorte, reescalado al presupuesto de tiles, JPEG/WebP).
+    """
+    if DOCUMENT_PREPROCESS:
+        try:
+            data, mime, info = preprocess_image(
+                source,
+                grayscale=DOCUMENT_GRAYSCALE,
+                deskew=DOCUMENT_DESKEW,
+                crop=DOCUMENT_CROP,
+                max_tiles=DOCUMENT_MAX_TILES,
+                fmt=DOCUMENT_IMAGE_FORMAT,
+                quality=DOCUMENT_IMAGE_QUALITY,
+            )
+            logger.info(
+                f"[EXTRACT-DOC] preprocess {info['original_size']}→{info['size']} angle={info['angle']} "
+                f"bytes={info['bytes']} tokens {info['tokens_before']}→{info['tokens_after']}"
+            )
+            return data, mime
+        except Exception:
+            logger.exception("[EXTRACT-DOC] preprocess failed, sending original")
+    if hasattr(source, "read"):
+        source.seek(0)
+        return source.read(), mime
+    # Convertir PIL Image a bytes
+    img_byte_arr = io.BytesIO()
+    source.save(img_byte_arr, format='PNG')
+    return img_byte_arr.getbuffer(), "image/png"
+
+def render_pdf_pages(path: str) -> List[Tuple[bytes, str]]:
+    """PDF → imagen por página, ya preparada (bloqueante: se ejecuta en el pool).
+
+    pdftoppm lee el temporal de la subida por ruta; pdf2image reparte las páginas
+    entre DOCUMENT_RENDER_THREADS procesos.
+    """
+    try:
+        from pdf2image import convert_from_path
+    except ImportError:
+        raise DocumentExtractionError(400, {"error": "pdf2image no está instalado. Instala con: pip install pdf2image"})
+    images = convert_from_path(
+        path,
+        first_page=1,
+        last_page=DOCUMENT_MAX_PAGES,
+        thread_count=DOCUMENT_RENDER_THREADS,
+    )
+    if not images:
+        raise DocumentExtractionError(400, {"error": "No se pudo convertir el PDF a imagen"})
+
+    return [prepare_image(image) for image in images]
+
+async def extract_page(image_data: bytes, mime: str = "image/png") -> dict:
+    """Llama a la Vision API con una página y parsea el JSON extraído.
+
+    Raises:
+        DocumentExtractionError: si la respuesta no es JSON.
+    """
+    # Data URL base64 para OpenAI, codificado en el pool y sin copias intermedias
+    image_url = await run_in_document_pool(image_data_url, image_data, mime)
+    del image_data
+
+    # Prompt para Vision API (system estático en prompts.py; la imagen va al final)
+    user_prompt = "Extrae toda la información de esta historia clínica y estructúrala según el formato solicitado."
+
+    # Llamar a OpenAI Vision API
+    logger.info("[EXTRACT-DOC] Calling OpenAI Vision API...")
+
+    response = await chat_completion(
+        "document",
+        model=OPENAI_MODEL_VISION,
+        messages=[
+            {
+                "role": "system",
+                "content": DOCUMENT_SYSTEM_PROMPT
+            },
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": user_prompt},
+                    {
+                        "type": "image_url",
+                        "image_url": {
+                            "url": image_url,
+                            "detail": DOCUMENT_DETAIL  # high detail para mejor extracción
+                        }
+                    }
+                ]
+            }
+        ],
+        max_tokens=4000,
+        temperature=0.1  # Baja temperatura para precisión
+    )
+
+    # Extraer el contenido de la respuesta
+    content = response.choices[0].message.content
+    logger.info(f"[EXTRACT-DOC] OpenAI response received: {len(content)} chars")
+
+    # Parsear el JSON
+    try:
+        # Limpiar markdown si viene envuelto en ```json ... ```
+        if content.strip().startswith("```"):
+            # Extraer solo el JSON
+            lines = content.strip().split('\n')
+            json_lines = []
+            in_json = False
+            for line in lines:
+                if line.strip().startswith("```"):
+                    in_json = not in_json
+                    continue
+                if in_json:
+                    json_lines.append(line)
+            content = '\n'.join(json_lines)
+
+        extracted_data = json.loads(content)
+        logger.info("[EXTRACT-DOC] Successfully parsed JSON")
+        return coerce_delta(extracted_data)
+
+    except json.JSONDecodeError as e:
+        logger.error(f"[EXTRACT-DOC] JSON parse error: {e}")
+        logger.error(f"[EXTRACT-DOC] Raw content: {content}")
+        raise DocumentExtractionError(500, {
+            "success": False,
+            "error": "Error al parsear la respuesta de la IA",
+            "raw_content": content
+        })
+
+async def run_document_extraction(upload, is_pdf: bool, on_page=None, content_type: str = "image/png") -> dict:
+    """Extrae todas las páginas (en paralelo acotado) y las mezcla en un solo JSON.
+
+    Las páginas se mezclan en orden con FORM_MERGER: los campos escalares de páginas
+    posteriores completan/pisan a los anteriores y las listas (síntomas, diagnósticos,
+    tratamientos) se acumulan sin duplicados (diagnósticos por nombre / CIE-10,
+    tratamientos por medicamento).
+
+    Args:
+        upload: Temporal de la subida (PDF: uploads.spool_upload; imagen: el de Starlette,
+            ver uploads.take_upload_file); lo cierra el llamador.
+        on_page: Callback async opcional (índice, total, data) al terminar cada página.
+
+    Raises:
+        DocumentExtractionError: si el PDF no se puede convertir o ninguna página da JSON.
+    """
+    if is_pdf:
+        pages = await run_in_document_pool(render_pdf_pages, upload.name)
+    else:
+        # Ya es una imagen: Pillow lee directo del temporal
+        pages = [await run_in_document_pool(prepare_image, upload, content_type or "image/png")]
+    logger.info(f"[EXTRACT-DOC] pages={len(pages)} concurrency={DOCUMENT_PAGE_CONCURRENCY}")
+
+    semaphore = asyncio.Semaphore(max(1, DOCUMENT_PAGE_CONCURRENCY))
+
+    def take(index: int) -> Tuple[bytes, str]:
+        # La lista suelta la página: extract_page la libera apenas arma el data URL
+        page, pages[index] = pages[index], None
+        return page
+
+    async def run_page(index: int) -> dict:
+        async with semaphore:
+            data = await extract_page(*take(index))
+        if on_page is not None:
+            await on_page(index, len(pages), data)
+        return data
+
+    results = await asyncio.gather(*(run_page(i) for i in range(len(pages))), return_exceptions=True)
+    ok = [r for r in results if not isinstance(r, BaseException)]
+    if not ok:
+        raise results[0]
+    for i, r in enumerate(results):
+        if isinstance(r, BaseException):
+            logger.warning(f"[EXTRACT-DOC] page {i + 1} failed: {r}")
+
+    merged: dict = {}
+    for data in ok:
+        if isinstance(data, dict):
+            merged, _ = FORM_MERGER.merge(merged, data)
+    return merged
+
+def document_extraction(upload, is_pdf: bool, content_type: str = ""):
+    """Extracción para document_store.get_or_extract y la función que libera `upload`.
+
+    Returns:
+        (start, release): start(publish) arranca la extracción (que cierra el
+        temporal al terminar) y emite un evento {"type":"page"} por página;
+        release() cierra el temporal si la extracción nunca arrancó (resultado
+        guardado o ya en curso para el mismo archivo).
+    """
+    started = False
+
+    def start(publish):
+        nonlocal started
+        started = True
+
+        async def on_page(index: int, total: int, data: dict):
+            publish({"type": "page", "page": index + 1, "pages": total, "data": data})
+
+        async def extract():
+            try:
+                return await run_document_extraction(upload, is_pdf, on_page, content_type)
+            finally:
+                upload.close()
+
+        return extract()
+
+    def release():
+        if not started:
+            upload.close()
+
+    return start, release
+
+async def stream_document_extraction(digest: str, start, release):
+    """NDJSON: una línea {"type":"page"} por página terminada y al final {"type":"done"}.
+
+    Pasa por document_store igual que la respuesta JSON: con el resultado guardado
+    solo se emite "done"; si el mismo archivo ya se está extrayendo (otra pestaña)
+    se comparte esa extracción y sus páginas (también las ya terminadas).
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def wait():
+        try:
+            return await document_store.get_or_extract(digest, start, listener=queue.put_nowait)
+        finally:
+            release()
+
+    task = asyncio.create_task(wait())
+    task.add_done_callback(lambda _: queue.put_nowait(None))
+    try:
+        while (item := await queue.get()) is not None:
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+        try:
+            data, source = task.result()
+            logger.info(f"[EXTRACT-DOC] digest={digest[:12]} source={source} (stream)")
+            item = {"type": "done", "success": True, "cached": source != "extracted", "data": data}
+        except DocumentExtractionError as e:
+            item = {"type": "error", "success": False, **e.content}
+        except Exception as e:
+            logger.exception("[EXTRACT-DOC] Unexpected error (stream)")
+            item = {"type": "error", "success": False, "error": str(e)}
+        yield json.dumps(item, ensure_ascii=False) + "\n"
+    finally:
+        # Solo deja de esperar: la extracción compartida sigue (shield) para los demás
+        if not task.done():
+            task.cancel()
+
 @app.post("/extract-document")
-async def extract_document(file: UploadFile = File(...)):
+async def extract_document(file: UploadFile = File(...), stream: bool = False):
     """
     Endpoint para extraer información de documentos médicos (imágenes o PDFs).
 
@@ -710,8 +1345,16 @@ async def extract_document(file: UploadFile = File(...)):
     2. Extraer información estructurada según nuestro schema
     3. Retornar JSON compatible con el formulario
 
+    El resultado se indexa por hash del archivo: si el mismo documento ya se
+    procesó (o se está procesando) no se vuelve a llamar a la Vision API.
+    Los PDFs se procesan página por página (hasta DOCUMENT_MAX_PAGES). El archivo
+    nunca se lee entero en memoria: las imágenes se hashean y leen del temporal de
+    Starlette, los PDFs se copian a un temporal con nombre para pdftoppm. Lo que supera
+    DOCUMENT_MAX_UPLOAD_BYTES recibe 413 (antes de recibirse entero, ver UploadLimitMiddleware).
+
     Args:
         file: Archivo subido (imagen: jpg, png, etc. o PDF)
+        stream: ?stream=1 → respuesta NDJSON con un evento por página y uno final
 
     Returns:
         JSONResponse con la estructura de datos extraída
@@ -719,196 +1362,58 @@ async def extract_document(file: UploadFile = File(...)):
     try:
         logger.info(f"[EXTRACT-DOC] Received file: {file.filename}, content_type: {file.content_type}")
 
-        # Leer el contenido del archivo
-        contents = await file.read()
-
         # Determinar si es imagen o PDF
         is_pdf = file.content_type == "application/pdf" or file.filename.lower().endswith('.pdf')
 
+        # Starlette ya conoce el tamaño de la parte: rechazar sin copiar nada
+        if DOCUMENT_MAX_UPLOAD_BYTES and (getattr(file, "size", None) or 0) > DOCUMENT_MAX_UPLOAD_BYTES:
+            raise UploadTooLarge(DOCUMENT_MAX_UPLOAD_BYTES)
+
+        # El límite exacto del archivo se verifica al hashear (el middleware ya cortó lo
+        # que excedía el cuerpo); todo el I/O corre en el pool, fuera del loop
+        hasher = upload_hasher(DOCUMENT_EXTRACTOR_VERSION)
         if is_pdf:
-            # Para PDFs: convertir primera página a imagen
-            try:
-                from pdf2image import convert_from_bytes
-                images = convert_from_bytes(contents, first_page=1, last_page=1)
-                if not images:
-                    return JSONResponse(
-                        status_code=400,
-                        content={"error": "No se pudo convertir el PDF a imagen"}
-                    )
-
-                # Convertir PIL Image a bytes
-                img_byte_arr = io.BytesIO()
-                images[0].save(img_byte_arr, format='PNG')
-                img_byte_arr.seek(0)
-                image_data = img_byte_arr.getvalue()
-
-            except ImportError:
-                return JSONResponse(
-                    status_code=400,
-                    content={"error": "pdf2image no está instalado. Instala con: pip install pdf2image"}
-                )
+            # pdftoppm necesita una ruta: copia a un temporal con nombre, hash en la misma pasada
+            upload, size = await run_in_document_pool(
+                spool_upload, file.file, DOCUMENT_MAX_UPLOAD_BYTES, hasher, True
+            )
+            await file.close()
         else:
-            # Ya es una imagen
-            image_data = contents
-
-        # Convertir a base64 para enviar a OpenAI
-        base64_image = base64.b64encode(image_data).decode('utf-8')
-
-        # Crear el prompt para Vision API
-        system_prompt = """Eres un experto en digitalización de historias clínicas médicas.
-
-Tu tarea es extraer TODA la información visible en el documento médico y estructurarla en formato JSON.
-
-IMPORTANTE:
-- Extrae TODOS los datos que veas, incluso si están incompletos
-- Si un campo no está presente, omítelo del JSON (no pongas null ni cadenas vacías)
-- Mantén la terminología médica original
-- Para fechas, usa formato ISO (YYYY-MM-DD) si es posible
-- Para arrays (síntomas, diagnósticos, tratamientos), incluye todos los items que encuentres
-
-ESTRUCTURA ESPERADA:
-{
-  "afiliacion": {
-    "nombreCompleto": "nombre del paciente",
-    "edad": {"anios": número, "meses": número},
-    "sexo": "M/F",
-    "dni": "documento",
-    "grupoSangre": "tipo sangre",
-    "fechaHora": "fecha consulta",
-    "seguro": "nombre seguro",
-    "tipoConsulta": "tipo",
-    "numeroSeguro": "número",
-    "motivoConsulta": "motivo"
-  },
-  "anamnesis": {
-    "tiempoEnfermedad": "duración",
-    "sintomasPrincipales": ["síntoma1", "síntoma2"],
-    "relato": "narrativa completa",
-    "funcionesBiologicas": {
-      "apetito": "estado",
-      "sed": "estado",
-      "orina": "estado",
-      "deposiciones": "estado",
-      "sueno": "estado"
-    },
-    "antecedentes": {
-      "personales": ["antecedente1"],
-      "padre": ["antecedente paterno"],
-      "madre": ["antecedente materno"]
-    },
-    "alergias": ["alergia1"],
-    "medicamentos": ["medicamento1"]
-  },
-  "examenClinico": {
-    "signosVitales": {
-      "PA": "presión arterial",
-      "FC": frecuencia cardiaca (número),
-      "FR": frecuencia respiratoria (número),
-      "temperatura": "temperatura",
-      "SpO2": "saturación",
-      "IMC": "índice masa corporal",
-      "peso": peso en kg,
-      "talla": talla en cm
-    },
-    "estadoGeneral": "descripción",
-    "descripcionGeneral": "hallazgos",
-    "sistemas": {
-      "piel": "hallazgos",
-      "cabeza": "hallazgos",
-      "cuello": "hallazgos",
-      "torax": "hallazgos",
-      "pulmones": "hallazgos",
-      "corazon": "hallazgos",
-      "abdomen": "hallazgos",
-      "extremidades": "hallazgos",
-      "neurologico": "hallazgos"
-    }
-  },
-  "diagnosticos": [
-    {"nombre": "diagnóstico", "cie10": "código", "tipo": "Presuntivo/Definitivo/Diferencial"}
-  ],
-  "tratamientos": [
-    {"medicamento": "nombre", "dosisIndicacion": "dosis e indicaciones", "gtin": "código"}
-  ],
-  "firma": {
-    "medico": "nombre médico",
-    "colegiatura": "número colegiatura",
-    "fecha": "fecha"
-  }
-}
-
-Devuelve SOLO el JSON, sin explicaciones adicionales."""
-
-        user_prompt = "Extrae toda la información de esta historia clínica y estructúrala según el formato solicitado."
-
-        # Llamar a OpenAI Vision API
-        logger.info("[EXTRACT-DOC] Calling OpenAI Vision API...")
+            # Imagen: se hashea el temporal de Starlette en su lugar y se usa tal cual
+            size = await run_in_document_pool(hash_upload, file.file, DOCUMENT_MAX_UPLOAD_BYTES, hasher)
+            upload = take_upload_file(file)
+        UPLOAD_STATS.record(size, upload)
+        digest = hasher.hexdigest()
+
+        # El temporal lo cierra la extracción si arranca (puede seguir aunque este
+        # cliente se desconecte); si no arranca (resultado guardado / en curso), release()
+        start, release = document_extraction(upload, is_pdf, file.content_type)
+
+        if stream:
+            return StreamingResponse(
+                stream_document_extraction(digest, start, release),
+                media_type="application/x-ndjson"
+            )
 
-        response = client.chat.completions.create(
-            model="gpt-4o",  # gpt-4o tiene vision capabilities
-            messages=[
-                {
-                    "role": "system",
-                    "content": system_prompt
-                },
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": user_prompt},
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}",
-                                "detail": "high"  # high detail para mejor extracción
-                            }
-                        }
-                    ]
-                }
-            ],
-            max_tokens=4000,
-            temperature=0.1  # Baja temperatura para precisión
-        )
+        try:
+            extracted_data, source = await document_store.get_or_extract(digest, start)
+        finally:
+            release()
+        logger.info(f"[EXTRACT-DOC] digest={digest[:12]} source={source}")
+
+        return JSONResponse(content={
+            "success": True,
+            "data": extracted_data,
+            "cached": source != "extracted",
+            "message": "Documento procesado exitosamente"
+        })
 
-        # Extraer el contenido de la respuesta
-        content = response.choices[0].message.content
-        logger.info(f"[EXTRACT-DOC] OpenAI response received: {len(content)} chars")
+    except UploadTooLarge as e:
+        UPLOAD_STATS.rejected += 1
+        return JSONResponse(status_code=413, content={"success": False, "error": str(e)})
 
-        # Parsear el JSON
-        try:
-            # Limpiar markdown si viene envuelto en ```json ... ```
-            if content.strip().startswith("```"):
-                # Extraer solo el JSON
-                lines = content.strip().split('\n')
-                json_lines = []
-                in_json = False
-                for line in lines:
-                    if line.strip().startswith("```"):
-                        in_json = not in_json
-                        continue
-                    if in_json:
-                        json_lines.append(line)
-                content = '\n'.join(json_lines)
-
-            extracted_data = json.loads(content)
-            logger.info("[EXTRACT-DOC] Successfully parsed JSON")
-
-            return JSONResponse(content={
-                "success": True,
-                "data": extracted_data,
-                "message": "Documento procesado exitosamente"
-            })
-
-        except json.JSONDecodeError as e:
-            logger.error(f"[EXTRACT-DOC] JSON parse error: {e}")
-            logger.error(f"[EXTRACT-DOC] Raw content: {content}")
-            return JSONResponse(
-                status_code=500,
-                content={
-                    "success": False,
-                    "error": "Error al parsear la respuesta de la IA",
-                    "raw_content": content
-                }
-            )
+    except DocumentExtractionError as e:
+        return JSONResponse(status_code=e.status_code, content=e.content)
 
     except Exception as e:
         logger.exception("[EXTRACT-DOC] Unexpected error")
@@ -0,0 +1,453 @@
+# session_backends.py
+# Backends externos para compartir sesiones entre workers / nodos
+#
+# Cada sesión se guarda de forma incremental:
+#   - snapshot: estado compacto (JSON sin espacios + zlib) de transcript/json_state/history,
+#     revisión del formulario y especialidad
+#   - log: operaciones agregadas desde el último snapshot, una por cambio:
+#       {"op": "seg", "text": "...", "ts": t}     segmento agregado al transcript
+#       {"op": "set", "path": "a.b", "value": v}  campo del formulario cambiado
+#       {"op": "push", "path": "a.b", "value": v} elemento agregado al final de una lista
+#       {"op": "meta", "key": k, "value": v}      campo de la sesión (revision, specialty)
+#   Cada tanto (log_max ops) se escribe un snapshot nuevo y se recorta el log.
+#
+# Implementaciones:
+#   MemoryBackend  → en el mismo proceso (referencia / pruebas)
+#   SqliteBackend  → archivo SQLite (WAL), compartido por los workers de un nodo
+#   RedisBackend   → protocolo Redis (RESP2) sin dependencias extra; se puede
+#                    probar localmente con redis_standin.py
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from form_diff import split_append
+from transcript import Transcript
+
+# ------------------ Serialización ------------------
+
+SNAPSHOT_KEYS = ("json_state", "history", "revision", "specialty")
+
+
+def dumps_compact(value: Any) -> bytes:
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def encode_snapshot(state: Dict[str, Any]) -> bytes:
+    """Snapshot compacto del estado (solo lo necesario para reconstruirlo)."""
+    data = {k: state[k] for k in SNAPSHOT_KEYS if k in state}
+    if "transcript" in state:
+        data["transcript"] = state["transcript"].to_json()
+    return zlib.compress(dumps_compact(data))
+
+
+def decode_snapshot(data: bytes) -> Dict[str, Any]:
+    state = json.loads(zlib.decompress(data).decode("utf-8"))
+    if "transcript" in state:
+        state["transcript"] = Transcript.from_json(state["transcript"])
+    return state
+
+
+def segment_op(segment: str, ts: float) -> Dict[str, Any]:
+    """Op para un segmento nuevo del transcript."""
+    return {"op": "seg", "text": segment, "ts": ts}
+
+
+def meta_op(key: str, value: Any) -> Dict[str, Any]:
+    """Op para un campo de primer nivel de la sesión (uno de SNAPSHOT_KEYS)."""
+    return {"op": "meta", "key": key, "value": value}
+
+
+def set_ops(changes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Ops de formulario a partir de compute_deltas ([{path, value}]).
+
+    Los agregados a una lista ("a.b.-") se guardan como "push": el log no repite la lista.
+    """
+    ops = []
+    for c in changes:
+        path, append = split_append(c["path"])
+        ops.append({"op": "push" if append else "set", "path": path, "value": c.get("value")})
+    return ops
+
+
+def apply_ops(state: Dict[str, Any], ops: List[Dict[str, Any]]) -> None:
+    """Reaplica el log sobre un estado (in place)."""
+    for op in ops:
+        kind = op.get("op")
+        if kind == "seg":
+            state.setdefault("transcript", Transcript()).append(op["text"], op.get("ts"))
+        elif kind == "meta":
+            if op.get("key") in SNAPSHOT_KEYS:
+                state[op["key"]] = op.get("value")
+        elif kind in ("set", "push"):
+            parts = op["path"].split(".")
+            cur = _walk(state.setdefault("json_state", {}), parts[:-1])
+            last = parts[-1]
+            if isinstance(cur, list):
+                # Elemento existente de una lista reemplazado entero ("diagnosticos.0")
+                if kind == "set" and last.isdigit() and int(last) < len(cur):
+                    cur[int(last)] = op.get("value")
+            elif cur is not None and kind == "set":
+                cur[last] = op.get("value")
+            elif cur is not None:
+                items = cur.get(last)
+                if not isinstance(items, list):
+                    items = cur[last] = []
+                items.append(op.get("value"))
+
+
+def _walk(cur: Any, parts: List[str]) -> Any:
+    """Baja por `parts` creando dicts faltantes; entra a listas por índice ("diagnosticos.0").
+
+    Devuelve None si la ruta pasa por un índice inexistente o un valor escalar.
+    """
+    for p in parts:
+        if isinstance(cur, list):
+            cur = cur[int(p)] if p.isdigit() and int(p) < len(cur) else None
+        elif isinstance(cur, dict):
+            nxt = cur.get(p)
+            if not isinstance(nxt, (dict, list)):
+                nxt = cur[p] = {}
+            cur = nxt
+        else:
+            return None
+    return cur if isinstance(cur, (dict, list)) else None
+
+
+def restore_state(base: Dict[str, Any], snapshot: Optional[bytes], log: List[bytes]) -> Dict[str, Any]:
+    """Reconstruye un estado de sesión: base (blanco) + snapshot + log."""
+    if snapshot:
+        base.update(decode_snapshot(snapshot))
+    apply_ops(base, [json.loads(raw) for raw in log])
+    base["last_form"] = base.get("json_state")
+    return base
+
+
+# ------------------ Interfaz ------------------
+
+class SessionBackend:
+    """Almacén externo de sesiones (snapshot + log incremental)."""
+
+    async def load(self, session_id: str) -> Optional[Tuple[Optional[bytes], List[bytes]]]:
+        """(snapshot, log) o None si la sesión no existe."""
+        raise NotImplementedError
+
+    async def append(self, session_id: str, ops: List[Dict[str, Any]]) -> int:
+        """Agrega ops al log. Devuelve el largo del log tras agregar."""
+        raise NotImplementedError
+
+    async def save_snapshot(self, session_id: str, snapshot: bytes, covered: int) -> None:
+        """Guarda un snapshot que incluye las primeras `covered` ops del log y las recorta."""
+        raise NotImplementedError
+
+    async def delete(self, session_id: str) -> None:
+        raise NotImplementedError
+
+    async def sweep(self) -> int:
+        """Borra las sesiones expiradas (si el backend no expira solo). Devuelve cuántas."""
+        return 0
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryBackend(SessionBackend):
+    """Backend en memoria del proceso (misma interfaz; útil para pruebas)."""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, Any]] = {}
+
+    async def load(self, session_id):
+        d = self._data.get(session_id)
+        if d is None:
+            return None
+        return d["snap"], list(d["log"])
+
+    async def append(self, session_id, ops):
+        d = self._data.setdefault(session_id, {"snap": None, "log": []})
+        d["log"].extend(dumps_compact(op) for op in ops)
+        return len(d["log"])
+
+    async def save_snapshot(self, session_id, snapshot, covered):
+        d = self._data.setdefault(session_id, {"snap": None, "log": []})
+        d["snap"] = snapshot
+        del d["log"][:covered]
+
+    async def delete(self, session_id):
+        self._data.pop(session_id, None)
+
+
+class SqliteBackend(SessionBackend):
+    """Backend en un archivo SQLite (modo WAL; las consultas corren en un thread).
+
+    Args:
+        path: Ruta del archivo .db.
+        ttl: Segundos sin escritura tras los cuales una sesión se borra (0 = nunca).
+    """
+
+    def __init__(self, path: str, ttl: float = 0):
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_snapshot (id TEXT PRIMARY KEY, data BLOB, updated REAL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS session_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, id TEXT, op BLOB)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS session_log_id ON session_log (id, seq)")
+
+    def _run(self, fn, *args):
+        with self._lock:
+            return fn(*args)
+
+    def _load(self, session_id):
+        # Solo lectura: las expiradas se ignoran aquí y las borra sweep()
+        cutoff = time.time() - self._ttl if self._ttl else 0
+        row = self._conn.execute(
+            "SELECT data FROM session_snapshot WHERE id = ? AND updated >= ?", (session_id, cutoff)
+        ).fetchone()
+        if row is None:
+            return None
+        log = [r[0] for r in self._conn.execute("SELECT op FROM session_log WHERE id = ? ORDER BY seq", (session_id,))]
+        return row[0], log
+
+    def _append(self, session_id, ops):
+        now = time.time()
+        self._conn.execute("BEGIN")
+        # La fila de snapshot marca que la sesión existe (data NULL hasta el primer snapshot)
+        self._conn.execute(
+            "INSERT INTO session_snapshot (id, data, updated) VALUES (?, NULL, ?) "
+            "ON CONFLICT(id) DO UPDATE SET updated = excluded.updated",
+            (session_id, now),
+        )
+        self._conn.executemany(
+            "INSERT INTO session_log (id, op) VALUES (?, ?)", [(session_id, dumps_compact(op)) for op in ops]
+        )
+        (count,) = self._conn.execute("SELECT COUNT(*) FROM session_log WHERE id = ?", (session_id,)).fetchone()
+        self._conn.execute("COMMIT")
+        return count
+
+    def _save_snapshot(self, session_id, snapshot, covered):
+        self._conn.execute("BEGIN")
+        self._conn.execute(
+            "INSERT INTO session_snapshot (id, data, updated) VALUES (?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET data = excluded.data, updated = excluded.updated",
+            (session_id, snapshot, time.time()),
+        )
+        self._conn.execute(
+            "DELETE FROM session_log WHERE seq IN "
+            "(SELECT seq FROM session_log WHERE id = ? ORDER BY seq LIMIT ?)",
+            (session_id, covered),
+        )
+        self._conn.execute("COMMIT")
+
+    def _sweep(self):
+        cutoff = time.time() - self._ttl
+        self._conn.execute("BEGIN")
+        self._conn.execute(
+            "DELETE FROM session_log WHERE id IN (SELECT id FROM session_snapshot WHERE updated < ?)", (cutoff,)
+        )
+        removed = self._conn.execute("DELETE FROM session_snapshot WHERE updated < ?", (cutoff,)).rowcount
+        self._conn.execute("COMMIT")
+        return removed
+
+    def _delete(self, session_id):
+        self._conn.execute("BEGIN")
+        self._conn.execute("DELETE FROM session_log WHERE id = ?", (session_id,))
+        self._conn.execute("DELETE FROM session_snapshot WHERE id = ?", (session_id,))
+        self._conn.execute("COMMIT")
+
+    async def load(self, session_id):
+        return await asyncio.to_thread(self._run, self._load, session_id)
+
+    async def append(self, session_id, ops):
+        return await asyncio.to_thread(self._run, self._append, session_id, ops)
+
+    async def save_snapshot(self, session_id, snapshot, covered):
+        await asyncio.to_thread(self._run, self._save_snapshot, session_id, snapshot, covered)
+
+    async def delete(self, session_id):
+        await asyncio.to_thread(self._run, self._delete, session_id)
+
+    async def sweep(self):
+        if not self._ttl:
+            return 0
+        return await asyncio.to_thread(self._run, self._sweep)
+
+    async def close(self):
+        await asyncio.to_thread(self._run, self._conn.close)
+
+
+# ------------------ Redis (RESP2) ------------------
+
+class RespError(Exception):
+    """Error devuelto por el servidor Redis (-ERR ...)."""
+
+
+# Comandos que no se pueden reenviar a ciegas: si la conexión cae después de
+# enviarlos no se sabe si el servidor los aplicó (un RPUSH repetido duplica ops)
+_NOT_RETRYABLE = frozenset(("RPUSH", "LPUSH", "INCR", "INCRBY", "APPEND"))
+
+
+class RespConnection:
+    """Conexión mínima RESP2 sobre asyncio (una request a la vez)."""
+
+    def __init__(self, host: str, port: int, password: Optional[str] = None, db: int = 0):
+        self._host = host
+        self._port = port
+        self._password = password
+        self._db = db
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _encode(args) -> bytes:
+        out = [b"*%d\r\n" % len(args)]
+        for a in args:
+            if not isinstance(a, bytes):
+                a = str(a).encode("utf-8")
+            out.append(b"$%d\r\n%s\r\n" % (len(a), a))
+        return b"".join(out)
+
+    async def _read_reply(self):
+        line = await self._reader.readline()
+        if not line:
+            raise ConnectionError("Redis cerró la conexión")
+        kind, rest = line[:1], line[1:-2]
+        if kind == b"+":
+            return rest
+        if kind == b"-":
+            raise RespError(rest.decode("utf-8", "replace"))
+        if kind == b":":
+            return int(rest)
+        if kind == b"$":
+            n = int(rest)
+            if n < 0:
+                return None
+            data = await self._reader.readexactly(n + 2)
+            return data[:-2]
+        if kind == b"*":
+            n = int(rest)
+            if n < 0:
+                return None
+            return [await self._read_reply() for _ in range(n)]
+        raise RespError(f"respuesta RESP inválida: {line!r}")
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.open_connection(self._host, self._port)
+        if self._password:
+            await self._send_recv([("AUTH", self._password)])
+        if self._db:
+            await self._send_recv([("SELECT", self._db)])
+
+    async def _send_recv(self, commands):
+        self._writer.write(b"".join(self._encode(c) for c in commands))
+        await self._writer.drain()
+        return [await self._read_reply() for _ in commands]
+
+    async def pipeline(self, *commands) -> list:
+        """Envía varios comandos en un solo round-trip y devuelve sus respuestas."""
+        async with self._lock:
+            if self._writer is None or self._writer.is_closing() or self._reader.at_eof():
+                # Conexión cerrada por el servidor (p. ej. timeout por inactividad)
+                await self._connect()
+            try:
+                return await self._send_recv(commands)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                self._writer.close()
+                self._writer = None
+                if any(str(c[0]).upper() in _NOT_RETRYABLE for c in commands):
+                    raise
+                # Reintento único con conexión nueva (solo comandos idempotentes)
+                await self._connect()
+                return await self._send_recv(commands)
+
+    async def execute(self, *args):
+        (reply,) = await self.pipeline(args)
+        return reply
+
+    async def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+
+
+class RedisBackend(SessionBackend):
+    """Backend sobre el protocolo Redis (Redis, Valkey, KeyDB o redis_standin.py).
+
+    Claves: <prefix><id>:snap (string) y <prefix><id>:log (lista de ops).
+
+    Args:
+        url: redis://[:password@]host:port/db
+        ttl: Expiración de las claves en segundos (0 = sin expiración).
+    """
+
+    def __init__(self, url: str, ttl: float = 0, prefix: str = "consultia:sess:"):
+        u = urlparse(url)
+        db = int((u.path or "/0").lstrip("/") or 0)
+        self._conn = RespConnection(u.hostname or "localhost", u.port or 6379, u.password, db)
+        self._ttl = int(ttl)
+        self._prefix = prefix
+
+    def _keys(self, session_id: str) -> Tuple[str, str]:
+        base = f"{self._prefix}{session_id}"
+        return f"{base}:snap", f"{base}:log"
+
+    def _expire(self, *keys) -> list:
+        return [("EXPIRE", k, self._ttl) for k in keys] if self._ttl else []
+
+    async def load(self, session_id):
+        snap_key, log_key = self._keys(session_id)
+        snap, log = await self._conn.pipeline(("GET", snap_key), ("LRANGE", log_key, 0, -1))
+        if snap is None and not log:
+            return None
+        return snap or None, log or []
+
+    async def append(self, session_id, ops):
+        snap_key, log_key = self._keys(session_id)
+        replies = await self._conn.pipeline(
+            ("RPUSH", log_key, *[dumps_compact(op) for op in ops]),
+            *self._expire(snap_key, log_key),
+        )
+        return replies[0]
+
+    async def save_snapshot(self, session_id, snapshot, covered):
+        snap_key, log_key = self._keys(session_id)
+        await self._conn.pipeline(
+            ("SET", snap_key, snapshot),
+            # Solo se recortan las ops incluidas en el snapshot (otras pudieron llegar después)
+            ("LTRIM", log_key, covered, -1),
+            *self._expire(snap_key, log_key),
+        )
+
+    async def delete(self, session_id):
+        await self._conn.execute("DEL", *self._keys(session_id))
+
+    async def close(self):
+        await self._conn.close()
+
+
+def make_backend(kind: str, url: str = "", ttl: float = 0) -> Optional[SessionBackend]:
+    """Crea el backend según SESSION_BACKEND ("" = solo RAM del proceso)."""
+    kind = (kind or "").lower()
+    if not kind or kind == "none":
+        return None
+    if kind == "memory":
+        return MemoryBackend()
+    if kind == "sqlite":
+        return SqliteBackend(url or "sessions.db", ttl=ttl)
+    if kind == "redis":
+        return RedisBackend(url or "redis://localhost:6379/0", ttl=ttl)
+    raise ValueError(f"SESSION_BACKEND desconocido: {kind}")
@@ -0,0 +1,304 @@
+# session_store.py
+# Almacén de sesiones en memoria con expiración y límite de memoria
+# - TTL por inactividad: se barre periódicamente (sweep) y se eliminan las
+#   sesiones sin actividad hace más de `ttl` segundos
+# - LRU bajo presupuesto de memoria: si el tamaño estimado total supera
+#   `max_bytes` (o hay más de `max_sessions`), se desalojan las menos usadas
+# - Las sesiones con un WebSocket abierto (acquire/release) nunca se desalojan
+# - Métricas: sesiones vivas, fijadas, bytes estimados, desalojos por causa
+# - Opcional: backend externo (session_backends.py) para compartir el estado entre
+#   workers; la RAM actúa como caché y cada cambio se persiste como op incremental
+
+import asyncio
+import logging
+import sys
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional
+
+from session_backends import SessionBackend, encode_snapshot, restore_state
+
+logger = logging.getLogger("uvicorn.error")
+
+# Overhead aproximado por contenedor/valor (CPython 64 bits, orden de magnitud)
+_DICT_OVERHEAD = 64
+_ITEM_OVERHEAD = 16
+
+
+def estimate_size(value: Any) -> int:
+    """Tamaño aproximado en bytes de un estado de sesión (dict/list/str/números).
+
+    No pretende ser exacto como sys.getsizeof recursivo; es barato y estable,
+    suficiente para comparar contra un presupuesto.
+    """
+    if isinstance(value, str):
+        return 49 + len(value)
+    if isinstance(value, dict):
+        return _DICT_OVERHEAD + sum(
+            _ITEM_OVERHEAD + estimate_size(k) + estimate_size(v) for k, v in value.items()
+        )
+    if isinstance(value, (list, tuple)):
+        return _DICT_OVERHEAD + sum(_ITEM_OVERHEAD + estimate_size(v) for v in value)
+    if value is None or isinstance(value, (bool, int, float)):
+        return _ITEM_OVERHEAD
+    return sys.getsizeof(value)
+
+
+class _Entry:
+    __slots__ = ("state", "last_access", "size", "refs", "persist_lock", "log_len", "inflight_ops")
+
+    def __init__(self, state: Dict[str, Any], log_len: int = 0):
+        self.state = state
+        self.last_access = time.monotonic()
+        self.size = estimate_size(state)
+        self.refs = 0
+        # persist(): appends en orden de llamada; log_len = ops en el log del backend
+        # (según la última respuesta), inflight_ops = ops llamadas pero aún no agregadas
+        self.persist_lock = asyncio.Lock()
+        self.log_len = log_len
+        self.inflight_ops = 0
+
+
+class SessionManager:
+    """Sesiones de consulta en RAM con TTL y desalojo LRU.
+
+    Args:
+        ttl: Segundos de inactividad antes de expirar (0 = sin TTL).
+        max_bytes: Presupuesto de memoria estimada para todas las sesiones (0 = sin límite).
+        max_sessions: Máximo de sesiones vivas (0 = sin límite).
+        backend: Almacén externo compartido (None = solo RAM del proceso).
+        log_max: Ops en el log del backend antes de compactar en un snapshot.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_bytes: int = 0,
+        max_sessions: int = 0,
+        backend: Optional[SessionBackend] = None,
+        log_max: int = 200,
+    ):
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._max_sessions = max_sessions
+        self._backend = backend
+        self._log_max = log_max
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._total_bytes = 0
+        self._sweeper: Optional[asyncio.Task] = None
+
+        # Métricas
+        self.created = 0
+        self.evicted_ttl = 0
+        self.evicted_memory = 0
+        self.backend_loads = 0
+        self.backend_ops = 0
+        self.backend_snapshots = 0
+        self.backend_errors = 0
+
+    # ---------- Acceso ----------
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __getitem__(self, session_id: str) -> Dict[str, Any]:
+        entry = self._entries[session_id]
+        self._touch(session_id, entry)
+        return entry.state
+
+    def get_or_create(self, session_id: str, factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            entry = _Entry(factory())
+            self._entries[session_id] = entry
+            self._total_bytes += entry.size
+            self.created += 1
+            self._enforce_budget(keep=session_id)
+        else:
+            self._touch(session_id, entry)
+        return entry.state
+
+    async def load_or_create(self, session_id: str, factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Como get_or_create, pero consultando antes el backend externo.
+
+        Si la sesión no tiene un WebSocket abierto en este worker se recarga del
+        backend (otro worker pudo haberla modificado); si no existe, se crea.
+        """
+        entry = self._entries.get(session_id)
+        if self._backend is None or (entry is not None and entry.refs > 0):
+            return self.get_or_create(session_id, factory)
+        try:
+            stored = await self._backend.load(session_id)
+        except Exception:
+            self.backend_errors += 1
+            logger.exception(f"[SESSIONS] backend load error session={session_id}")
+            return self.get_or_create(session_id, factory)
+        if stored is None:
+            return self.get_or_create(session_id, factory)
+
+        state = restore_state(factory(), *stored)
+        self.backend_loads += 1
+        if entry is not None:
+            self._evict(session_id)
+        entry = _Entry(state, log_len=len(stored[1]))
+        self._entries[session_id] = entry
+        self._total_bytes += entry.size
+        self._enforce_budget(keep=session_id)
+        return state
+
+    async def persist(self, session_id: str, ops: List[Dict[str, Any]]) -> None:
+        """Agrega ops al backend; compacta en un snapshot cada `log_max` ops.
+
+        Se llama justo después de aplicar `ops` al estado en RAM, sin await en el
+        medio. El snapshot se codifica en ese momento (el estado refleja exactamente
+        las ops hasta éstas) y se guarda bajo el lock de la sesión junto con el
+        conteo del log que devolvió el append: un append concurrente (segmento del
+        WebSocket vs set/push del pipeline) nunca queda dentro del snapshot y
+        además en el log, donde se volvería a aplicar al restaurar.
+
+        Los errores del backend se registran pero no interrumpen la consulta
+        (el estado en RAM sigue siendo válido).
+        """
+        if self._backend is None or not ops:
+            return
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        snapshot = None
+        if entry.log_len + entry.inflight_ops + len(ops) >= self._log_max:
+            snapshot = encode_snapshot(entry.state)
+        entry.inflight_ops += len(ops)
+        try:
+            # asyncio.Lock es FIFO: los appends llegan al backend en orden de llamada
+            async with entry.persist_lock:
+                try:
+                    count = await self._backend.append(session_id, ops)
+                finally:
+                    entry.inflight_ops -= len(ops)
+                entry.log_len = count
+                self.backend_ops += len(ops)
+                if snapshot is not None and count >= self._log_max:
+                    await self._backend.save_snapshot(session_id, snapshot, count)
+                    entry.log_len = 0
+                    self.backend_snapshots += 1
+        except Exception:
+            self.backend_errors += 1
+            logger.exception(f"[SESSIONS] backend persist error session={session_id}")
+
+    async def close_backend(self) -> None:
+        if self._backend is not None:
+            await self._backend.close()
+
+    def _touch(self, session_id: str, entry: _Entry) -> None:
+        entry.last_access = time.monotonic()
+        self._entries.move_to_end(session_id)
+
+    def update_size(self, session_id: str) -> None:
+        """Recalcula el tamaño de la sesión (llamar tras modificar su estado)."""
+        entry = self._entries.get(session_id)
+        if entry is None:
+            return
+        size = estimate_size(entry.state)
+        self._total_bytes += size - entry.size
+        entry.size = size
+        self._touch(session_id, entry)
+        self._enforce_budget(keep=session_id)
+
+    # ---------- Conexiones activas ----------
+
+    def acquire(self, session_id: str) -> None:
+        """Marca la sesión como en uso (no se desaloja mientras tenga refs)."""
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry.refs += 1
+            self._touch(session_id, entry)
+
+    def release(self, session_id: str) -> None:
+        entry = self._entries.get(session_id)
+        if entry is not None:
+            entry.refs = max(0, entry.refs - 1)
+            self._touch(session_id, entry)
+
+    # ---------- Desalojo ----------
+
+    def _evict(self, session_id: str) -> None:
+        entry = self._entries.pop(session_id)
+        self._total_bytes -= entry.size
+
+    def _over_budget(self) -> bool:
+        if self._max_bytes and self._total_bytes > self._max_bytes:
+            return True
+        return bool(self._max_sessions and len(self._entries) > self._max_sessions)
+
+    def _enforce_budget(self, keep: Optional[str] = None) -> None:
+        if not self._over_budget():
+            return
+        # OrderedDict: del menos reciente al más reciente
+        for sid in list(self._entries):
+            if not self._over_budget():
+                break
+            entry = self._entries[sid]
+            if sid == keep or entry.refs > 0:
+                continue
+            self._evict(sid)
+            self.evicted_memory += 1
+            logger.info(f"[SESSIONS] evicted (LRU/memoria) session={sid} size={entry.size}")
+
+    def sweep(self) -> int:
+        """Elimina las sesiones inactivas más allá del TTL. Devuelve cuántas."""
+        if not self._ttl:
+            return 0
+        cutoff = time.monotonic() - self._ttl
+        expired = [sid for sid, e in self._entries.items() if e.refs == 0 and e.last_access < cutoff]
+        for sid in expired:
+            self._evict(sid)
+        self.evicted_ttl += len(expired)
+        if expired:
+            logger.info(f"[SESSIONS] expiradas por TTL: {len(expired)} (vivas={len(self._entries)})")
+        return len(expired)
+
+    # ---------- Barrido periódico ----------
+
+    def start(self, interval: float = 60) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_loop(interval))
+
+    async def _sweep_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.sweep()
+                if self._backend is not None:
+                    # Expiradas en el backend (SQLite no expira solo; una vez por barrido, no en cada load)
+                    removed = await self._backend.sweep()
+                    if removed:
+                        logger.info(f"[SESSIONS] backend: expiradas por TTL: {removed}")
+            except Exception:
+                logger.exception("[SESSIONS] sweep error")
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    # ---------- Métricas ----------
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "live": len(self._entries),
+            "pinned": sum(1 for e in self._entries.values() if e.refs > 0),
+            "bytes": self._total_bytes,
+            "max_bytes": self._max_bytes,
+            "created": self.created,
+            "evicted_ttl": self.evicted_ttl,
+            "evicted_memory": self.evicted_memory,
+            "backend": type(self._backend).__name__ if self._backend else None,
+            "backend_loads": self.backend_loads,
+            "backend_ops": self.backend_ops,
+            "backend_snapshots": self.backend_snapshots,
+            "backend_errors": self.backend_errors,
+        }
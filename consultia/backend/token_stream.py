@@ -0,0 +1,123 @@
+# token_stream.py
+# Envío de tokens del LLM al WebSocket con control de backpressure
+# - TokenBatcher: agrupa deltas pequeños en frames por presupuesto de tiempo/tamaño;
+#   si el socket va lento, los deltas que llegan mientras se envía un frame se
+#   fusionan en el siguiente (no se encolan frames sin límite)
+# - LatencyStats: métricas de time-to-first-token por modo (stream / fallback)
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger("uvicorn.error")
+
+
+class TokenBatcher:
+    """Agrupa deltas de texto en frames `assistant_token`.
+
+    Args:
+        send: Corrutina que envía un mensaje JSON (p. ej. ws.send_json).
+        max_delay: Segundos máximos que un delta espera antes de salir en un frame.
+        max_chars: Tamaño de frame que fuerza el envío inmediato.
+    """
+
+    def __init__(
+        self,
+        send: Callable[[Dict[str, Any]], Awaitable[None]],
+        max_delay: float = 0.05,
+        max_chars: int = 64,
+    ):
+        self._send = send
+        self._max_delay = max(0.0, max_delay)
+        self._max_chars = max(1, max_chars)
+        self._buf: List[str] = []
+        self._chars = 0
+        self._has_data = asyncio.Event()
+        self._full = asyncio.Event()
+        self._closing = False
+        self._task: Optional[asyncio.Task] = None
+
+        # Métricas simples
+        self.deltas_in = 0
+        self.frames_out = 0
+
+    def push(self, delta: str) -> None:
+        """Agrega un delta al frame en construcción (no bloquea)."""
+        if not delta or self._closing:
+            return
+        self.deltas_in += 1
+        self._buf.append(delta)
+        self._chars += len(delta)
+        self._has_data.set()
+        if self._chars >= self._max_chars:
+            self._full.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_data.wait()
+            if not self._closing and self._chars < self._max_chars:
+                # Presupuesto de tiempo: esperar a llenar el frame o a que venza
+                try:
+                    await asyncio.wait_for(self._full.wait(), timeout=self._max_delay)
+                except asyncio.TimeoutError:
+                    pass
+
+            text = "".join(self._buf)
+            self._buf.clear()
+            self._chars = 0
+            self._has_data.clear()
+            self._full.clear()
+
+            if text:
+                # Mientras este send esté bloqueado (cliente lento), los deltas
+                # nuevos se acumulan en _buf y salen fusionados en el próximo frame
+                await self._send({"type": "assistant_token", "delta": text})
+                self.frames_out += 1
+
+            if self._closing and not self._buf:
+                return
+
+    async def aclose(self) -> None:
+        """Envía lo pendiente y termina el sender."""
+        self._closing = True
+        if self._task is None:
+            return
+        self._has_data.set()
+        self._full.set()
+        await self._task
+
+    def cancel(self) -> None:
+        """Descarta lo pendiente (p. ej. si el resumen fue reemplazado)."""
+        self._closing = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+
+
+class LatencyStats:
+    """Acumula time-to-first-token y duración total por modo de llamada."""
+
+    def __init__(self):
+        self._data: Dict[str, Dict[str, float]] = {}
+
+    def record(self, mode: str, ttft: Optional[float], total: float) -> None:
+        d = self._data.setdefault(mode, {"calls": 0, "ttft_calls": 0, "ttft_sum": 0.0, "total_sum": 0.0})
+        d["calls"] += 1
+        d["total_sum"] += total
+        if ttft is not None:
+            # Solo las llamadas que llegaron a emitir un token cuentan para el promedio de TTFT
+            d["ttft_calls"] += 1
+            d["ttft_sum"] += ttft
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        out = {}
+        for mode, d in self._data.items():
+            n = d["calls"] or 1
+            out[mode] = {
+                "calls": d["calls"],
+                "ttft_calls": d["ttft_calls"],
+                "avg_ttft_ms": round(d["ttft_sum"] / (d["ttft_calls"] or 1) * 1000, 1),
+                "avg_total_ms": round(d["total_sum"] / n * 1000, 1),
+            }
+        return out
@@ -0,0 +1,165 @@
+# transcript.py
+# Transcript de la consulta como lista de segmentos (un fragmento "final" cada uno)
+#
+# Antes cada fragmento reconstruía state["final"] concatenando el string completo
+# y cada consumidor volvía a cortar la cola ([-2000:], [-1500:], [-4000:]): copias
+# O(n) por fragmento, cuadrático en dictados de una hora.
+#
+# Aquí cada segmento guarda su texto, timestamp y offset acumulado:
+#   - append(): O(1), sin copiar lo anterior
+#   - tail(chars) / tail_tokens(n): recorre solo los segmentos del final
+#   - evidence(value): segmentos que mejor respaldan un valor (para explain_deltas),
+#     vía un índice invertido término → segmentos armado en append (no se vuelve
+#     a normalizar el transcript por cada campo cambiado)
+#   - text: el string completo se arma solo si alguien lo pide (y se cachea)
+#   - __sizeof__: contador acumulado, O(1) (session_store lo consulta por fragmento)
+
+import re
+import time
+from bisect import bisect_right
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional
+
+from form_context import normalize_text
+
+SEPARATOR = " "
+# Aproximación usada en el resto del backend (ver bench_schema_digest.py)
+CHARS_PER_TOKEN = 4
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_STOPWORDS = frozenset((
+    "que", "con", "por", "para", "los", "las", "del", "una", "uno", "unos", "unas", "sus",
+    "esta", "este", "esto", "como", "pero", "mas", "muy", "tiene", "hay", "desde", "hace",
+))
+
+
+def _significant(words: Iterable[str]) -> set:
+    return {w for w in words if (len(w) >= 3 or w.isdigit()) and w not in _STOPWORDS}
+
+
+def _terms(value: Any) -> set:
+    """Palabras significativas (>= 3 chars, sin tildes) de un valor del formulario."""
+    if isinstance(value, dict):
+        return set().union(*(_terms(v) for v in value.values())) if value else set()
+    if isinstance(value, (list, tuple)):
+        return set().union(*(_terms(v) for v in value)) if value else set()
+    if value is None or isinstance(value, bool):
+        return set()
+    return _significant(_WORD_RE.findall(normalize_text(str(value))))
+
+
+class Transcript:
+    """Buffer de segmentos con timestamps y offsets acumulados.
+
+    Los segmentos se unen con un espacio; `offsets[i]` es la posición del
+    segmento i dentro de `text`.
+    """
+
+    __slots__ = ("_segments", "_times", "_offsets", "_length", "_text", "_index", "_bytes")
+
+    def __init__(self):
+        self._segments: List[str] = []
+        self._times: List[float] = []
+        self._offsets: List[int] = []
+        self._length = 0
+        self._text: Optional[str] = ""
+        self._index: Dict[str, List[int]] = {}   # término → índices de segmento (ascendente)
+        self._bytes = 64                         # tamaño estimado (ver __sizeof__)
+
+    # ---------- Escritura ----------
+
+    def append(self, text: str, ts: Optional[float] = None) -> str:
+        """Agrega un fragmento (con punto final si no tiene puntuación). Devuelve el segmento."""
+        text = text.strip()
+        if not text:
+            return ""
+        if not text.endswith((".", "?", "!")):
+            text += "."
+        self._add(text, time.time() if ts is None else ts)
+        return text
+
+    def _add(self, segment: str, ts: float) -> None:
+        offset = self._length + (len(SEPARATOR) if self._segments else 0)
+        self._segments.append(segment)
+        self._times.append(ts)
+        self._offsets.append(offset)
+        self._length = offset + len(segment)
+        self._text = None
+        i = len(self._segments) - 1
+        terms = _significant(_WORD_RE.findall(normalize_text(segment)))
+        for term in terms:
+            self._index.setdefault(term, []).append(i)
+        # Mismo orden de magnitud que estimate_size: texto + listas + postings del índice
+        self._bytes += 49 + len(segment) + 24 + 8 * len(terms)
+
+    # ---------- Lectura ----------
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __bool__(self) -> bool:
+        return bool(self._segments)
+
+    def __str__(self) -> str:
+        return self.text
+
+    def __sizeof__(self) -> int:
+        # Lo usa estimate_size (session_store.py) para el presupuesto de memoria
+        return self._bytes
+
+    @property
+    def segments(self) -> List[str]:
+        return self._segments
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = SEPARATOR.join(self._segments)
+        return self._text
+
+    def tail(self, max_chars: int) -> str:
+        """Últimos max_chars caracteres (equivale a text[-max_chars:] sin armar text)."""
+        if max_chars <= 0:
+            return ""
+        if self._length <= max_chars:
+            return self.text
+        # Primer segmento que termina dentro de la ventana
+        start = bisect_right(self._offsets, self._length - max_chars) - 1
+        window = SEPARATOR.join(self._segments[max(start, 0):])
+        return window[-max_chars:]
+
+    def tail_tokens(self, max_tokens: int) -> str:
+        """Cola aproximada por tokens (CHARS_PER_TOKEN chars por token)."""
+        return self.tail(max_tokens * CHARS_PER_TOKEN)
+
+    def segment_at(self, offset: int) -> int:
+        """Índice del segmento que contiene `offset` (posición en text)."""
+        return max(bisect_right(self._offsets, offset) - 1, 0)
+
+    def since(self, ts: float) -> List[str]:
+        """Segmentos agregados desde el timestamp `ts`."""
+        return self._segments[bisect_right(self._times, ts):]
+
+    def evidence(self, value: Any, limit: int = 2, max_chars: int = 240) -> List[str]:
+        """Segmentos que más palabras comparten con `value` (los más recientes ganan empates)."""
+        terms = _terms(value)
+        if not terms:
+            return []
+        hits: Counter = Counter()
+        for term in terms:
+            hits.update(self._index.get(term, ()))
+        best = sorted(hits.items(), key=lambda x: (-x[1], -x[0]))[:limit]
+        return [self._segments[i][:max_chars] for i, _ in best]
+
+    # ---------- Serialización (snapshot de session_backends.py) ----------
+
+    def to_json(self) -> Dict[str, List]:
+        return {"s": self._segments, "t": self._times}
+
+    @classmethod
+    def from_json(cls, data: Optional[Dict[str, Iterable]]) -> "Transcript":
+        tr = cls()
+        if data:
+            for seg, ts in zip(data.get("s", []), data.get("t", [])):
+                tr._add(seg, ts)
+        return tr
@@ -0,0 +1,290 @@
+# uploads.py
+# Manejo de archivos subidos a /extract-document sin leerlos enteros en memoria
+# - UploadLimitMiddleware: 413 apenas el Content-Length (o los bytes recibidos, si
+#   no viene) superan el límite, antes de que Starlette termine de recibir y
+#   escribir a disco el multipart
+# - Imágenes: se hashea el temporal de Starlette en su lugar (hash_upload) y se lo
+#   toma tal cual (take_upload_file); Pillow lee de él, sin copia ni bytes intermedio
+# - PDFs: copia en bloques (UPLOAD_CHUNK) a un NamedTemporaryFile calculando el
+#   sha256 en la misma pasada, para que pdftoppm lea la ruta (el temporal de
+#   Starlette no tiene nombre; convert_from_bytes escribía otra copia igual)
+# - image_data_url: el data URL base64 sin copias intermedias del payload
+# Benchmark de memoria: bench_upload_rss.py
+
+import binascii
+import hashlib
+import io
+import json
+import tempfile
+from typing import Any, BinaryIO, Callable, Dict, Iterable, Optional, Tuple
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+UPLOAD_CHUNK = 1024 * 1024
+# Múltiplo de 3: cada bloque codifica sin relleno "=" intermedio
+_B64_BLOCK = 3 * 64 * 1024
+# Margen del cuerpo multipart sobre el archivo (boundaries, cabeceras de la parte, campos)
+FORM_OVERHEAD = 64 * 1024
+
+
+class UploadTooLarge(Exception):
+    """El archivo supera el límite de tamaño configurado."""
+
+    def __init__(self, limit: int):
+        super().__init__(f"El archivo supera el máximo de {limit / (1024 * 1024):g} MB")
+        self.limit = limit
+
+
+class UploadStats:
+    """Contadores de subidas (para /metrics), incluido el pico de RSS del proceso."""
+
+    def __init__(self):
+        self.uploads = 0
+        self.bytes = 0
+        self.largest = 0
+        self.spilled = 0        # temporales que superaron la RAM y pasaron a disco
+        self.rejected = 0       # 413 por tamaño
+
+    def record(self, size: int, spool: BinaryIO) -> None:
+        self.uploads += 1
+        self.bytes += size
+        self.largest = max(self.largest, size)
+        if getattr(spool, "_rolled", True):
+            self.spilled += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "uploads": self.uploads,
+            "bytes": self.bytes,
+            "largest": self.largest,
+            "spilled_to_disk": self.spilled,
+            "rejected": self.rejected,
+            "peak_rss_kb": peak_rss_kb(),
+        }
+
+
+def _proc_status_kb(field: str) -> int:
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+def peak_rss_kb() -> int:
+    """Pico de RSS del proceso en KB (0 si no está disponible).
+
+    En Linux usa VmHWM: ru_maxrss hereda el pico del proceso padre a través de exec.
+    """
+    peak = _proc_status_kb("VmHWM")
+    if peak or resource is None:
+        return peak
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def current_rss_kb() -> int:
+    """RSS actual del proceso en KB (solo Linux; 0 si no está disponible)."""
+    return _proc_status_kb("VmRSS")
+
+
+def upload_hasher(version: str = ""):
+    """sha256 incremental de la subida, precedido por la versión del extractor (modelo/prompt)."""
+    return hashlib.sha256(version.encode("utf-8"))
+
+
+class UploadLimitMiddleware:
+    """Middleware ASGI: 413 para cuerpos de `paths` que superan `limit` (+ FORM_OVERHEAD).
+
+    Con Content-Length se rechaza sin leer el cuerpo. Sin él (chunked) se cuentan
+    los bytes recibidos: al pasarse, la app ve un "http.disconnect" (deja de leer)
+    y su respuesta de error se reemplaza por el 413.
+
+    Args:
+        app: App ASGI envuelta.
+        limit: Bytes máximos del archivo (0 = sin límite).
+        paths: Rutas a las que aplica.
+        on_reject: Callback opcional por cada rechazo (métricas).
+    """
+
+    def __init__(self, app, limit: int, paths: Iterable[str] = (), on_reject: Optional[Callable[[], None]] = None):
+        self._app = app
+        self._limit = limit
+        self._max_body = limit + FORM_OVERHEAD
+        self._paths = frozenset(paths)
+        self._on_reject = on_reject
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self._limit or scope.get("path") not in self._paths:
+            await self._app(scope, receive, send)
+            return
+        length = dict(scope.get("headers") or ()).get(b"content-length")
+        if length is not None and length.isdigit() and int(length) > self._max_body:
+            await self._reject(send)
+            return
+
+        received = 0
+        exceeded = False
+        started = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            if exceeded:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self._max_body:
+                    exceeded = True
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal started
+            if message["type"] == "http.response.start":
+                if started:
+                    return
+                started = True
+                if exceeded:
+                    await self._reject(send)
+                    return
+            elif exceeded:
+                return
+            await send(message)
+
+        try:
+            await self._app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+            if not started:
+                await self._reject(send)
+
+    async def _reject(self, send) -> None:
+        if self._on_reject is not None:
+            self._on_reject()
+        body = json.dumps({"success": False, "error": str(UploadTooLarge(self._limit))}, ensure_ascii=False).encode("utf-8")
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                        (b"connection", b"close")],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+
+def hash_upload(source: BinaryIO, limit: int, hasher) -> int:
+    """Hashea `source` en su lugar, en bloques, y lo deja al inicio (bloqueante: usar en un thread).
+
+    Returns:
+        Tamaño en bytes.
+
+    Raises:
+        UploadTooLarge: si se supera `limit` (0 = sin límite).
+    """
+    size = 0
+    source.seek(0)
+    buf = bytearray(UPLOAD_CHUNK)
+    view = memoryview(buf)
+    while True:
+        n = source.readinto(view) if hasattr(source, "readinto") else _read_into(source, view)
+        if not n:
+            break
+        size += n
+        if limit and size > limit:
+            raise UploadTooLarge(limit)
+        hasher.update(view[:n])
+    source.seek(0)
+    return size
+
+
+def take_upload_file(upload) -> BinaryIO:
+    """Se adueña del temporal de un UploadFile de Starlette (lo cierra quien lo toma).
+
+    FastAPI cierra los archivos del formulario al volver del endpoint, antes de que
+    una StreamingResponse termine; al cambiar `upload.file` ese cierre ya no lo alcanza.
+    """
+    spool, upload.file = upload.file, io.BytesIO()
+    return spool
+
+
+def spool_upload(
+    source: BinaryIO,
+    limit: int,
+    hasher=None,
+    named: bool = False,
+    memory_max: int = 2 * 1024 * 1024,
+    directory: str = None,
+) -> Tuple[BinaryIO, int]:
+    """Copia `source` en bloques a un temporal propio (bloqueante: usar en un thread).
+
+    Args:
+        source: Archivo de origen (UploadFile.file). Para imágenes basta hash_upload.
+        limit: Bytes máximos (0 = sin límite).
+        hasher: hashlib opcional que se actualiza con cada bloque.
+        named: True → NamedTemporaryFile en disco (con .name para herramientas externas).
+        memory_max: Tamaño hasta el que el SpooledTemporaryFile queda en RAM.
+
+    Returns:
+        (archivo temporal posicionado al inicio, tamaño en bytes). El llamador lo cierra.
+
+    Raises:
+        UploadTooLarge: si se supera `limit` (el temporal ya quedó cerrado).
+    """
+    if named:
+        spool = tempfile.NamedTemporaryFile(suffix=".pdf", dir=directory)
+    else:
+        spool = tempfile.SpooledTemporaryFile(max_size=memory_max, dir=directory)
+    size = 0
+    try:
+        source.seek(0)
+        buf = bytearray(UPLOAD_CHUNK)
+        view = memoryview(buf)
+        while True:
+            n = source.readinto(view) if hasattr(source, "readinto") else _read_into(source, view)
+            if not n:
+                break
+            size += n
+            if limit and size > limit:
+                raise UploadTooLarge(limit)
+            if hasher is not None:
+                hasher.update(view[:n])
+            spool.write(view[:n])
+        spool.flush()
+        spool.seek(0)
+    except BaseException:
+        spool.close()
+        raise
+    return spool, size
+
+
+def _read_into(source: BinaryIO, view: memoryview) -> int:
+    chunk = source.read(len(view))
+    view[:len(chunk)] = chunk
+    return len(chunk)
+
+
+def image_data_url(data, mime: str) -> str:
+    """data:<mime>;base64,... con la menor cantidad de copias del payload.
+
+    `data` puede ser bytes o un memoryview (p. ej. BytesIO.getbuffer()), no se copia.
+    La codificación va por bloques a un bytearray del tamaño final y se decodifica
+    una sola vez: en memoria conviven el bytearray y el str resultante, en lugar de
+    bytes base64 + str decodificado + str del f-string.
+    """
+    prefix = f"data:{mime};base64,".encode("ascii")
+    view = memoryview(data).cast("B")
+    n = len(view)
+    out = bytearray(len(prefix) + 4 * ((n + 2) // 3))
+    out[:len(prefix)] = prefix
+    pos = len(prefix)
+    for start in range(0, n, _B64_BLOCK):
+        chunk = binascii.b2a_base64(view[start:start + _B64_BLOCK], newline=False)
+        out[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+    return out.decode("ascii")
@@ -0,0 +1,274 @@
+# vitals.py
+# Pre-extractor local (reglas) de signos vitales y campos numéricos
+#
+# Fragmentos como "presión 120 sobre 80" o "temperatura treinta y ocho grados"
+# se mapean de forma determinista a examenClinico.signosVitales. Se extraen aquí
+# en microsegundos, con el mismo formato de delta que consume deep_merge; si el
+# fragmento no contiene nada más que esos datos (covered=True) se omite el LLM.
+#
+# Cubre: PA, FC, FR, SpO2, temperatura, peso, talla, glasgow y edad (años/meses),
+# con números en cifras o dictados ("ciento veinte", "treinta y ocho punto cinco").
+# Corpus y tasa de aciertos: bench_vitals.py
+
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from form_context import normalize_text
+
+# ------------------ Números dictados ------------------
+
+_UNITS = {
+    "cero": 0, "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9,
+}
+_TEENS = {
+    "diez": 10, "once": 11, "doce": 12, "trece": 13, "catorce": 14, "quince": 15,
+    "dieciseis": 16, "diecisiete": 17, "dieciocho": 18, "diecinueve": 19,
+    "veinte": 20, "veintiun": 21, "veintiuno": 21, "veintidos": 22, "veintitres": 23,
+    "veinticuatro": 24, "veinticinco": 25, "veintiseis": 26, "veintisiete": 27,
+    "veintiocho": 28, "veintinueve": 29,
+}
+_TENS = {
+    "treinta": 30, "cuarenta": 40, "cincuenta": 50, "sesenta": 60, "setenta": 70,
+    "ochenta": 80, "noventa": 90,
+}
+_HUNDREDS = {
+    "cien": 100, "ciento": 100, "doscientos": 200, "trescientos": 300, "cuatrocientos": 400,
+    "quinientos": 500, "seiscientos": 600, "setecientos": 700, "ochocientos": 800,
+    "novecientos": 900,
+}
+_DECIMAL_WORDS = ("punto", "coma")
+
+
+def _read_number(tokens: List[str], i: int) -> Tuple[Optional[int], int]:
+    """Lee un número dictado desde tokens[i]. Devuelve (valor, siguiente índice)."""
+    value, j, seen = 0, i, False
+    if j < len(tokens) and tokens[j] in _HUNDREDS:
+        value += _HUNDREDS[tokens[j]]
+        j, seen = j + 1, True
+    if j < len(tokens) and tokens[j] in _TENS:
+        value += _TENS[tokens[j]]
+        j, seen = j + 1, True
+        if j + 1 < len(tokens) and tokens[j] == "y" and tokens[j + 1] in _UNITS:
+            value += _UNITS[tokens[j + 1]]
+            j += 2
+    elif j < len(tokens) and tokens[j] in _TEENS:
+        value += _TEENS[tokens[j]]
+        j, seen = j + 1, True
+    elif j < len(tokens) and tokens[j] in _UNITS:
+        value += _UNITS[tokens[j]]
+        j, seen = j + 1, True
+    return (value, j) if seen else (None, i)
+
+
+def words_to_digits(text: str) -> str:
+    """Reemplaza números dictados por cifras ("treinta y ocho punto cinco" → "38.5").
+
+    Espera texto normalizado (minúsculas, sin tildes).
+    """
+    tokens = text.split()
+    out: List[str] = []
+    i = 0
+    while i < len(tokens):
+        value, j = _read_number(tokens, i)
+        if value is None or (tokens[i] == "ciento" and i and tokens[i - 1] == "por"):  # "por ciento"
+            out.append(tokens[i])
+            i += 1
+            continue
+        number = str(value)
+        # Decimales: "treinta y ocho punto cinco" / "38 coma 5"
+        if j + 1 < len(tokens) and tokens[j] in _DECIMAL_WORDS:
+            dec, k = _read_number(tokens, j + 1)
+            if dec is None and tokens[j + 1].isdigit():
+                dec, k = int(tokens[j + 1]), j + 2
+            if dec is not None:
+                number, j = f"{value}.{dec}", k
+        out.append(number)
+        i = j
+    text = " ".join(out)
+    # "38 punto 5" / "38,5" (cifras) → 38.5
+    return re.sub(r"(\d+)(?:,| punto | coma )(\d+)", r"\1.\2", text)
+
+
+# ------------------ Reglas ------------------
+
+_NUM = r"(\d+(?:\.\d+)?)"
+_DE = r"(?:\s(?:es|de|del|en|al|a|:))*"
+# Edad solo con frase explícita ("edad de 45", "paciente de 45 años", "45 años de edad"):
+# "tiene 3 meses de evolución" / "2 años sin control" son duraciones, no edades
+_AGE_SUBJECT = r"(?:paciente|varon|mujer|nino|nina|senor|senora|hombre|adulto|adulta|lactante|bebe)"
+_AGE_LEAD = r"(?:edad" + _DE + r"|" + _AGE_SUBJECT + r" de)"
+
+# (path, regex, conversión, rango plausible); el grupo 1 (y 2 para PA) es el valor
+_RULES: List[Tuple[Tuple[str, ...], "re.Pattern", str, Tuple[float, float]]] = [
+    (("examenClinico", "signosVitales", "PA"), re.compile(
+        r"\b(?:presion(?: arterial)?|tension(?: arterial)?|pa)" + _DE +
+        r"\s(\d{2,3})\s?(?:sobre|/|con|entre|x)\s?(\d{2,3})(?:\s(?:mmhg|milimetros de mercurio))?\b"
+    ), "pa", (20, 300)),
+    (("examenClinico", "signosVitales", "FC"), re.compile(
+        r"\b(?:(?:frecuencia cardiaca|fc|pulso)" + _DE + r"\s" + _NUM +
+        r"(?:\s(?:latidos(?: por minuto)?|lpm|por minuto|x minuto|x min))?"
+        r"|" + _NUM + r"\s(?:latidos(?: por minuto)?|lpm))\b"
+    ), "num", (20, 250)),
+    (("examenClinico", "signosVitales", "FR"), re.compile(
+        r"\b(?:(?:frecuencia respiratoria|fr)" + _DE + r"\s" + _NUM +
+        r"(?:\s(?:respiraciones(?: por minuto)?|rpm|por minuto|x minuto|x min))?"
+        r"|" + _NUM + r"\s(?:respiraciones(?: por minuto)?|rpm))\b"
+    ), "num", (4, 80)),
+    (("examenClinico", "signosVitales", "SpO2"), re.compile(
+        r"\b(?:saturacion(?: de oxigeno| de o2)?|saturando|sat|spo2|so2)" + _DE + r"\s" + _NUM +
+        r"(?:\s?(?:%|por ciento|porciento))?"
+    ), "num", (50, 100)),
+    (("examenClinico", "signosVitales", "temperatura"), re.compile(
+        r"\b(?:(?:temperatura|temp|fiebre)" + _DE + r"\s" + _NUM +
+        r"(?:\s(?:grados(?: centigrados| celsius)?|°c?))?"
+        r"|" + _NUM + r"\s(?:grados(?: centigrados| celsius)?(?: de (?:temperatura|fiebre))?|°c?))"
+    ), "num", (30, 45)),
+    (("examenClinico", "signosVitales", "peso"), re.compile(
+        r"\b(?:(?:peso|pesa)" + _DE + r"\s" + _NUM + r"(?:\s(?:kilos|kilogramos|kg|kgs))?"
+        r"|" + _NUM + r"\s(?:kilos|kilogramos|kg|kgs)(?: de peso)?)\b"
+    ), "num", (0.5, 400)),
+    (("examenClinico", "signosVitales", "talla"), re.compile(
+        r"\b(?:(?:talla|mide|estatura)" + _DE + r"\s" +
+        r"(?:(1) (\d{2})|" + _NUM + r")(?:\s(?:metros|metro|m|centimetros|cm|mts))?"
+        r"|" + _NUM + r"\s(?:centimetros|cm)(?: de (?:talla|estatura))?)\b"
+    ), "talla", (30, 250)),
+    (("examenClinico", "signosVitales", "glasgow"), re.compile(
+        r"\b(?:glasgow|escala de glasgow)" + _DE + r"\s(\d{1,2})(?:\s?(?:sobre|/) ?15)?\b"
+    ), "num", (3, 15)),
+    (("afiliacion", "edad", "anios"), re.compile(
+        r"\b(?:" + _AGE_LEAD + r"\s(\d{1,3})\s(?:anos|ano)(?: de edad)?|(\d{1,3})\s(?:anos|ano) de edad)\b"
+    ), "int", (0, 120)),
+    (("afiliacion", "edad", "meses"), re.compile(
+        r"\b(?:" + _AGE_LEAD + r"\s(?:\d{1,3}\s(?:anos|ano)\sy\s)?(\d{1,2})\s(?:meses|mes)(?: de edad)?"
+        r"|(\d{1,2})\s(?:meses|mes) de edad)\b"
+    ), "int", (0, 24)),
+]
+
+# Palabras que pueden quedar sin afectar la cobertura (muletillas, conectores)
+_FILLER = frozenset((
+    "y", "e", "o", "con", "de", "del", "la", "el", "los", "las", "lo", "su", "sus", "un", "una",
+    "al", "a", "en", "es", "esta", "estan", "se", "le", "tiene", "presenta", "paciente",
+    "signos", "vitales", "vital", "funciones", "ok", "okey", "bien", "bueno", "entonces", "ya",
+    "eh", "em", "mm", "mmm", "este", "pues", "ahora", "hoy", "actual", "actualmente", "tomamos",
+    "toma", "medimos", "medida", "control", "controles", "encuentra", "anotar",
+    "anota", "registrar", "registra", "coloca", "pon", "poner", "por", "favor", "mas", "tambien",
+))
+_WORD_RE = re.compile(r"[a-z]+|\d+(?:\.\d+)?")
+
+
+def _convert(kind: str, groups: Tuple[Optional[str], ...]) -> Any:
+    vals = [g for g in groups if g is not None]
+    if kind == "pa":
+        return f"{int(vals[0])}/{int(vals[1])}"
+    if kind == "talla":
+        if len(vals) == 2:  # "mide uno setenta"
+            return 100 + int(vals[1])
+        v = float(vals[0])
+        return round(v * 100) if v < 3 else _num(v)  # metros → cm
+    if kind == "int":
+        return int(float(vals[0]))
+    return _num(float(vals[0]))
+
+
+def _num(v: float) -> Any:
+    return int(v) if v == int(v) else round(v, 1)
+
+
+def _in_range(kind: str, value: Any, lo: float, hi: float) -> bool:
+    if kind == "pa":
+        sys_, dia = map(int, value.split("/"))
+        return lo <= dia < sys_ <= hi
+    return lo <= value <= hi
+
+
+class VitalsResult:
+    """Resultado del pre-extractor.
+
+    Attributes:
+        delta: Cambios en el formato de deep_merge ({} si no hubo aciertos).
+        covered: True si el fragmento no tiene otra información (se puede omitir el LLM).
+        explanations: [{path, reason, evidence}] para attach_explanations.
+    """
+
+    __slots__ = ("delta", "covered", "explanations")
+
+    def __init__(self, delta: Dict[str, Any], covered: bool, explanations: List[Dict[str, str]]):
+        self.delta = delta
+        self.covered = covered
+        self.explanations = explanations
+
+    def __bool__(self) -> bool:
+        return bool(self.delta)
+
+
+def extract_vitals(fragment: str) -> VitalsResult:
+    """Extrae signos vitales / edad de un fragmento dictado."""
+    text = words_to_digits(re.sub(r"[;:!?¡¿()\"]|[.,](?!\d)", " ", normalize_text(fragment)))
+    text = re.sub(r"\s+", " ", text).strip()
+
+    delta: Dict[str, Any] = {}
+    explanations: List[Dict[str, str]] = []
+    spans: List[Tuple[int, int]] = []
+    for path, pattern, kind, (lo, hi) in _RULES:
+        for m in pattern.finditer(text):
+            try:
+                value = _convert(kind, m.groups())
+            except (ValueError, IndexError):
+                continue
+            if not _in_range(kind, value, lo, hi):
+                continue
+            node = delta
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+            spans.append(m.span())
+            explanations.append({
+                "path": ".".join(path),
+                "reason": "Valor dictado explícitamente (extracción local).",
+                "evidence": m.group(0),
+            })
+            break  # un valor por campo (el primero mencionado)
+
+    # Las reglas de edad se solapan ("paciente de 2 años y 3 meses"): se unen los tramos
+    merged: List[List[int]] = []
+    for start, end in sorted(spans):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    residual = text
+    for start, end in reversed(merged):
+        residual = residual[:start] + " " + residual[end:]
+    covered = bool(delta) and all(w in _FILLER for w in _WORD_RE.findall(residual))
+    return VitalsResult(delta, covered, explanations)
+
+
+class VitalsStats:
+    """Tasa de aciertos del pre-extractor (para /metrics)."""
+
+    def __init__(self):
+        self.fragments = 0
+        self.hits = 0          # fragmentos con al menos un campo extraído
+        self.covered = 0       # fragmentos resueltos sin LLM
+        self.fields: Dict[str, int] = {}
+
+    def record(self, result: VitalsResult) -> None:
+        self.fragments += 1
+        if result:
+            self.hits += 1
+            for e in result.explanations:
+                self.fields[e["path"]] = self.fields.get(e["path"], 0) + 1
+        if result.covered:
+            self.covered += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        n = self.fragments or 1
+        return {
+            "fragments": self.fragments,
+            "hits": self.hits,
+            "covered": self.covered,
+            "hit_rate": round(self.hits / n, 3),
+            "llm_skip_rate": round(self.covered / n, 3),
+            "fields": dict(self.fields),
+        }
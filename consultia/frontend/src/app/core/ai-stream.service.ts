@@ -2,6 +2,7 @@ import { Injectable, Inject, PLATFORM_ID } from '@angular/core';
 import { isPlatformBrowser } from '@angular/common';
 import { BehaviorSubject } from 'rxjs';
 import { environment } from '../../environments/environment';
+import { applyPatch, PatchOp } from './json-patch';
 
 /** Alineado con el schema de Historia Clínica del backend */
 export interface HistoriaClinica {
@@ -68,6 +69,8 @@ export class AiStreamService {
   // Observables públicos
   readonly aiText$ = new BehaviorSubject<string>('');
   readonly form$ = new BehaviorSubject<HistoriaClinica|null>(null);
+  /** Solo las secciones de primer nivel que cambiaron (el snapshot completo al conectar) */
+  readonly formChanges$ = new BehaviorSubject<HistoriaClinica|null>(null);
 
   readonly status$ = new BehaviorSubject<AiWsStatus>('idle');
   readonly deltas$    = new BehaviorSubject<FormDelta[]>([]);
@@ -76,11 +79,16 @@ export class AiStreamService {
     // --- NUEVO: progreso, faltantes y sugerencias coherentes ---
   readonly progress$     = new BehaviorSubject<{ done: number; total: number }>({ done: 0, total: 0 });
   readonly missing$      = new BehaviorSubject<string[]>([]);
+  /** % de requeridos completos por sección (form_update "completeness") */
+  readonly completeness$ = new BehaviorSubject<Record<string, number>>({});
   readonly suggestions$  = new BehaviorSubject<string[]>([]);
   // Reconexión
   private reconnectAttempts = 0;
   private maxBackoffMs = 5000;
   private sessionId = '';
+  // Revisión del formulario recibida (form_update con "rev"); -1 = sin snapshot
+  private formRev = -1;
+  private resyncPending = false;
   private REQUIRED_PATHS = [
     'afiliacion.motivoConsulta',
     'anamnesis.sintomasPrincipales',
@@ -165,6 +173,9 @@ export class AiStreamService {
       (this as any)._dbg = { ws: this.ws, sendFinal: (t: string)=> this.sendFinal(t), sendPartial: (t:string)=> this.sendPartial(t) };
       (window as any).__ai = (this as any)._dbg;
       this.ws.onopen = () => {
+        // El servidor manda un snapshot al conectar
+        this.formRev = -1;
+        this.resyncPending = false;
         this.status$.next('open');
         this.reconnectAttempts = 0;
         console.log('[AI WS] conectado');
@@ -199,8 +210,13 @@ export class AiStreamService {
               this.aiText$.next(this.aiText$.value + (msg.delta || ''));
               break;
             case 'form_update':
-              this.form$.next(msg.form || null);
+              if (!this.applyFormUpdate(msg)) break;
               this.missing$.next(msg.missing || []);
+              if (msg.completeness) this.completeness$.next(msg.completeness);
+              // En modo chain las sugerencias llegan aparte (suggestions_update)
+              if ('suggestions' in msg) this.suggestions$.next(msg.suggestions || []);
+              break;
+            case 'suggestions_update':
               this.suggestions$.next(msg.suggestions || []);
               break;
             case 'error':
@@ -244,6 +260,48 @@ export class AiStreamService {
 
   // ----------------- Privados -----------------
 
+  /**
+   * Snapshot ({rev, form}) o patch RFC 6902 ({rev, patch}) contra la revisión anterior.
+   * Ante un salto de revisión o un patch que no aplica pide "resync" y descarta el mensaje.
+   */
+  private applyFormUpdate(msg: any): boolean {
+    if (msg.form !== undefined) {
+      this.formRev = typeof msg.rev === 'number' ? msg.rev : -1;
+      this.resyncPending = false;
+      this.form$.next(msg.form || null);
+      this.formChanges$.next(msg.form || null);
+      return true;
+    }
+    if (!Array.isArray(msg.patch)) return false;
+    if (msg.rev <= this.formRev) return false;  // ya incluido en un snapshot más nuevo
+    const current = this.form$.value;
+    if (msg.rev !== this.formRev + 1 || !current) {
+      this.requestResync();
+      return false;
+    }
+    try {
+      const { doc, touched } = applyPatch(current, msg.patch as PatchOp[]);
+      this.formRev = msg.rev;
+      this.form$.next(doc);
+      if (touched.size) {
+        const changed: any = {};
+        touched.forEach(k => (changed[k] = (doc as any)[k]));
+        this.formChanges$.next(changed);
+      }
+      return true;
+    } catch (e) {
+      console.warn('[AI WS] patch no aplicable, pidiendo snapshot', e);
+      this.requestResync();
+      return false;
+    }
+  }
+
+  private requestResync() {
+    if (this.resyncPending || !this.canSend()) return;
+    this.resyncPending = true;
+    this.ws!.send(JSON.stringify({ type: 'resync', rev: this.formRev }));
+  }
+
   private canSend(): boolean {
     return !!(this.ws && this.ws.readyState === WebSocket.OPEN);
   }
@@ -0,0 +1,58 @@
+/** Operación RFC 6902 (solo las que envía el backend: add / replace / remove) */
+export type PatchOp =
+  | { op: 'add' | 'replace'; path: string; value: any }
+  | { op: 'remove'; path: string };
+
+/** "/a/b~1c" → ["a", "b/c"] (RFC 6901) */
+export function parsePointer(pointer: string): string[] {
+  if (pointer === '') return [];
+  if (pointer[0] !== '/') throw new Error(`JSON Pointer inválido: ${pointer}`);
+  return pointer.slice(1).split('/').map(t => t.replace(/~1/g, '/').replace(/~0/g, '~'));
+}
+
+function cloneShallow(node: any): any {
+  return Array.isArray(node) ? node.slice() : { ...node };
+}
+
+/**
+ * Aplica un patch sin mutar `doc`: copia solo los nodos en el camino de cada op
+ * (el resto se comparte). Devuelve el documento nuevo y las secciones de primer
+ * nivel tocadas, para que la UI re-renderice solo esas.
+ * Lanza Error si una ruta no existe (el llamador pide un snapshot).
+ */
+export function applyPatch<T extends object>(doc: T, ops: PatchOp[]): { doc: T; touched: Set<string> } {
+  const root: any = cloneShallow(doc);
+  const copied = new Set<any>([root]);
+  const touched = new Set<string>();
+
+  for (const op of ops) {
+    const parts = parsePointer(op.path);
+    if (!parts.length) throw new Error('No se admite reemplazar la raíz');
+    touched.add(parts[0]);
+
+    let parent = root;
+    for (const key of parts.slice(0, -1)) {
+      const child = parent?.[key];
+      if (child === null || typeof child !== 'object') throw new Error(`Ruta inexistente: ${op.path}`);
+      if (!copied.has(child)) {
+        parent[key] = cloneShallow(child);
+        copied.add(parent[key]);
+      }
+      parent = parent[key];
+    }
+
+    const last = parts[parts.length - 1];
+    if (Array.isArray(parent)) {
+      const index = last === '-' ? parent.length : Number(last);
+      if (!Number.isInteger(index) || index < 0 || index > parent.length) throw new Error(`Índice inválido: ${op.path}`);
+      if (op.op === 'add') parent.splice(index, 0, op.value);
+      else if (op.op === 'replace') parent[index] = op.value;
+      else parent.splice(index, 1);
+    } else {
+      if (op.op !== 'add' && !(last in parent)) throw new Error(`Ruta inexistente: ${op.path}`);
+      if (op.op === 'remove') delete parent[last];
+      else parent[last] = op.value;
+    }
+  }
+  return { doc: root, touched };
+}
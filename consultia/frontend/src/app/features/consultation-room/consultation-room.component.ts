@@ -163,7 +163,8 @@ export class ConsultationRoomComponent implements OnInit, OnDestroy {
         this.ai.aiText$.subscribe(t => (this.assistantLive = t || '')),
         this.ai.missing$.subscribe(m => (this.missing = m || [])),
         this.ai.suggestions$.subscribe(s => (this.suggestions = s || [])),
-        this.ai.form$.subscribe(json => { if (json) this.patchFormFromAI(json); this.ai.evaluate(this.hcForm.getRawValue());}),
+        // Solo las secciones que cambiaron en el último patch (o todo, en un snapshot)
+        this.ai.formChanges$.subscribe(json => { if (json) this.patchFormFromAI(json); this.ai.evaluate(this.hcForm.getRawValue());}),
         this.ai.deltas$.subscribe(changes => {
           (changes || []).forEach(ch => {
             const { title, icon } = this.mapPathToTitle(ch.path);
@@ -715,43 +716,73 @@ export class ConsultationRoomComponent implements OnInit, OnDestroy {
     const formData = new FormData();
     formData.append('file', file);
 
-    // Enviar al backend
-    const apiUrl = `${environment.apiBase}/extract-document`;
+    // Enviar al backend (NDJSON: un evento por página y uno final con todo mezclado)
+    const apiUrl = `${environment.apiBase}/extract-document?stream=1`;
 
-    this.http.post<any>(apiUrl, formData).subscribe({
-      next: (response) => {
+    this.streamDocumentExtraction(apiUrl, formData)
+      .catch((error) => {
+        console.error('[UPLOAD] Error:', error);
+        alert('Error al procesar el documento. ' + (error?.message || ''));
+      })
+      .finally(() => {
         this.uploading = false;
+      });
+  }
 
-        if (response.success && response.data) {
-          console.log('[UPLOAD] Datos extraídos:', response.data);
+  private async streamDocumentExtraction(apiUrl: string, formData: FormData): Promise<void> {
+    const response = await fetch(apiUrl, { method: 'POST', body: formData });
+    if (!response.ok || !response.body) {
+      let detail = `HTTP ${response.status}`;
+      try {
+        const body = await response.json();
+        if (body?.error) detail = body.error;
+      } catch { /* respuesta sin JSON */ }
+      throw new Error(detail);
+    }
 
-          // Aplicar datos al formulario
-          this.applyExtractedData(response.data);
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+      const { done, value } = await reader.read();
+      if (value) buffer += decoder.decode(value, { stream: !done });
+      let newline: number;
+      while ((newline = buffer.indexOf('\n')) >= 0) {
+        const line = buffer.slice(0, newline).trim();
+        buffer = buffer.slice(newline + 1);
+        if (line) this.handleDocumentEvent(JSON.parse(line));
+      }
+      if (done) break;
+    }
+  }
 
-          // Guardar datos extraídos para mostrar en la tab Firma
-          this.extractedDataPreview = JSON.stringify(response.data, null, 2);
+  private handleDocumentEvent(msg: any): void {
+    switch (msg.type) {
+      case 'page':
+        // Llenado progresivo: cada página se aplica apenas llega
+        console.log(`[UPLOAD] Página ${msg.page}/${msg.pages}:`, msg.data);
+        this.patchFormFromAI(msg.data);
+        break;
 
-          // Cambiar a la tab Firma para ver los datos
-          this.activeTab = 'firma';
-        } else {
-          console.error('[UPLOAD] Error en respuesta:', response);
-          alert('Error al procesar el documento: ' + (response.error || 'Error desconocido'));
-        }
-      },
-      error: (error) => {
-        this.uploading = false;
-        console.error('[UPLOAD] Error:', error);
+      case 'done':
+        console.log('[UPLOAD] Datos extraídos:', msg.data);
 
-        let errorMsg = 'Error al procesar el documento.';
-        if (error.error?.error) {
-          errorMsg += ' ' + error.error.error;
-        } else if (error.message) {
-          errorMsg += ' ' + error.message;
-        }
+        // Aplicar datos al formulario (el resultado final ya mezcla todas las páginas)
+        this.applyExtractedData(msg.data);
 
-        alert(errorMsg);
-      }
-    });
+        // Guardar datos extraídos para mostrar en la tab Firma
+        this.extractedDataPreview = JSON.stringify(msg.data, null, 2);
+
+        // Cambiar a la tab Firma para ver los datos
+        this.activeTab = 'firma';
+        break;
+
+      case 'error':
+        console.error('[UPLOAD] Error en respuesta:', msg);
+        alert('Error al procesar el documento: ' + (msg.error || 'Error desconocido'));
+        break;
+    }
   }
 
   private applyExtractedData(data: any): void {